@@ -125,7 +125,10 @@ def do_setup(with_c_extension):
             "Topic :: Internet :: WWW/HTTP :: Dynamic Content",
             "Topic :: Text Processing :: Markup :: HTML",
         ],
-        scripts=["bin/tonnikala-compile-jstemplate"],
+        scripts=[
+            "bin/tonnikala-compile-jstemplate",
+            "bin/tonnikala-extract-messages",
+        ],
         install_requires=install_requires,
         extras_require=extras_require,
         setup_requires=[],
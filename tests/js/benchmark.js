@@ -0,0 +1,70 @@
+// Micro-benchmark of the JavaScript runtime: renders a long list the way
+// the compiled templates do.
+//
+// Usage: node tests/js/benchmark.js [path/to/runtime.js]
+
+var path = require('path');
+
+var runtimePath = process.argv[2] ||
+    path.join(__dirname, '..', '..', 'tonnikala', 'runtime', 'javascript.js');
+
+var runtime;
+global.define = function (requires, func) {
+    runtime = func();
+};
+require(path.resolve(runtimePath));
+
+// the equivalent of a compiled
+// <ul><li py:for="row in rows" class="$row.cls">${row.name} - ${row.id}</li></ul>
+var escape = runtime.escapeString || runtime.escape;
+
+function renderList(rows) {
+    var output = runtime.Buffer();
+    output('<ul>');
+    rows.forEach(function (row) {
+        output('<li');
+        output.attr('class', row.cls);
+        output('>');
+        output(escape(row.name));
+        output(' - ');
+        output(escape(row.id));
+        output('</li>');
+    });
+    output('</ul>');
+    return output.toString();
+}
+
+var rows = [], i;
+for (i = 0; i < 1000; i++) {
+    rows.push({
+        id: i,
+        cls: i % 2 ? 'odd' : 'even',
+        name: i % 10 ? 'Item number ' + i : 'Tom & <Jerry> "' + i + '"'
+    });
+}
+
+function bench(name, func, iterations) {
+    var start, elapsed, n;
+
+    // warm up the JIT
+    for (n = 0; n < iterations / 10; n++) {
+        func();
+    }
+
+    start = process.hrtime();
+    for (n = 0; n < iterations; n++) {
+        func();
+    }
+    elapsed = process.hrtime(start);
+
+    console.log(name + ': ' +
+        ((elapsed[0] * 1e3 + elapsed[1] / 1e6) / iterations).toFixed(4) +
+        ' ms per call');
+}
+
+bench('render 1000 rows', function () { renderList(rows); }, 500);
+bench('escape', function () {
+    for (var j = 0; j < rows.length; j++) {
+        runtime.escape(rows[j].name);
+    }
+}, 500);
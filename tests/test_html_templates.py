@@ -1,17 +1,30 @@
 import unittest
 
 import codecs
+import gettext
+import hashlib
+import io
 import os.path
+import shutil
+import sys
+import tempfile
+import time
+import traceback
 from collections import OrderedDict
+from types import MappingProxyType, SimpleNamespace
+from unittest.mock import ANY
 
 
+from tonnikala import lazy
 from tonnikala.loader import FileLoader
 from tonnikala.runtime import python
-from tonnikala.runtime.exceptions import TemplateSyntaxError
+from tonnikala.runtime.exceptions import RenderLimitError, TemplateSyntaxError
 
 
-def render(template, debug=False, translatable=False, **args):
-    compiled = FileLoader(debug=debug, translatable=translatable).load_string(template)
+def render(template, debug=False, translatable=False, minify=False, **args):
+    compiled = FileLoader(
+        debug=debug, translatable=translatable, minify=minify
+    ).load_string(template)
     return str(compiled.render(args))
 
 
@@ -32,6 +45,11 @@ def get_reference_output(name):
         return f.read()
 
 
+class UpperTranslations(gettext.NullTranslations):
+    def gettext(self, message):
+        return '<"%s&>' % message.upper()
+
+
 class TestHtmlTemplates(unittest.TestCase):
     def are(self, result, template, **args):
         """assert rendered equals"""
@@ -148,6 +166,74 @@ class TestHtmlTemplates(unittest.TestCase):
         fragment = '<html><div py:for="i in values">${i}</div></html>'
         self.are("<html><div>0</div><div>1</div></html>", fragment, values=range(2))
 
+    def test_simple_for_body(self):
+        class Item(object):
+            def __init__(self, name):
+                self.name = name
+                self.data = {"key": name.upper()}
+
+        items = [Item("a<"), Item("b")]
+        fragment = (
+            '<ul><li py:for="x in items" id="${x.data[\'key\']}">$x.name</li></ul>'
+        )
+        self.are(
+            '<ul><li id="A&lt;">a&lt;</li><li id="B">b</li></ul>', fragment, items=items
+        )
+
+        fragment = '<ul><li py:for="x in items">${x[0]}${x[1]}</li></ul>'
+        self.are(
+            "<ul><li>ab</li><li>cd</li></ul>", fragment, items=[("a", "b"), ["c", "d"]]
+        )
+
+        # the loop variable is still bound after the loop
+        fragment = '<html><py:for each="x in items">$x</py:for>-$x</html>'
+        self.are("<html>12-2</html>", fragment, items=[1, 2])
+
+        fragment = '<html><py:for each="x in items">$x.missing</py:for></html>'
+        self.assert_render_throws(AttributeError, fragment, items=[1])
+
+    def test_safe_values(self):
+        fragment = (
+            '<ul><py:def function="item(x)"><li>$x</li></py:def>'
+            '<py:for each="i in range(2)">${item(i * 2)}${len(v)}${"<"}${1.5}'
+            "</py:for></ul>"
+        )
+        self.are("<ul><li>0</li>1&lt;1.5<li>2</li>1&lt;1.5</ul>", fragment, v=["<"])
+
+        # the loop variable is not known to be a number if rebound
+        fragment = (
+            '<html><py:for each="i in range(1)">${i + 1}'
+            '<py:for each="i in v">${i}</py:for></py:for></html>'
+        )
+        self.are("<html>1&lt;</html>", fragment, v=["<"])
+
+        fragment = (
+            '<html><py:for each="i in range(1)">'
+            '<py:with vars="i = v">${i * 2}</py:with></py:for></html>'
+        )
+        self.are("<html>&lt;&lt;</html>", fragment, v="<")
+
+        # a def replaced through the context is escaped
+        fragment = '<html><py:def function="foo()">foo</py:def>${foo()}</html>'
+        self.are("<html>&lt;</html>", fragment, foo=lambda: "<")
+
+        # the builtins can be replaced through the context
+        fragment = "<html>${len(v)}${int(v)}</html>"
+        self.are(
+            "<html>&lt;a&gt;&lt;b&gt;</html>",
+            fragment,
+            v="",
+            len=lambda v: "<a>",
+            int=lambda v: "<b>",
+        )
+
+        fragment = '<html><py:for each="i in range(1)">$i$v</py:for></html>'
+        self.are("<html>&lt;a&gt;b</html>", fragment, v="b", range=lambda n: ["<a>"])
+
+        # blocks replaced through the context are output as they are
+        fragment = '<html><p><py:block name="b">x</py:block></p></html>'
+        self.are("<html><p><script></p></html>", fragment, b=lambda: "<script>")
+
     def test_def(self):
         fragment = (
             '<html><py:def function="foo(bar)">bar: ${bar}</py:def>'
@@ -204,6 +290,31 @@ class TestHtmlTemplates(unittest.TestCase):
         fragment = "<html><!--! some comment here, stripped --></html>"
         self.are("<html></html>", fragment)
 
+    def test_minify(self):
+        fragment = (
+            '<html>\n  <!-- a comment -->\n  <body class="a  b">\n'
+            "    <p>\n      Hello,\t${'big   ' + name}\n    </p>\n"
+            "    <pre>  keep\n   this  </pre>\n"
+            "    <textarea>\n  and this</textarea>\n"
+            "    <script>  if (a  &&  b) {}</script>\n"
+            "    <style>  a  { }</style>\n"
+            "    <p>&nbsp; &nbsp;</p>\n"
+            "  </body>\n</html>"
+        )
+        self.are(
+            '<html> <body class="a  b"> <p> Hello, big   world </p> '
+            "<pre>  keep\n   this  </pre> <textarea>\n  and this</textarea> "
+            "<script>  if (a  &&  b) {}</script> <style>  a  { }</style> "
+            "<p>\xa0 \xa0</p> </body> </html>",
+            fragment,
+            minify=True,
+            name="world",
+        )
+
+    def test_minify_keeps_conditional_comments(self):
+        fragment = "<html><!--[if IE]>ie<![endif]--><!-- gone --></html>"
+        self.are("<html><!--[if IE]>ie<![endif]--></html>", fragment, minify=True)
+
     def test_replace(self):
         fragment = '<html><div py:replace="foo">bar</div></html>'
         self.are("<html>baz</html>", fragment, foo="baz")
@@ -326,6 +437,63 @@ class TestHtmlTemplates(unittest.TestCase):
             gettext=gettext,
         )
 
+    def test_translations_inlined_per_locale(self):
+        fragment = '<html alt="foo"> abc <script>abc</script></html>'
+        loader = FileLoader(
+            translations={"xx": UpperTranslations(), "yy": gettext.NullTranslations()}
+        )
+
+        template = loader.load_string(fragment, locale="xx")
+        self.assertEqual(
+            template.render({}),
+            '<html alt="&lt;&#34;FOO&amp;&gt;"> &lt;&#34;ABC&amp;&gt; '
+            "<script>abc</script></html>",
+        )
+
+        # translated at compile time; the gettext of the context is not used
+        self.assertNotIn("gettext", template.binder_func.__code__.co_names)
+        self.assertEqual(
+            template.render({"gettext": str.lower}),
+            '<html alt="&lt;&#34;FOO&amp;&gt;"> &lt;&#34;ABC&amp;&gt; '
+            "<script>abc</script></html>",
+        )
+
+        template = loader.load_string(fragment, locale="yy")
+        self.assertEqual(
+            template.render({}), '<html alt="foo"> abc <script>abc</script></html>'
+        )
+
+        with self.assertRaises(ValueError):
+            loader.load_string(fragment, locale="zz")
+
+    def test_file_loader_caches_per_locale(self):
+        loader = get_loader()
+        loader.translations = {"xx": UpperTranslations()}
+
+        translated = loader.load("child.tk", locale="xx")
+        untranslated = loader.load("child.tk")
+        self.assertIsNot(translated, untranslated)
+        self.assertIs(loader.load("child.tk", locale="xx"), translated)
+
+        # the parent template is loaded for the same locale
+        self.assertIn(("base.tk", "xx"), loader.cache)
+        self.assertEqual(
+            translated.render({"title": "x"}),
+            "<html>\n<title>&lt;&#34;BUT I AM&amp;&gt; x &lt;&#34;INSTEAD&amp;&gt;"
+            "</title>\n<h1>&lt;&#34;BUT I AM&amp;&gt; x &lt;&#34;INSTEAD&amp;&gt;"
+            "</h1>\n</html>",
+        )
+
+        # the same as translating at render time
+        loader = get_loader()
+        loader.translatable = True
+        self.assertEqual(
+            loader.load("child.tk").render(
+                {"title": "x", "gettext": UpperTranslations().gettext}
+            ),
+            translated.render({"title": "x"}),
+        )
+
     def test_cdata_elements_not_translated(self):
         fragment = "<html>a<script>a</script>a<style>a</style>a</html>"
         # fragment = '<html><script>a</script><style>a</style>a</html>'
@@ -362,6 +530,34 @@ class TestHtmlTemplates(unittest.TestCase):
         attrs = None
         self.are("<html><div></div></html>", fragment, debug=False, foo=attrs)
 
+        attrs = {"a": True, "b": False, "c": None, "d": "<&>", "e": 1.5}
+        self.are(
+            '<html><div a="a" d="&lt;&amp;&gt;" e="1.5"></div></html>',
+            fragment,
+            debug=False,
+            foo=attrs,
+        )
+
+        attrs = MappingProxyType({"foo": '"'})
+        self.are('<html><div foo="&#34;"></div></html>', fragment, foo=attrs)
+
+        attrs = iter([["foo", "bar"]])
+        self.are('<html><div foo="bar"></div></html>', fragment, foo=attrs)
+
+        with self.assertRaises(ValueError):
+            render(fragment, foo=[("foo", "bar", "baz")])
+
+    def test_attrs_with_other_attributes(self):
+        fragment = (
+            '<html><input type="checkbox" py:attrs="foo" checked="$checked"/></html>'
+        )
+        self.are(
+            '<html><input type="checkbox" checked="checked" name="x" /></html>',
+            fragment,
+            foo={"name": "x"},
+            checked=True,
+        )
+
     def test_empty_attribute(self):
         self.are("<html foobar></html>", "<html foobar></html>", debug=False)
 
@@ -384,9 +580,542 @@ class TestHtmlTemplates(unittest.TestCase):
         reference = get_reference_output(output_file)
         self.assertEqual(str(output), reference.rstrip("\n"))
 
+    def test_max_output_size(self):
+        source = (
+            '<ul><py:def function="item(x)"><li>$x</li></py:def>'
+            '<py:for each="i in items">${item(i)}</py:for></ul>'
+        )
+        template = FileLoader(max_output_size=50).load_string(source)
+        self.assertEqual(
+            str(template.render({"items": "ab"})), "<ul><li>a</li><li>b</li></ul>"
+        )
+        with self.assertRaises(RenderLimitError):
+            template.render({"items": "abcdefgh"})
+
+        # a single def that outputs too much
+        with self.assertRaises(RenderLimitError):
+            template.render({"items": ["x" * 100]})
+
+    def test_render_timeout(self):
+        def items():
+            while True:
+                yield time.sleep(0.001)
+
+        source = '<ul><li py:for="i in items">$i</li></ul>'
+        template = FileLoader(render_timeout=0.1).load_string(source)
+        self.assertEqual(str(template.render({"items": [1]})), "<ul><li>1</li></ul>")
+        with self.assertRaises(RenderLimitError):
+            template.render({"items": items()})
+
     def test_file_loader(self):
         self.assert_file_rendering_equals("simple.tk", "simple.tk", foo="bar")
 
+    def test_render_iter(self):
+        template = FileLoader().load_string('<ul><li py:for="i in l">$i</li></ul>')
+        chunks = list(template.render_iter({"l": range(100)}, chunk_size=64))
+        self.assertEqual("".join(chunks), template.render({"l": range(100)}))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 64)
+
+    def test_lazy_values(self):
+        calls = []
+
+        def compute(value):
+            def func():
+                calls.append(value)
+                return value
+
+            return lazy(func)
+
+        source = (
+            '<div><py:def function="show(n)">$n $x</py:def>'
+            '<p py:if="flag">$x ${x.upper()} ${show(y)}</p>'
+            '<p py:for="z in zs">$z</p></div>'
+        )
+        template = FileLoader(lazy_values=True).load_string(source)
+
+        context = {"flag": True, "x": compute("a<"), "y": compute(1), "zs": [1]}
+        self.assertEqual(
+            str(template.render(context)),
+            "<div><p>a&lt; A&lt; 1 a&lt;</p><p>1</p></div>",
+        )
+        self.assertEqual(calls, ["a<", 1])
+
+        # the values on the branches that are not rendered are not computed
+        del calls[:]
+        context = {"flag": False, "x": compute("b"), "y": compute(2), "z": compute(3)}
+        context["zs"] = []
+        self.assertEqual(str(template.render(context)), "<div></div>")
+        self.assertEqual(calls, [])
+
+        # the values are computed once per render, also if read by the
+        # templates that the template imports or includes at render time
+        directory = self.write_templates(
+            {
+                "page.tk": '<div><py:import href="macros.tk" alias="m"/>'
+                '$x ${m.show()}<py:include href="${name}"/></div>',
+                "macros.tk": '<py:def function="show()">$x</py:def>',
+                "part.tk": '<p><py:def function="unused()"/>$x</p>',
+            }
+        )
+        template = FileLoader(paths=[directory], lazy_values=True).load("page.tk")
+        context = {"x": compute("c"), "name": "part.tk"}
+        for i in range(2):
+            self.assertEqual(str(template.render(context)), "<div>c c<p>c</p></div>")
+
+        self.assertEqual(calls, ["c", "c"])
+
+        # by default the lazy values are not resolved
+        del calls[:]
+        template = FileLoader().load_string("<p>$x</p>")
+        output = str(template.render({"x": compute("c")}))
+        self.assertTrue(output.startswith("<p>&lt;lazy "))
+        self.assertEqual(calls, [])
+
+    def test_free_variables(self):
+        template = FileLoader().load_string(
+            '<div py:for="i in range(n)">$i ${x.y} ${f"{z}"}</div>'
+        )
+        self.assertEqual(template.free_variables, {"range", "n", "x", "z"})
+
+        loader = get_loader()
+        self.assertEqual(loader.load("child.tk").free_variables, {"title"})
+        self.assertEqual(loader.load("importing.tk").free_variables, {"foo"})
+
+    def render_traceback(self, template, context):
+        try:
+            template.render(context)
+        except Exception:
+            return traceback.extract_tb(sys.exc_info()[2])
+
+        self.fail("rendering did not raise")  # pragma: no cover
+
+    def test_translated_traceback(self):
+        from tonnikala.runtime.debug import get_fake_code
+
+        template = FileLoader().load_string(
+            '<div>\n<p py:block="x">${1 // zero}</p>\n</div>', filename="t.tk"
+        )
+        for i in range(2):
+            frames = self.render_traceback(template, {"zero": 0})
+            self.assertEqual(
+                (frames[-1].filename, frames[-1].lineno, frames[-1].name),
+                ("t.tk", 2, 'block "x"'),
+            )
+
+        # the fake code objects are reused
+        hits = get_fake_code.cache_info().hits
+        with self.assertRaises(ZeroDivisionError):
+            template.render({"zero": 0})
+        self.assertEqual(get_fake_code.cache_info().hits, hits + 2)
+
+    def test_annotated_exception(self):
+        template = FileLoader(translate_tracebacks=False).load_string(
+            '<div>\n<p py:block="x">${1 // zero}</p>\n</div>', filename="t.tk"
+        )
+        try:
+            template.render({"zero": 0})
+        except ZeroDivisionError as e:
+            exception = e
+        else:  # pragma: no cover
+            self.fail("ZeroDivisionError not raised")
+
+        self.assertEqual(
+            exception.template_locations,
+            [("t.tk", 2, "top-level template code"), ("t.tk", 2, 'block "x"')],
+        )
+
+        # the traceback is not rewritten
+        frames = traceback.extract_tb(exception.__traceback__)
+        self.assertEqual(frames[-1].name, "__TK__block__x")
+
+    def test_render_to(self):
+        template = FileLoader().load_string('<ul><li py:for="i in l">$i</li></ul>')
+        output = io.StringIO()
+        template.render_to(output, {"l": range(10)})
+        self.assertEqual(output.getvalue(), template.render({"l": range(10)}))
+
+        class Writer(object):
+            def __init__(self):
+                self.parts = []
+
+            def write(self, part):
+                self.parts.append(part)
+
+        writer = Writer()
+        template.render_to(writer, {"l": range(10)})
+        self.assertEqual("".join(writer.parts), template.render({"l": range(10)}))
+        self.assertGreater(len(writer.parts), 1)
+
+    def test_render_with_digest(self):
+        template = FileLoader().load_string("<p>$x</p>")
+        body, digest = template.render_with_digest({"x": "\u00e4<"})
+        self.assertEqual(body, "<p>\u00e4&lt;</p>".encode("UTF-8"))
+        self.assertEqual(digest, hashlib.blake2b(body, digest_size=16).hexdigest())
+
+        body, digest = template.render_with_digest(
+            {"x": "y"}, encoding="latin-1", digest=hashlib.sha256
+        )
+        self.assertEqual(body, b"<p>y</p>")
+        self.assertEqual(digest, hashlib.sha256(b"<p>y</p>").hexdigest())
+
+    def test_flatten_extends(self):
+        loader = get_loader()
+        loader.flatten_extends = True
+        template = loader.load("child.tk")
+        self.assertEqual(
+            str(template.render({"title": "the child"})),
+            get_reference_output("child.tk").rstrip("\n"),
+        )
+        self.assertEqual(
+            template.dependencies, {os.path.join(data_dir, "input", "base.tk"): ANY}
+        )
+        self.assertNotIn("base.tk", loader.cache)
+
+    def test_flatten_extends_chain(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        templates = {
+            "base.tk": '<html><py:def function="greet(x)">Hi $x</py:def>'
+            '<title py:block="title">Base</title>'
+            '<py:block name="body">${greet(name)}'
+            '<py:block name="footer">footer</py:block></py:block></html>',
+            "middle.tk": '<py:extends href="base.tk">'
+            '<py:block name="footer">middle ${greet("footer")}</py:block>'
+            "</py:extends>",
+            "leaf.tk": '<py:extends href="middle.tk">'
+            '<py:def function="greet(x)">Hello $x</py:def>'
+            '<py:block name="title">Leaf</py:block></py:extends>',
+        }
+        for name, source in templates.items():
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(source)
+
+        expected = FileLoader(paths=[directory]).load("leaf.tk").render({"name": "x"})
+        self.assertEqual(str(expected), "<html>LeafHello xmiddle Hello footer</html>")
+
+        loader = FileLoader(paths=[directory], flatten_extends=True)
+        loader.set_reload(True)
+        template = loader.load("leaf.tk")
+        self.assertEqual(str(template.render({"name": "x"})), str(expected))
+        self.assertEqual(len(template.dependencies), 2)
+
+        # changing the grandparent invalidates the flattened template
+        with open(os.path.join(directory, "base.tk"), "w") as f:
+            f.write('<html><py:block name="title">New</py:block></html>')
+
+        stat = os.stat(os.path.join(directory, "base.tk"))
+        os.utime(
+            os.path.join(directory, "base.tk"), (stat.st_atime, stat.st_mtime + 10)
+        )
+        loader._last_reload_check = 0
+        self.assertEqual(str(loader.load("leaf.tk").render({})), "<html>Leaf</html>")
+
+    def test_flatten_extends_import_clash(self):
+        directory = self.write_templates(
+            {
+                "a.tk": '<div><py:def function="x()">A</py:def></div>',
+                "b.tk": '<div><py:def function="x()">B</py:def></div>',
+                "base.tk": '<html><py:import href="a.tk" alias="m"/>'
+                '<p>${m.x()}</p><py:block name="body"/></html>',
+                "child.tk": '<py:extends href="base.tk">'
+                '<py:import href="b.tk" alias="m"/>'
+                '<py:block name="body">${m.x()}</py:block></py:extends>',
+                "child_def.tk": '<py:extends href="base.tk">'
+                '<py:def function="m()">D</py:def>'
+                '<py:block name="body">${m()}</py:block></py:extends>',
+            }
+        )
+
+        # the imports and defs replacing an import of the parent are not
+        # merged into it
+        loader = FileLoader(paths=[directory], flatten_extends=True)
+        template = loader.load("child.tk")
+        self.assertEqual(str(template.render({})), "<html><p>A</p>B</html>")
+        self.assertEqual(template.dependencies, {})
+
+        template = loader.load("child_def.tk")
+        self.assertEqual(template.dependencies, {})
+
+    def test_inline_defs(self):
+        directory = self.write_templates(
+            {
+                "macros.tk": "<div><py:def function=\"item(label, kind='default')\">"
+                "<li>$kind: $label</li></py:def></div>",
+                "page.tk": '<div><py:import href="macros.tk" alias="m"/>'
+                '<ul><py:for each="i in items">${m.item(i)}'
+                '${m.item(next(counter), kind="x")}</py:for></ul></div>',
+            }
+        )
+        context = {"items": ["<a>", "b"]}
+        expected = (
+            FileLoader(paths=[directory])
+            .load("page.tk")
+            .render(dict(context, counter=iter(range(10))))
+        )
+
+        template = FileLoader(paths=[directory], inline_defs=True).load("page.tk")
+        output = template.render(dict(context, counter=iter(range(10))))
+        self.assertEqual(str(output), str(expected))
+        self.assertEqual(
+            str(output),
+            "<div><ul><li>default: &lt;a&gt;</li><li>x: 0</li>"
+            "<li>default: b</li><li>x: 1</li></ul></div>",
+        )
+
+    def test_inline_defs_overridden(self):
+        # the top-level defs of the template are not inlined, as an
+        # extending template or the context can replace them
+        directory = self.write_templates(
+            {
+                "base.tk": '<div><py:def function="label(x)"><b>$x</b></py:def>'
+                '${label("a")}</div>',
+                "child.tk": '<py:extends href="base.tk">'
+                '<py:def function="label(x)"><i>$x</i></py:def></py:extends>',
+            }
+        )
+        for flatten_extends in (False, True):
+            loader = FileLoader(
+                paths=[directory], inline_defs=True, flatten_extends=flatten_extends
+            )
+            self.assertEqual(
+                str(loader.load("child.tk").render({})), "<div><i>a</i></div>"
+            )
+            self.assertEqual(
+                str(loader.load("base.tk").render({"label": str.upper})),
+                "<div>A</div>",
+            )
+
+    def test_inline_defs_shadowed(self):
+        directory = self.write_templates(
+            {
+                "macros.tk": '<div><py:def function="item(x)"><li>$x</li></py:def>'
+                "</div>",
+                "page.tk": '<div><py:import href="macros.tk" alias="m"/>'
+                '<ul><py:for each="m in others">${m.item(1)}</py:for></ul></div>',
+            }
+        )
+        template = FileLoader(paths=[directory], inline_defs=True).load("page.tk")
+        others = [SimpleNamespace(item=str)]
+        self.assertEqual(
+            str(template.render({"others": others})), "<div><ul>1</ul></div>"
+        )
+
+    def test_inline_imported_defs(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        templates = {
+            "macros.tk": '<div><py:def function="icon(name)"><i class="$name"/>'
+            '</py:def><py:def function="greet()">Hi $name</py:def></div>',
+            "page.tk": '<div><py:import href="macros.tk" alias="m"/>'
+            '<p py:for="i in items">${m.icon(i)}${m.greet()}</p></div>',
+        }
+        for name, source in templates.items():
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(source)
+
+        context = {"items": ["a", "b"], "name": "x"}
+        expected = FileLoader(paths=[directory]).load("page.tk").render(context)
+        template = FileLoader(paths=[directory], inline_defs=True).load("page.tk")
+        self.assertEqual(str(template.render(context)), str(expected))
+        self.assertEqual(
+            template.dependencies, {os.path.join(directory, "macros.tk"): ANY}
+        )
+
+    def write_templates(self, templates):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, source in templates.items():
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(source)
+
+        return directory
+
+    def test_include(self):
+        directory = self.write_templates(
+            {
+                "page.tk": '<ul><py:for each="i in items">'
+                '<py:include href="row.tk"/></py:for>'
+                '<py:include href="${kind}.tk"/></ul>',
+                "row.tk": "<li>$i ${label(i)}</li>",
+                "footer.tk": "<li>$kind</li>",
+            }
+        )
+
+        loader = FileLoader(paths=[directory])
+        loader.set_reload(True)
+        template = loader.load("page.tk")
+        context = {"items": ["a", "<b>"], "label": str.upper, "kind": "footer"}
+        self.assertEqual(
+            str(template.render(context)),
+            "<ul><li>a A</li><li>&lt;b&gt; &lt;B&gt;</li><li>footer</li></ul>",
+        )
+
+        # the literal include is spliced in, the dynamic one is not
+        self.assertEqual(
+            template.dependencies, {os.path.join(directory, "row.tk"): ANY}
+        )
+        self.assertIn("footer.tk", loader.cache)
+        self.assertNotIn("row.tk", loader.cache)
+
+        # changing the included template recompiles the including one
+        path = os.path.join(directory, "row.tk")
+        with open(path, "w") as f:
+            f.write("<li>$i</li>")
+
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        loader._last_reload_check = 0
+        self.assertEqual(
+            str(loader.load("page.tk").render(context)),
+            "<ul><li>a</li><li>&lt;b&gt;</li><li>footer</li></ul>",
+        )
+
+    def test_include_defining_names(self):
+        directory = self.write_templates(
+            {
+                "page.tk": '<div><py:def function="helper()">MINE</py:def>'
+                '<py:include href="a.tk"/><py:include href="b.tk"/></div>',
+                "a.tk": '<i><py:block name="bb">B</py:block></i>',
+                "b.tk": '<i><py:block name="bb">B2</py:block>'
+                '<py:def function="helper()"><b>H</b></py:def>${helper()}</i>',
+            }
+        )
+
+        # the templates defining names are included at render time
+        loader = FileLoader(paths=[directory])
+        template = loader.load("page.tk")
+        self.assertEqual(
+            str(template.render({})), "<div><i>B</i><i>B2<b>H</b></i></div>"
+        )
+        self.assertEqual(template.dependencies, {})
+
+        # they cannot read the local names of the including template
+        directory = self.write_templates(
+            {
+                "loop.tk": '<div><py:for each="i in items">'
+                '<py:include href="item.tk"/></py:for></div>',
+                "item.tk": '<span><py:def function="unused()"/>$i</span>',
+                "helper.tk": '<div><py:def function="helper()">MINE</py:def>'
+                '<py:include href="uses_helper.tk"/></div>',
+                "uses_helper.tk": '<span><py:def function="unused()"/>'
+                "${helper()}</span>",
+            }
+        )
+        loader = FileLoader(paths=[directory])
+        with self.assertRaises(TemplateSyntaxError) as cm:
+            loader.load("loop.tk")
+
+        self.assertIn("local names i ", cm.exception.message)
+        with self.assertRaises(TemplateSyntaxError):
+            loader.load("helper.tk")
+
+    def test_include_itself(self):
+        directory = self.write_templates(
+            {
+                "a.tk": '<div><py:include href="b.tk"/></div>',
+                "b.tk": '<div><py:include href="a.tk"/></div>',
+            }
+        )
+
+        with self.assertRaises(TemplateSyntaxError):
+            FileLoader(paths=[directory]).load("a.tk")
+
+    def test_merged_template_locations(self):
+        directory = self.write_templates(
+            {
+                "base.tk": '<html>\n<py:block name="b">x</py:block>\n'
+                "<p>${1 // zero}</p>\n</html>",
+                "child.tk": '<py:extends href="base.tk">\n'
+                '<py:block name="b"><py:include href="row.tk"/></py:block>\n'
+                "</py:extends>",
+                "row.tk": "<div>\n\n<i>${1 // one}</i>\n</div>",
+                "bad.tk": '<div>\n<py:include href="broken.tk"/>\n</div>',
+                "broken.tk": "<p>\n${a +}</p>",
+            }
+        )
+
+        # the errors are located in the files merged into the template
+        loader = FileLoader(paths=[directory], flatten_extends=True)
+        template = loader.load("child.tk")
+        base_path = os.path.join(directory, "base.tk")
+        row_path = os.path.join(directory, "row.tk")
+        self.assertEqual(len(template.dependencies), 2)
+
+        frames = self.render_traceback(template, {"zero": 0, "one": 1})
+        self.assertEqual((frames[-1].filename, frames[-1].lineno), (base_path, 3))
+        frames = self.render_traceback(template, {"zero": 1, "one": 0})
+        self.assertEqual((frames[-1].filename, frames[-1].lineno), (row_path, 3))
+
+        loader.translate_tracebacks = False
+        loader.cache.clear()
+        try:
+            loader.load("child.tk").render({"zero": 1, "one": 0})
+        except ZeroDivisionError as e:
+            self.assertEqual(e.template_locations[-1][:2], (row_path, 3))
+        else:  # pragma: no cover
+            self.fail("ZeroDivisionError not raised")
+
+        with self.assertRaises(TemplateSyntaxError) as cm:
+            loader.load("bad.tk")
+
+        self.assertEqual(cm.exception.filename, os.path.join(directory, "broken.tk"))
+        self.assertEqual(cm.exception.lineno, 2)
+        self.assertEqual(cm.exception.source, "<p>\n${a +}</p>")
+
+    def test_file_loader_preload(self):
+        loader = get_loader()
+        self.assertEqual(loader.find_templates("simple.*"), ["simple.tk"])
+
+        templates = loader.preload("*.tk", "simple.tk")
+        self.assertEqual(len(templates), 6)
+        self.assertIs(loader.load("child.tk"), loader.cache["child.tk"])
+        self.assertIn("base.tk", loader.cache)
+
+    def test_file_loader_caches_resolution(self):
+        loader = get_loader()
+        resolved = []
+
+        def resolve(name):
+            resolved.append(name)
+            return FileLoader.resolve(loader, name)
+
+        loader.resolve = resolve
+        for i in range(3):
+            with self.assertRaises(OSError):
+                loader.load("optional.tk")
+
+        self.assertEqual(resolved, ["optional.tk"])
+
+        # a new search path might contain the template
+        overrides = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, overrides)
+        loader.add_path(overrides)
+        with open(os.path.join(overrides, "optional.tk"), "w") as f:
+            f.write("<html>override</html>")
+
+        self.assertEqual(
+            str(loader.load("optional.tk").render({})), "<html>override</html>"
+        )
+        self.assertEqual(resolved, ["optional.tk"] * 2)
+
+    def test_resolution_cache_invalidated_on_reload(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        loader = FileLoader(paths=[directory])
+        loader.set_reload(True)
+
+        with self.assertRaises(OSError):
+            loader.load("added.tk")
+
+        with open(os.path.join(directory, "added.tk"), "w") as f:
+            f.write("<html>added</html>")
+
+        # the cache is checked at most every MIN_CHECK_INTERVAL
+        loader._last_reload_check = 0
+        self.assertEqual(str(loader.load("added.tk").render({})), "<html>added</html>")
+
     def test_extension(self):
         self.assert_file_rendering_equals("base.tk", "base.tk", title="the base")
         self.assert_file_rendering_equals("child.tk", "child.tk", title="the child")
@@ -0,0 +1,104 @@
+"Message extraction tests"
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from tonnikala.i18n import Options, TonnikalaExtractor, write_pot
+
+templates = {
+    "a.tk": '<html>\n<p>Hello</p>\n<p>${_("World")} $name</p>\n</html>',
+    "b.tk": '<html>\n<p title="Title">Body</p>\n</html>',
+    "c.tk": "<html>${gettext('Third')}</html>",
+}
+
+
+class CountingExtractor(TonnikalaExtractor):
+    parsed = 0
+
+    def extract(self, *a, **kw):
+        CountingExtractor.parsed += 1
+        return super(CountingExtractor, self).extract(*a, **kw)
+
+
+class TestExtraction(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, source in sorted(templates.items()):
+            filename = os.path.join(self.dir, name)
+            with open(filename, "w", encoding="UTF-8") as f:
+                f.write(source)
+
+            self.filenames.append(filename)
+
+        self.cache_dir = os.path.join(self.dir, "cache")
+        CountingExtractor.parsed = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def extract_sequentially(self, extractor):
+        messages = []
+        for filename in self.filenames:
+            messages.extend(extractor(filename, Options()))
+
+        return messages
+
+    def test_extract(self):
+        messages = self.extract_sequentially(TonnikalaExtractor())
+        self.assertEqual(
+            [m.msgid for m in messages], ["World", "Hello", "Body", "Title", "Third"]
+        )
+
+    def test_cache_skips_unchanged_files(self):
+        expected = self.extract_sequentially(TonnikalaExtractor())
+
+        extractor = CountingExtractor({"cache_dir": self.cache_dir})
+        self.assertEqual(self.extract_sequentially(extractor), expected)
+        self.assertEqual(CountingExtractor.parsed, 3)
+
+        self.assertEqual(self.extract_sequentially(extractor), expected)
+        self.assertEqual(CountingExtractor.parsed, 3)
+
+        with open(self.filenames[1], "w", encoding="UTF-8") as f:
+            f.write("<html>Changed</html>")
+
+        messages = self.extract_sequentially(extractor)
+        self.assertEqual(CountingExtractor.parsed, 4)
+        self.assertEqual([m.msgid for m in messages][2:], ["Changed", "Third"])
+
+    def test_extract_files_in_parallel(self):
+        expected = self.extract_sequentially(TonnikalaExtractor())
+
+        extractor = TonnikalaExtractor({"cache_dir": self.cache_dir})
+        messages = list(extractor.extract_files(self.filenames, Options(), 2))
+        self.assertEqual(messages, expected)
+
+        extractor = CountingExtractor({"cache_dir": self.cache_dir})
+        messages = list(extractor.extract_files(self.filenames, Options()))
+        self.assertEqual(messages, expected)
+        self.assertEqual(CountingExtractor.parsed, 0)
+
+        extractor = TonnikalaExtractor()
+        messages = list(extractor.extract_files(self.filenames, Options(), 1))
+        self.assertEqual(messages, expected)
+
+    def test_write_pot(self):
+        import polib
+
+        output = os.path.join(self.dir, "messages.pot")
+        count = write_pot([self.dir], output, Options(), processes=2)
+        catalog = polib.pofile(output)
+        self.assertEqual(count, 5)
+        self.assertEqual(
+            [(i.msgid, i.occurrences[0][0]) for i in catalog],
+            [
+                ("World", self.filenames[0]),
+                ("Hello", self.filenames[0]),
+                ("Body", self.filenames[1]),
+                ("Title", self.filenames[1]),
+                ("Third", self.filenames[2]),
+            ],
+        )
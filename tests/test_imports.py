@@ -0,0 +1,65 @@
+"Test the set of modules imported by the runtime-only import path"
+
+import subprocess
+import sys
+import unittest
+
+# modules that are needed only for compiling templates
+compile_time_modules = [
+    "tonnikala.ir",
+    "tonnikala.syntaxes",
+    "tonnikala.languages",
+    "tonnikala.runtime.debug",
+    "html.parser",
+    "xml.dom.minidom",
+    "slimit",
+    "ply",
+]
+
+
+def get_imported_modules(statement):
+    """
+    Run the statement in a fresh interpreter with ``-X importtime`` and
+    return the names of the modules imported by it.
+    """
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+
+    modules = []
+    for line in process.stderr.decode("UTF-8").splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        name = line.rsplit("|", 1)[-1].strip()
+        if name != "imported package":
+            modules.append(name)
+
+    return modules
+
+
+class TestImports(unittest.TestCase):
+    def assert_not_imported(self, statement):
+        modules = get_imported_modules(statement)
+        for module in modules:
+            for forbidden in compile_time_modules:
+                if module == forbidden or module.startswith(forbidden + "."):
+                    self.fail(
+                        "%r imported the compile-time module %r" % (statement, module)
+                    )
+
+    def test_loader_import_is_runtime_only(self):
+        self.assert_not_imported("import tonnikala.loader")
+
+    def test_runtime_import_is_runtime_only(self):
+        self.assert_not_imported("import tonnikala.runtime.python")
+
+    def test_compile_imports_pipeline_lazily(self):
+        modules = get_imported_modules(
+            "import tonnikala; tonnikala.Loader().load_string('<html></html>')"
+        )
+        self.assertIn("tonnikala.languages.python.generator", modules)
+        self.assertIn("tonnikala.syntaxes.tonnikala", modules)
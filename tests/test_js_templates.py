@@ -1,11 +1,15 @@
 import importlib.resources
 import json
 import os.path
+import shutil
 import subprocess
+import tempfile
 import unittest
 from shutil import which
 
-from tonnikala.loader import JSLoader
+from tonnikala.languages.javascript.generator import FreeVarFinder
+from tonnikala.loader import JSLoader, compile_js_directory
+from tonnikala.runtime.exceptions import TemplateSyntaxError
 
 runtime_code = importlib.resources.read_binary("tonnikala.runtime", "javascript.js")
 
@@ -51,6 +55,99 @@ def render(template, debug=False, **args):
     return str(execute_nodejs_runner("scratch.js", args))
 
 
+class TestJsCompile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.dir, "src")
+        self.target_dir = os.path.join(self.dir, "out")
+        self.cache_dir = os.path.join(self.dir, "cache")
+
+        os.makedirs(os.path.join(self.source_dir, "sub"))
+        self.templates = {
+            "a.tk": "<p>${a}</p>",
+            os.path.join("sub", "b.tk"): '<p js:for="i in l">$i</p>',
+        }
+        for name, contents in self.templates.items():
+            with open(os.path.join(self.source_dir, name), "w") as f:
+                f.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def compile(self, processes):
+        return compile_js_directory(
+            self.source_dir,
+            self.target_dir,
+            processes=processes,
+            cache_dir=self.cache_dir,
+        )
+
+    def read_target(self, name):
+        with open(os.path.join(self.target_dir, name)) as f:
+            return f.read()
+
+    def test_compile_directory(self):
+        targets = self.compile(processes=2)
+        self.assertEqual(
+            targets,
+            [
+                os.path.join(self.target_dir, "a.js"),
+                os.path.join(self.target_dir, "sub", "b.js"),
+            ],
+        )
+        self.assertEqual(
+            self.read_target("a.js"), JSLoader().load_string(self.templates["a.tk"])
+        )
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_cache_is_used_for_unchanged_templates(self):
+        self.compile(processes=1)
+
+        loader = JSLoader(cache_dir=self.cache_dir)
+        cache_path = loader.get_cache_path(self.templates["a.tk"])
+        with open(cache_path, "w") as f:
+            f.write("cached")
+
+        self.compile(processes=1)
+        self.assertEqual(self.read_target("a.js"), "cached")
+
+        with open(os.path.join(self.source_dir, "a.tk"), "w") as f:
+            f.write("<p>changed</p>")
+
+        self.compile(processes=1)
+        self.assertIn("changed", self.read_target("a.js"))
+
+        # minified output is cached separately
+        minified = JSLoader(cache_dir=self.cache_dir, minify=True)
+        self.assertNotEqual(
+            minified.load_string(self.templates["a.tk"]),
+            loader.load_string(self.templates["a.tk"]),
+        )
+
+
+class TestFreeVarFinder(unittest.TestCase):
+    def assert_free_variables(self, code, expected):
+        self.assertEqual(FreeVarFinder(code).get_free_variables(), set(expected))
+
+    def test_declarations(self):
+        self.assert_free_variables("var a = 1, b = c; d(a, b)", ["c", "d"])
+        self.assert_free_variables("for (var i in o) { f(i) }", ["o", "f"])
+        self.assert_free_variables("try { a() } catch (e) { e.x }", ["a"])
+
+    def test_functions(self):
+        self.assert_free_variables(
+            "f(1); function f(a) { return g(a, b); }", ["g", "b"]
+        )
+        self.assert_free_variables("h(function f(a) { return f(a); }); f", ["h", "f"])
+        self.assert_free_variables("l.map(x => x + y)", ["l", "y"])
+        self.assert_free_variables(
+            "l.map((x, i) => { var z = x; return z + i; })", ["l"]
+        )
+
+    def test_properties(self):
+        self.assert_free_variables("f({key: value, other: a.b})", ["f", "value", "a"])
+
+
 class TestJsTemplates(unittest.TestCase):
     def are(self, result, template, **args):
         """assert rendered equals"""
@@ -97,6 +194,8 @@ class TestJsTemplates(unittest.TestCase):
 
     def test_escapes_in_expression(self):
         self.are("<html>&lt;&amp;&#34;</html>", "<html>${i}</html>", i='<&"')
+        self.are("<html>&#39;&gt;</html>", "<html>${i}</html>", i="'>")
+        self.are("<html>1.5 null</html>", "<html>${i} ${j}</html>", i=1.5, j=None)
 
     def test_if_else_expression(self):
         """
@@ -217,6 +316,18 @@ class TestJsTemplates(unittest.TestCase):
     def test_empty_attribute(self):
         self.are("<html foobar></html>", "<html foobar></html>")
 
+    def test_syntax_errors(self):
+        self.assert_compile_throws(TemplateSyntaxError, "<html>${a +}</html>")
+        self.assert_compile_throws(
+            TemplateSyntaxError, '<html><p js:if="a ===">x</p></html>'
+        )
+        self.assert_compile_throws(
+            TemplateSyntaxError, '<html><p js:for="i in f(l">$i</p></html>'
+        )
+        self.assert_compile_throws(
+            TemplateSyntaxError, "<html><?javascript var a = 'b; ?></html>"
+        )
+
     def test_dollars(self):
         fragment = "<html><script>$.fn $(abc) $$a $a</script></html>"
         self.are(
@@ -0,0 +1,94 @@
+"Allocation report and allocations per render"
+
+import os.path
+import unittest
+
+import tonnikala.loader
+from tonnikala.loader import FileLoader
+from tonnikala.profiling import allocation_report
+from tonnikala.runtime import python
+
+data_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), "files")
+input_dir = os.path.join(data_dir, "input")
+
+
+class TestAllocationReport(unittest.TestCase):
+    # the maximum number of blocks allocated by a render, with the C
+    # Buffer and with the pure-Python Buffer
+    max_counts = {
+        "simple": (30, 30),
+        "extends": (40, 40),
+        "import": (45, 45),
+        "loop": (350, 375),
+    }
+
+    def setUp(self):
+        self.loader = FileLoader(paths=[input_dir])
+
+    def max_count(self, name):
+        return self.max_counts[name][python.Buffer is python._TKPythonBufferImpl]
+
+    def report(self, template, context):
+        # render once so that the one-time allocations, such as the
+        # builtins of the context, are not counted
+        template.render(context)
+        return allocation_report(template, context)
+
+    def test_attributes_to_template_lines(self):
+        template = self.loader.load("importing.tk")
+        report = self.report(template, {"foo": "bar"})
+        locations = {(i.filename, i.lineno) for i in report.allocations}
+        self.assertIn((os.path.join(input_dir, "importing.tk"), 1), locations)
+        self.assertIn((os.path.join(input_dir, "imported.tk"), 2), locations)
+        self.assertEqual(report.count, sum(i.count for i in report.allocations))
+        self.assertIn("importing.tk:1: ", str(report))
+
+        # the copy of the context made for the rendering is counted
+        filenames = {i.filename for i in report.allocations}
+        self.assertIn(tonnikala.loader.__file__, filenames)
+
+    def assert_allocations_at_most(self, name, context, count, peak):
+        template = self.loader.load(name)
+        report = self.report(template, context)
+        self.assertLessEqual(report.count, count, str(report))
+        if report.peak is not None:
+            self.assertLessEqual(report.peak, peak, str(report))
+
+    def test_simple(self):
+        self.assert_allocations_at_most(
+            "simple.tk", {"foo": "bar"}, self.max_count("simple"), 16384
+        )
+
+    def test_extends(self):
+        self.assert_allocations_at_most(
+            "child.tk", {"title": "x"}, self.max_count("extends"), 24576
+        )
+
+    def test_import(self):
+        self.assert_allocations_at_most(
+            "importing.tk", {"foo": "bar"}, self.max_count("import"), 32768
+        )
+
+    def test_loop(self):
+        template = self.loader.load_string(
+            '<table><tr py:for="row in rows">'
+            '<td py:for="cell in row">$cell</td></tr></table>'
+        )
+
+        # a block for each cell that is not output as is, and the list
+        report = self.report(template, {"rows": [["a<b", 1, 2.5]] * 100})
+        self.assertLessEqual(report.count, self.max_count("loop"), str(report))
+
+
+if python.Buffer is not python._TKPythonBufferImpl:
+
+    class TestAllocationReportWithoutSpeedups(TestAllocationReport):
+        def setUp(self):
+            super(TestAllocationReportWithoutSpeedups, self).setUp()
+            self.saved_buffer_cls = python.Buffer
+            python.Buffer = python._TKPythonBufferImpl
+            python.TonnikalaRuntime.Buffer = staticmethod(python.Buffer)
+
+        def tearDown(self):
+            python.Buffer = self.saved_buffer_cls
+            python.TonnikalaRuntime.Buffer = staticmethod(python.Buffer)
@@ -0,0 +1,149 @@
+"Pyramid renderer tests"
+
+import gc
+import hashlib
+import os.path
+import unittest
+
+from tonnikala.runtime.exceptions import RenderLimitError
+
+try:
+    from pyramid import testing
+    from pyramid.renderers import render
+    from webob import Request
+except ImportError:  # pragma: no cover
+    testing = None
+
+data_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), "files")
+input_dir = os.path.join(data_dir, "input")
+output_dir = os.path.join(data_dir, "output")
+
+
+def get_reference_output(name):
+    with open(os.path.join(output_dir, name), encoding="UTF-8") as f:
+        return f.read().rstrip("\n")
+
+
+def simple_view(request):
+    return {"foo": "bar"}
+
+
+def streaming_view(request):
+    request.tonnikala_streaming = True
+    return {"foo": "bar"}
+
+
+@unittest.skipIf(testing is None, "Pyramid is not installed")
+class TestPyramidRenderer(unittest.TestCase):
+    def setUp(self):
+        self.setup_config()
+
+    def setup_config(self, **settings):
+        settings.setdefault("tonnikala.extensions", ".tk")
+        settings.setdefault("tonnikala.search_paths", input_dir)
+        self.config = testing.setUp(settings=settings)
+        self.config.include("tonnikala.pyramid")
+        self.config.add_route("simple", "/simple")
+        self.config.add_view(simple_view, route_name="simple", renderer="simple.tk")
+        self.config.add_route("streaming", "/streaming")
+        self.config.add_view(
+            streaming_view, route_name="streaming", renderer="simple.tk"
+        )
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def get(self, path):
+        app = self.config.make_wsgi_app()
+        return Request.blank(path).get_response(app)
+
+    def test_render(self):
+        response = self.get("/simple")
+        self.assertEqual(response.text, get_reference_output("simple.tk"))
+        self.assertIsNotNone(response.content_length)
+
+    def test_streaming_setting(self):
+        testing.tearDown()
+        self.setup_config(**{"tonnikala.streaming": "true"})
+
+        response = self.get("/simple")
+        self.assertIsNone(response.content_length)
+        self.assertEqual(response.text, get_reference_output("simple.tk"))
+
+        # rendering outside of views returns a string regardless
+        self.assertEqual(
+            render("simple.tk", {"foo": "bar"}), get_reference_output("simple.tk")
+        )
+
+    def test_streaming_per_view(self):
+        response = self.get("/streaming")
+        self.assertIsNone(response.content_length)
+        self.assertEqual(response.text, get_reference_output("simple.tk"))
+
+    def test_etag_setting(self):
+        response = self.get("/simple")
+        self.assertIsNone(response.etag)
+
+        testing.tearDown()
+        self.setup_config(**{"tonnikala.etag": "true"})
+
+        response = self.get("/simple")
+        self.assertEqual(response.text, get_reference_output("simple.tk"))
+        self.assertEqual(
+            response.etag,
+            hashlib.blake2b(response.body, digest_size=16).hexdigest(),
+        )
+
+        app = self.config.make_wsgi_app()
+        request = Request.blank("/simple", if_none_match='"%s"' % response.etag)
+        self.assertEqual(request.get_response(app).status_int, 304)
+
+        # streamed responses are not given an ETag
+        self.assertIsNone(self.get("/streaming").etag)
+
+    def test_render_limits(self):
+        testing.tearDown()
+        self.setup_config(
+            **{"tonnikala.max_output_size": "10", "tonnikala.render_timeout": "5"}
+        )
+
+        loader = self.config.registry.tonnikala_renderer_factory.loader
+        self.assertEqual(loader.max_output_size, 10)
+        self.assertEqual(loader.render_timeout, 5.0)
+        with self.assertRaises(RenderLimitError):
+            render("simple.tk", {"foo": "bar"})
+
+    def test_translate_tracebacks_setting(self):
+        loader = self.config.registry.tonnikala_renderer_factory.loader
+        self.assertTrue(loader.translate_tracebacks)
+
+        testing.tearDown()
+        self.setup_config(**{"tonnikala.translate_tracebacks": "false"})
+        loader = self.config.registry.tonnikala_renderer_factory.loader
+        self.assertFalse(loader.translate_tracebacks)
+
+    def test_preload(self):
+        testing.tearDown()
+        self.setup_config(
+            **{"tonnikala.preload": "*.tk", "tonnikala.preload_gc_freeze": "false"}
+        )
+        self.config.commit()
+
+        loader = self.config.registry.tonnikala_renderer_factory.loader
+        self.assertIn("simple.tk", loader.cache)
+        self.assertIn("child.tk", loader.cache)
+
+        # the renderer uses the preloaded template
+        template = loader.cache["simple.tk"]
+        self.get("/simple")
+        self.assertIs(loader.cache["simple.tk"], template)
+
+    @unittest.skipUnless(hasattr(gc, "freeze"), "gc.freeze needs Python 3.7")
+    def test_preload_freezes_gc(self):
+        self.addCleanup(gc.unfreeze)
+        self.config.preload_tonnikala_templates(os.path.join(input_dir, "*.tk"))
+        self.config.commit()
+
+        loader = self.config.registry.tonnikala_renderer_factory.loader
+        self.assertIn(os.path.join(input_dir, "simple.tk"), loader.cache)
+        self.assertGreater(gc.get_freeze_count(), 0)
@@ -0,0 +1,133 @@
+"Incremental re-rendering with RenderSession"
+
+import os.path
+import unittest
+
+from tonnikala.loader import FileLoader
+from tonnikala.session import RenderSession
+
+data_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), "files")
+input_dir = os.path.join(data_dir, "input")
+
+
+class Versioned(list):
+    version = 0
+
+
+class TestRenderSession(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def track(self, name, value):
+        self.calls.append(name)
+        return value
+
+    def load_string(self, source):
+        return FileLoader().load_string(source)
+
+    def test_rerenders_changed_blocks(self):
+        template = self.load_string(
+            "<div>"
+            '<p py:block="first">${track("first", a)}</p>'
+            '<p py:block="second">${track("second", b)} ${item(a)}</p>'
+            '<py:def function="item(x)">${track("item", x)}</py:def>'
+            "</div>"
+        )
+        session = RenderSession(template)
+        context = {"a": "1", "b": "<2>", "track": self.track}
+
+        expected = "<div><p>1</p><p>&lt;2&gt; 1</p></div>"
+        self.assertEqual(session.render(context), expected)
+        self.assertEqual(self.calls, ["first", "second", "item"])
+
+        # nothing changed
+        del self.calls[:]
+        self.assertEqual(session.render(dict(context)), expected)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(session.hits, 1)
+
+        # only the block that reads b is executed; the def is cached
+        del self.calls[:]
+        context["b"] = "3"
+        self.assertEqual(session.render(context), "<div><p>1</p><p>3 1</p></div>")
+        self.assertEqual(self.calls, ["second"])
+
+        # the block and the def read a
+        del self.calls[:]
+        context["a"] = "4"
+        self.assertEqual(session.render(context), "<div><p>4</p><p>3 4</p></div>")
+        self.assertEqual(self.calls, ["first", "second", "item"])
+
+    def test_stamp(self):
+        template = self.load_string(
+            '<div><p py:block="items">${track("items", len(l))}</p></div>'
+        )
+        session = RenderSession(template, stamp=lambda i: getattr(i, "version", i))
+        items = Versioned([1])
+        context = {"l": items, "track": self.track}
+        self.assertEqual(session.render(context), "<div><p>1</p></div>")
+
+        # mutated in place; the same version is not rendered again
+        items.append(2)
+        self.assertEqual(session.render(context), "<div><p>1</p></div>")
+
+        items.version += 1
+        self.assertEqual(session.render(context), "<div><p>2</p></div>")
+        self.assertEqual(self.calls, ["items", "items"])
+
+    def test_recursive_def(self):
+        template = self.load_string(
+            '<div><py:def function="tree(n)">'
+            '${track("tree", n)}<py:if test="n">${tree(n - 1)}</py:if>'
+            "</py:def>${tree(depth)}</div>"
+        )
+        session = RenderSession(template)
+        context = {"depth": 2, "track": self.track}
+        self.assertEqual(session.render(context), "<div>210</div>")
+        self.assertEqual(session.render(context), "<div>210</div>")
+        self.assertEqual(self.calls, ["tree", "tree", "tree"])
+
+        context["depth"] = 3
+        self.assertEqual(session.render(context), "<div>3210</div>")
+        self.assertEqual(self.calls, ["tree", "tree", "tree", "tree"])
+
+    def test_stale_entries_are_dropped(self):
+        template = self.load_string(
+            '<div><py:def function="item(x)">${track("item", x)}</py:def>'
+            '<p py:block="items"><py:for each="i in l">${item(i)}</py:for></p>'
+            "</div>"
+        )
+        session = RenderSession(template)
+        for i in range(20):
+            context = {"l": [i, i + 1], "track": self.track}
+            self.assertEqual(
+                session.render(context), "<div><p>%d%d</p></div>" % (i, i + 1)
+            )
+
+        # the main function, the block and the def for the two arguments
+        # of the last render
+        self.assertEqual(len(session.cache), 4)
+
+        # the entries of the functions called by a cached function are kept
+        del self.calls[:]
+        session.render(context)
+        self.assertEqual(len(session.cache), 4)
+        session.render(dict(context, l=[19, 21]))
+        self.assertEqual(self.calls, ["item"])
+        self.assertEqual(len(session.cache), 4)
+
+    def test_extends_and_imports(self):
+        loader = FileLoader(paths=[input_dir])
+        for name, context in [
+            ("child.tk", {"title": "x"}),
+            ("importing.tk", {"foo": "bar"}),
+        ]:
+            template = loader.load(name)
+            session = RenderSession(template)
+            expected = template.render(context)
+            self.assertEqual(session.render(context), expected)
+            self.assertEqual(session.render(context), expected)
+            self.assertGreater(session.hits, 0)
+
+            changed = dict(context, title="y", foo="baz")
+            self.assertEqual(session.render(changed), template.render(changed))
@@ -0,0 +1,166 @@
+"Multi-threaded loading and rendering tests"
+
+import os.path
+import sys
+import threading
+import time
+import unittest
+
+try:
+    import _interpreters as interpreters
+except ImportError:  # pragma: no cover
+    try:
+        import _xxsubinterpreters as interpreters
+    except ImportError:
+        interpreters = None
+
+try:
+    from tonnikala.runtime import _buffer
+except ImportError:  # pragma: no cover
+    _buffer = None
+
+from tonnikala.loader import FileLoader, Loader
+
+data_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), "files")
+
+template_source = (
+    '<table><tr py:for="row in rows">'
+    '<td py:for="cell in row">$cell</td><td>${len(row)}</td>'
+    "</tr></table>"
+)
+
+rows = [["<%d>" % i, i, i * 2.5] for i in range(200)]
+expected_output = (
+    "<table>"
+    + "".join(
+        "<tr><td>&lt;%d&gt;</td><td>%d</td><td>%s</td><td>3</td></tr>" % (i, i, i * 2.5)
+        for i in range(200)
+    )
+    + "</table>"
+)
+
+
+def is_gil_enabled():
+    is_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_enabled is None or is_enabled()
+
+
+def run_in_threads(n_threads, func):
+    """
+    Run ``func`` concurrently in ``n_threads`` threads, all started at
+    once; return the results and the elapsed wall clock time.
+    """
+
+    barrier = threading.Barrier(n_threads)
+    results = [None] * n_threads
+    errors = []
+
+    def worker(index):
+        barrier.wait()
+        try:
+            results[index] = func()
+        except BaseException as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    if errors:  # pragma: no cover
+        raise errors[0]
+
+    return results, elapsed
+
+
+class CountingFileLoader(FileLoader):
+    def __init__(self, *a, **kw):
+        super(CountingFileLoader, self).__init__(*a, **kw)
+        self.compiled = []
+
+    def load_string(self, string, filename="<string>"):
+        self.compiled.append(os.path.basename(filename))
+        return super(CountingFileLoader, self).load_string(string, filename)
+
+
+class TestThreading(unittest.TestCase):
+    def test_concurrent_load_compiles_once(self):
+        loader = CountingFileLoader(paths=[os.path.join(data_dir, "input")])
+        results, _ = run_in_threads(8, lambda: loader.load("child.tk"))
+
+        self.assertEqual(sorted(loader.compiled), ["base.tk", "child.tk"])
+        for template in results:
+            self.assertIs(template, results[0])
+
+    def test_concurrent_render(self):
+        template = Loader().load_string(template_source)
+
+        def render():
+            return [template.render({"rows": rows}) for i in range(20)]
+
+        for n_threads in (1, 2, 4, 8):
+            results, _ = run_in_threads(n_threads, render)
+            for outputs in results:
+                for output in outputs:
+                    self.assertEqual(output, expected_output)
+
+    def test_render_throughput_scales_with_threads(self):
+        if is_gil_enabled():
+            self.skipTest("render throughput only scales without the GIL")
+
+        if (os.cpu_count() or 1) < 4:  # pragma: no cover
+            self.skipTest("at least 4 CPUs are needed")
+
+        template = Loader().load_string(template_source)
+        n_renders = 200
+
+        def render():
+            for i in range(n_renders):
+                template.render({"rows": rows})
+
+        # the same total amount of work per thread; with perfect
+        # scaling the elapsed time stays the same as with 1 thread
+        _, single = run_in_threads(1, render)
+        _, quad = run_in_threads(4, render)
+        throughput_ratio = 4 * single / quad
+        self.assertGreater(throughput_ratio, 2.0)
+
+
+subinterpreter_code = """
+import sys
+sys.path[:] = %r
+from tonnikala.runtime import _buffer
+buffer = _buffer.Buffer()
+buffer.output_loop(range(3), ("<i>", (), "</i>"))
+assert buffer.join() == "<i>0</i><i>1</i><i>2</i>"
+"""
+
+
+@unittest.skipIf(_buffer is None, "the C speedups are not available")
+@unittest.skipIf(
+    interpreters is None or sys.version_info < (3, 12),
+    "per-interpreter GIL needs Python 3.12",
+)
+class TestSubinterpreters(unittest.TestCase):
+    def create_isolated_interpreter(self):
+        if sys.version_info >= (3, 13):
+            return interpreters.create("isolated")
+
+        return interpreters.create(isolated=True)  # pragma: no cover
+
+    def test_buffer_in_isolated_subinterpreters(self):
+        def run():
+            interpreter = self.create_isolated_interpreter()
+            try:
+                return interpreters.run_string(
+                    interpreter, subinterpreter_code % (sys.path,)
+                )
+            finally:
+                interpreters.destroy(interpreter)
+
+        results, _ = run_in_threads(4, run)
+        self.assertEqual(results, [None] * 4)
@@ -0,0 +1,53 @@
+"Writers for Template.render_to"
+
+import socket
+import unittest
+
+from tonnikala.loader import FileLoader
+from tonnikala.writers import SocketWriter
+
+
+class PartialSocket(object):
+    """Sends at most ``limit`` bytes per call, like a full socket buffer"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.received = b""
+        self.calls = []
+
+    def sendmsg(self, buffers):
+        self.calls.append(len(buffers))
+        data = b"".join(buffers)[: self.limit]
+        self.received += data
+        return len(data)
+
+
+class TestSocketWriter(unittest.TestCase):
+    def test_partial_sends(self):
+        sock = PartialSocket(3)
+        writer = SocketWriter(sock, batch_size=2)
+        writer.writelines(["ab", "", "cde", "ä", "f"])
+        self.assertEqual(sock.received, "abcdeäf".encode("UTF-8"))
+        self.assertLessEqual(max(sock.calls), 2)
+
+        writer.write("gh")
+        self.assertEqual(sock.received, "abcdeäfgh".encode("UTF-8"))
+
+    @unittest.skipUnless(hasattr(socket, "socketpair"), "needs socket.socketpair")
+    @unittest.skipUnless(hasattr(socket.socket, "sendmsg"), "needs socket.sendmsg")
+    def test_render_to_socket(self):
+        template = FileLoader().load_string('<ul><li py:for="i in l">$i</li></ul>')
+        context = {"l": range(100)}
+
+        sender, receiver = socket.socketpair()
+        with sender, receiver:
+            template.render_to(SocketWriter(sender, batch_size=16), context)
+            sender.shutdown(socket.SHUT_WR)
+
+            received = b""
+            data = receiver.recv(65536)
+            while data:
+                received += data
+                data = receiver.recv(65536)
+
+        self.assertEqual(received.decode("UTF-8"), template.render(context))
@@ -1,5 +1,6 @@
 # ignore Flake8 error F401
 
 from .loader import FileLoader, Loader, Template  # noqa: F401
+from .runtime.python import lazy  # noqa: F401
 
 __version__ = "1.0.0"
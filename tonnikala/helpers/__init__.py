@@ -54,6 +54,20 @@ def calculate_position(source, offset, start=None):
 
 internal_code = set()
 
+# the line numbers of the code compiled from the n-th file merged into a
+# template at compile time (a parent or an included template) are offset
+# by n * LINE_OFFSET, so that they map back to the file they came from
+LINE_OFFSET = 1 << 20
+
+
+def split_lineno(lineno):
+    """
+    Return the ``(index, lineno)`` of the merged file and the line in it
+    of the line number of code compiled from a template
+    """
+
+    return divmod(lineno, LINE_OFFSET)
+
 
 def is_nonstr_iter(v):
     if isinstance(v, str):
@@ -1,4 +1,9 @@
+import hashlib
 import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 
 from lingua.extractors import Extractor
 from lingua.extractors import Message
@@ -6,6 +11,49 @@ from lingua.extractors.python import _extract_python
 from tonnikala.ir.nodes import TranslatableText, Expression
 from tonnikala.loader import parsers
 
+# bump when the extracted messages of an unchanged file might differ
+CACHE_VERSION = 1
+
+# a plain name or attribute chain cannot contain a translation call
+_simple_expression_re = re.compile(r"\s*[A-Za-z_][\w.]*\s*\Z")
+
+
+class ExtractionCache(object):
+    """
+    The messages extracted from a file, stored as a JSON file per
+    content hash in the given directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        try:
+            with io.open(self.path(key), encoding="UTF-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return [Message(*i[:6], location=tuple(i[6])) for i in entries]
+
+    def set(self, key, messages):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # write atomically, several extractions may share the directory
+        path = self.path(key)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with io.open(tmp_path, "w", encoding="UTF-8") as f:
+            json.dump([list(i) for i in messages], f)
+
+        os.replace(tmp_path, path)
+
+
+def _extract_in_process(extractor_class, config, filename, source, options):
+    return extractor_class(config).extract(filename, source, options)
+
 
 class TonnikalaExtractor(Extractor):
     "Extract strings from tonnikala templates, defaulting to Python expressions"
@@ -13,39 +61,199 @@ class TonnikalaExtractor(Extractor):
     extensions = [".tk"]
     syntax = "tonnikala"
 
+    # cache_dir: if set, the messages are cached there by file content
+    default_config = {"cache_dir": None}
+
     def parse_python(self, node, filename, lineno, options):
+        if _simple_expression_re.match(node.expression):
+            return
+
         start_line = (node.position[0] or 1) + lineno
         for message in _extract_python(filename, node.expression, options, start_line):
             yield Message(
                 *message[:6], location=(filename, lineno + message.location[1])
             )
 
-    def __call__(self, filename, options, fileobj=None, lineno=0):
-        self.filename = filename
-        if fileobj is None:
-            fileobj = io.open(filename, encoding="utf-8")
+    def extract(self, filename, source, options, lineno=0):
+        """
+        Parse the template source and return the list of messages in it
+        """
 
         parser_func = parsers.get(self.syntax)
-        source = fileobj.read()
-        if isinstance(source, bytes):
-            source = source.decode("UTF-8")
-
         tree = parser_func(filename, source, translatable=True)
 
+        messages = []
         for node in tree:
             if isinstance(node, TranslatableText):
-                yield Message(
-                    None,
-                    node.text,
-                    None,
-                    [],
-                    "",
-                    "",
-                    (filename, lineno + (node.position[0] or 1)),
+                messages.append(
+                    Message(
+                        None,
+                        node.text,
+                        None,
+                        [],
+                        "",
+                        "",
+                        (filename, lineno + (node.position[0] or 1)),
+                    )
                 )
             elif isinstance(node, Expression):
-                for m in self.parse_python(node, filename, lineno, options):
-                    yield m
+                messages.extend(self.parse_python(node, filename, lineno, options))
+
+        return messages
+
+    def get_cache(self):
+        cache_dir = self.config.get("cache_dir")
+        if not cache_dir:
+            return None
+
+        return ExtractionCache(cache_dir)
+
+    def get_cache_key(self, filename, source, options, lineno=0):
+        keywords = options.keywords or ()
+        key = [
+            CACHE_VERSION,
+            self.syntax,
+            filename,
+            lineno,
+            sorted(keywords),
+            options.comment_tag,
+            options.domain,
+            source,
+        ]
+        return hashlib.sha256(json.dumps(key).encode("UTF-8")).hexdigest()
+
+    def read_source(self, filename, fileobj=None):
+        if fileobj is None:
+            with io.open(filename, encoding="utf-8") as fileobj:
+                return fileobj.read()
+
+        source = fileobj.read()
+        if isinstance(source, bytes):
+            source = source.decode("UTF-8")
+
+        return source
+
+    def __call__(self, filename, options, fileobj=None, lineno=0):
+        self.filename = filename
+        source = self.read_source(filename, fileobj)
+
+        cache = self.get_cache()
+        if cache is None:
+            yield from self.extract(filename, source, options, lineno)
+            return
+
+        key = self.get_cache_key(filename, source, options, lineno)
+        messages = cache.get(key)
+        if messages is None:
+            messages = self.extract(filename, source, options, lineno)
+            cache.set(key, messages)
+
+        yield from messages
+
+    def extract_files(self, filenames, options, processes=None):
+        """
+        Extract the messages from all the given files, yielding them in
+        the same order as calling the extractor for each file would.
+        The files that are not in the cache are parsed in a pool of
+        ``processes`` worker processes (by default one per CPU); with
+        ``processes=1`` they are parsed in this process.
+        """
+
+        cache = self.get_cache()
+        sources = [self.read_source(i) for i in filenames]
+        keys = [None] * len(filenames)
+        results = [None] * len(filenames)
+
+        if cache is not None:
+            for i, (filename, source) in enumerate(zip(filenames, sources)):
+                keys[i] = self.get_cache_key(filename, source, options)
+                results[i] = cache.get(keys[i])
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if processes == 1 or len(missing) < 2:
+            for i in missing:
+                results[i] = self.extract(filenames[i], sources[i], options)
+
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [
+                    executor.submit(
+                        _extract_in_process,
+                        type(self),
+                        self.config,
+                        filenames[i],
+                        sources[i],
+                        options,
+                    )
+                    for i in missing
+                ]
+
+                for i, future in zip(missing, futures):
+                    results[i] = future.result()
+
+        for i in missing:
+            if cache is not None:
+                cache.set(keys[i], results[i])
+
+        for messages in results:
+            yield from messages
+
+
+def find_template_files(sources, extension=".tk"):
+    """
+    Return the template files given in ``sources``: the files as is,
+    and the files with the extension in the directories and their
+    subdirectories, in sorted order.
+    """
+
+    filenames = []
+    for source in sources:
+        if not os.path.isdir(source):
+            filenames.append(source)
+            continue
+
+        for dirpath, dirnames, names in os.walk(source):
+            dirnames.sort()
+            for name in sorted(names):
+                if name.endswith(extension):
+                    filenames.append(os.path.join(dirpath, name))
+
+    return filenames
+
+
+def write_pot(
+    sources, output, options, extension=".tk", processes=None, cache_dir=None
+):
+    """
+    Extract the messages of the templates in ``sources`` (files, or
+    directories searched for files with the extension) into the POT file
+    ``output`` like lingua's ``pot-create``, which calls the extractor
+    one file at a time, but parsing the files in a pool of ``processes``
+    worker processes with ``TonnikalaExtractor.extract_files``. Returns
+    the number of messages written.
+    """
+
+    from lingua.extract import POEntry, create_catalog, save_catalog
+
+    extractor = TonnikalaExtractor({"cache_dir": cache_dir})
+    filenames = find_template_files(sources, extension)
+
+    catalog = create_catalog(79, None, "PACKAGE", "1.0", None)
+    for message in extractor.extract_files(filenames, options, processes):
+        entry = catalog.find(message.msgid, msgctxt=message.msgctxt)
+        if entry is None:
+            entry = POEntry(msgctxt=message.msgctxt, msgid=message.msgid)
+            if message.msgid_plural:
+                entry.msgid_plural = message.msgid_plural
+                entry.msgstr_plural[0] = ""
+                entry.msgstr_plural[1] = ""
+
+            catalog.append(entry)
+
+        entry.update(message)
+
+    save_catalog(catalog, output)
+    return len(catalog)
 
 
 class Options:
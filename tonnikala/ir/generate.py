@@ -1,8 +1,11 @@
 """Generates IR nodes from DOM tree"""
 
+import re
+
 from .nodes import (
     Element,
     Text,
+    TranslatableText,
     MutableAttribute,
     ContainerNode,
     EscapedText,
@@ -44,6 +47,29 @@ html5_cdata_elements = frozenset(
 )
 
 
+html5_whitespace_preserving_elements = frozenset(
+    """
+    pre
+    textarea
+""".split()
+)
+
+# only the HTML whitespace characters; notably not U+00A0 from &nbsp;
+_html_whitespace_re = re.compile(r"[ \t\n\r\f]+")
+
+
+def collapse_whitespace(text):
+    return _html_whitespace_re.sub(" ", text)
+
+
+def is_conditional_comment(text):
+    """
+    Internet Explorer conditional comments are kept even when minifying
+    """
+
+    return text.lstrip().startswith("[if")
+
+
 class all_set(object):
     def __contains__(self, value):
         return True
@@ -134,10 +160,13 @@ class Validator(object):
 
 
 class BaseDOMIRGenerator(BaseIRGenerator):
-    def __init__(self, document=None, mode="html5", *a, **kw):
+    whitespace_preserving_elements = html5_whitespace_preserving_elements
+
+    def __init__(self, document=None, mode="html5", *a, minify=False, **kw):
         super(BaseDOMIRGenerator, self).__init__(*a, **kw)
         self.dom_document = document
         self.mode = mode
+        self.minify = minify
 
         if mode in ["html", "html5", "xhtml"]:
             self.empty_elements = html5_empty_tags
@@ -221,6 +250,45 @@ class BaseDOMIRGenerator(BaseIRGenerator):
 
         return start_tag_nodes
 
+    def collapse_whitespace_on(self, node):
+        """
+        Collapse runs of whitespace in the untranslatable text nodes
+        to a single space, leaving the contents of whitespace-preserving
+        and cdata elements untouched.
+        """
+
+        if isinstance(node, Element) and (
+            node.name in self.whitespace_preserving_elements
+            or node.name in self.cdata_elements
+        ):
+            return
+
+        previous = None
+        for i in node.children:
+            if (
+                isinstance(i, Text)
+                and not isinstance(i, (EscapedText, TranslatableText))
+                and not i.is_cdata
+            ):
+                text = collapse_whitespace(i.text)
+
+                # adjacent text nodes, e.g. around a removed comment
+                if previous is not None and previous.text.endswith(" "):
+                    text = text.lstrip(" ")
+
+                i.text = text
+                previous = i
+                continue
+
+            previous = None
+            if isinstance(i, ContainerNode):
+                self.collapse_whitespace_on(i)
+
+    def collapse_whitespace(self, tree):
+        root = tree.root
+        self.collapse_whitespace_on(root)
+        return tree
+
     def flatten_element_nodes_on(self, node):
         new_children = []
         recurse = False
@@ -0,0 +1,182 @@
+"""
+Compile-time template inclusion: splicing the IR tree of an included
+template into the tree of the including template.
+"""
+
+import ast
+
+from tonnikala.ir.inheritance import is_literal_href
+from tonnikala.ir.nodes import (
+    BaseNode,
+    Block,
+    Code,
+    ContainerNode,
+    Define,
+    DynamicAttributes,
+    Element,
+    Expression,
+    For,
+    If,
+    Import,
+    Include,
+    Unless,
+    With,
+)
+
+
+def expand_includes(node, get_included, local_names=None):
+    """
+    Replace the ``Include`` nodes with literal hrefs anywhere within the
+    node with the children of the root of the tree returned by
+    ``get_included(include, local_names)``, where ``local_names`` are
+    the names of the including template visible at the include but not
+    in the rendering context. The includes for which it returns None
+    are left to be done at render time.
+    """
+
+    if local_names is None:
+        # the blocks, and the top-level defs and imports of the template
+        local_names = set(get_block_names(node))
+        for child in node.children:
+            if isinstance(child, (Define, Import)):
+                local_names |= get_code_names(child)[1]
+
+    local_names = set(local_names)
+    children = []
+    for child in node.children:
+        if isinstance(child, Include) and is_literal_href(child.href):
+            tree = get_included(child, frozenset(local_names))
+            if tree is not None:
+                children.extend(tree.get_root().children)
+                continue
+
+        elif isinstance(child, Code):
+            local_names |= get_code_names(child)[1]
+
+        elif isinstance(child, ContainerNode):
+            expand_includes(child, get_included, local_names | get_code_names(child)[1])
+
+        children.append(child)
+
+    node.children = children
+
+
+def get_block_names(node):
+    """Yield the names of the blocks anywhere within the node"""
+
+    if isinstance(node, Block):
+        yield str(node.name)
+
+    if isinstance(node, ContainerNode):
+        for i in node.children:
+            yield from get_block_names(i)
+
+
+def defines_names(node):
+    """
+    Return True if the node or a node within it defines a name in the
+    scope of the template: a ``py:def``, a ``py:block`` or a
+    ``py:import``. Splicing such a template into another would mix the
+    names of the two templates.
+    """
+
+    if isinstance(node, (Block, Define, Import)):
+        return True
+
+    if isinstance(node, ContainerNode):
+        return any(defines_names(i) for i in node.children)
+
+    return False
+
+
+def _get_names(source, mode):
+    try:
+        tree = ast.parse(source.strip(), mode=mode)
+    except SyntaxError:
+        # reported when the template is compiled
+        return set(), set()
+
+    loaded = set()
+    stored = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loaded.add(node.id)
+            else:
+                stored.add(node.id)
+        elif isinstance(node, ast.arg):
+            stored.add(node.arg)
+        elif isinstance(node, ast.FunctionDef):
+            stored.add(node.name)
+
+    return loaded, stored
+
+
+def get_code_names(node):
+    """
+    Return the sets of the names read and bound by the Python code of
+    the node itself, not of the nodes within it
+    """
+
+    if isinstance(node, For):
+        return _get_names("for %s: pass" % node.expression, "exec")
+
+    if isinstance(node, Define):
+        funcspec = node.funcspec
+        if "(" not in funcspec:
+            funcspec += "()"
+
+        return _get_names("def %s: pass" % funcspec.strip(), "exec")
+
+    if isinstance(node, Import):
+        return set(), {str(node.alias)}
+
+    if isinstance(node, Block):
+        return set(), {str(node.name)}
+
+    if isinstance(node, With):
+        return _get_names(node.vars, "exec")
+
+    if isinstance(node, Code):
+        return _get_names(node.source, "exec")
+
+    if isinstance(node, (Expression, If, Unless, DynamicAttributes)):
+        expression = node.expression
+    elif isinstance(node, Element):
+        expression = node.guard_expression
+    else:
+        expression = None
+
+    if isinstance(expression, str):
+        return _get_names(expression, "eval")
+
+    return set(), set()
+
+
+def get_free_names(node):
+    """
+    Return the names that the Python code within the node reads but
+    does not bind anywhere within it
+    """
+
+    loaded = set()
+    stored = set()
+    seen = set()
+
+    def collect(value):
+        if isinstance(value, (list, tuple)):
+            for i in value:
+                collect(i)
+        elif isinstance(value, dict):
+            for i in value.values():
+                collect(i)
+        elif isinstance(value, BaseNode) and id(value) not in seen:
+            seen.add(id(value))
+            node_loaded, node_stored = get_code_names(value)
+            loaded.update(node_loaded)
+            stored.update(node_stored)
+            for i in vars(value).values():
+                collect(i)
+
+    collect(node)
+    return loaded - stored
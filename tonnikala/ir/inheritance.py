@@ -0,0 +1,101 @@
+"""
+Compile-time template inheritance: merging the IR tree of an extending
+template into the tree of its parent template.
+"""
+
+import re
+
+from tonnikala.ir.nodes import Block, ContainerNode, Define, Extends, Import
+
+_def_name_re = re.compile(r"\s*([^\W\d]\w*)")
+
+
+def get_extends(tree):
+    """
+    Return the ``Extends`` node of the tree, or None if the template
+    does not extend another template
+    """
+
+    for node in tree.get_root().children:
+        if isinstance(node, Extends):
+            return node
+
+    return None
+
+
+def is_literal_href(href):
+    return "$" not in href
+
+
+def get_def_name(define):
+    match = _def_name_re.match(define.funcspec)
+    if match:
+        return match.group(1)
+
+    return None
+
+
+def _replace_blocks(node, blocks, replaced):
+    for i, child in enumerate(node.children):
+        if isinstance(child, Block) and child.name in blocks:
+            node.children[i] = blocks[child.name]
+            replaced.add(child.name)
+
+            # the blocks within the overriding block are of the child
+            continue
+
+        if isinstance(child, ContainerNode):
+            _replace_blocks(child, blocks, replaced)
+
+
+def merge_extends(parent_tree, extends):
+    """
+    Merge the blocks, defs and imports within the ``extends`` node into
+    the (already flattened) tree of the parent template: the blocks
+    replace the blocks of the same name anywhere in the parent, and the
+    defs replace the top-level defs of the same name. Returns the merged
+    tree, or None if the extending template has blocks that the parent
+    does not have, which must stay callable by name, or imports or defs
+    named like an import of the parent, which would replace it in the
+    code of the parent; such templates cannot be merged.
+    """
+
+    blocks = {}
+    defs = {}
+    imports = []
+    for node in extends.children:
+        if isinstance(node, Block):
+            blocks[node.name] = node
+        elif isinstance(node, Define):
+            defs[get_def_name(node)] = node
+        elif isinstance(node, Import):
+            imports.append(node)
+
+    root = parent_tree.get_root()
+    parent_imports = {
+        str(node.alias): str(node.href)
+        for node in root.children
+        if isinstance(node, Import)
+    }
+    for node in imports:
+        href = parent_imports.get(str(node.alias))
+        if href is not None and href != str(node.href):
+            return None
+
+    if any(name in parent_imports for name in defs):
+        return None
+
+    replaced = set()
+    _replace_blocks(root, blocks, replaced)
+    if replaced != set(blocks):
+        return None
+
+    children = []
+    for node in root.children:
+        if isinstance(node, Define) and get_def_name(node) in defs:
+            continue
+
+        children.append(node)
+
+    root.children = imports + list(defs.values()) + children
+    return parent_tree
@@ -274,6 +274,16 @@ class Import(BaseNode):
         return ", ".join([self.href, self.alias])
 
 
+class Include(BaseNode):
+    def __init__(self, href):
+        super(Include, self).__init__()
+
+        self.href = href
+
+    def __str__(self):  # pragma: no cover
+        return self.href
+
+
 class If(ContainerNode):
     def __init__(self, expression):
         super(If, self).__init__()
@@ -324,7 +334,7 @@ class Extends(ContainerNode):
 
     def __str__(self):  # pragma: no cover
         children = str(self.children)
-        return ", ".join([("(%s)" % self.expression), children])
+        return ", ".join([("(%s)" % self.href), children])
 
     def add_child(self, child):
         """
@@ -0,0 +1,47 @@
+"""
+Locating the nodes of the IR trees merged into a template from other
+template files.
+"""
+
+from tonnikala.helpers import LINE_OFFSET, StringWithLocation
+from tonnikala.ir.nodes import BaseNode
+
+
+def relocate(tree, index):
+    """
+    Offset the line numbers of the nodes of the tree, and those of the
+    source strings they hold, by ``index * LINE_OFFSET``, marking them
+    as coming from the ``index``-th file merged into the template.
+    """
+
+    if index:
+        _relocate(tree.get_root(), index * LINE_OFFSET, set())
+
+    return tree
+
+
+def _relocate(value, offset, seen):
+    if isinstance(value, StringWithLocation):
+        lineno, col = value.position
+        return StringWithLocation(str(value), lineno + offset, col)
+
+    if isinstance(value, (list, tuple)):
+        return type(value)(_relocate(i, offset, seen) for i in value)
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            value[key] = _relocate(item, offset, seen)
+
+        return value
+
+    if isinstance(value, BaseNode) and id(value) not in seen:
+        seen.add(id(value))
+        attributes = vars(value)
+        for name, item in attributes.items():
+            if name == "position":
+                if item[0] is not None:
+                    attributes[name] = item[0] + offset, item[1]
+            else:
+                attributes[name] = _relocate(item, offset, seen)
+
+    return value
@@ -33,6 +33,7 @@ class BaseGenerator(object):
     ComplexExprNode = unimplemented
     ExpressionNode = unimplemented
     ImportNode = unimplemented
+    IncludeNode = unimplemented
     Node = unimplemented
     UnlessNode = unimplemented
     MutableAttribute = unimplemented
@@ -45,18 +46,28 @@ class BaseGenerator(object):
     CodeNode = unimplemented
     RootNode = unimplemented
 
-    def __init__(self, ir_tree):
+    def __init__(self, ir_tree, translations=None):
         self.tree = ir_tree
 
+        # if given, the gettext translations of a locale; the translatable
+        # texts are translated at compile time into constant output
+        self.translations = translations
+
     def add_children(self, ir_node, target):
         for i in ir_node.children:
             self.add_child(i, target)
 
     def add_child(self, ir_node, target):
         if isinstance(ir_node, nodes.TranslatableText):
-            new_node = self.TranslatableOutputNode(
-                ir_node.text, needs_escape=ir_node.needs_escape
-            )
+            if self.translations is not None:
+                translated = self.translations.gettext(ir_node.text)
+                text = nodes.Text(translated, is_cdata=ir_node.is_cdata)
+                new_node = self.OutputNode(str(text.escaped()))
+
+            else:
+                new_node = self.TranslatableOutputNode(
+                    ir_node.text, needs_escape=ir_node.needs_escape
+                )
 
         elif isinstance(ir_node, nodes.Text):
             new_node = self.OutputNode(ir_node.escaped())
@@ -82,6 +93,9 @@ class BaseGenerator(object):
         elif isinstance(ir_node, nodes.Import):
             new_node = self.ImportNode(ir_node.href, ir_node.alias)
 
+        elif isinstance(ir_node, nodes.Include):
+            new_node = self.IncludeNode(ir_node.href)
+
         elif isinstance(ir_node, nodes.MutableAttribute):
             new_node = self.AttributeNode(ir_node.name, ir_node.value)
 
@@ -1,184 +1,473 @@
-import json
+"""
+Generates JavaScript code from the IR tree.
 
-from slimit import ast
-from slimit.ast import (
-    String,
-    Identifier,
-    ExprStatement,
-    DotAccessor,
-    VarStatement,
-    VarDecl,
-    FunctionCall,
-    Assign as JSAssign,
-    UnaryOp,
-    If,
-    Block,
-    Return as JSReturn,
-    FuncDecl,
-)
-from slimit.parser import Parser
-from slimit.scope import SymbolTable
-from slimit.visitors.scopevisitor import (
-    Visitor,
-    ScopeTreeVisitor,
-    fill_scope_references,
-)
+The code is emitted as text directly from the language nodes; the free
+variables of the generated functions are found with a lightweight scan
+over the tokens of the code, instead of parsing it into a syntax tree.
+"""
+
+import itertools
+import json
+import re
 
 from tonnikala.languages.base import LanguageNode, ComplexNode, BaseGenerator
+from tonnikala.languages.javascript.jslex import JsLexer
 from ...runtime.debug import TemplateSyntaxError
 
+name_counter = itertools.count(1)
+ALWAYS_BUILTINS = """
+    undefined
+    arguments
+""".split()
 
-class FreeVariableAnalyzerVisitor(Visitor):
-    """Mangles names.
+INDENT = "    "
 
-    Walks over a parsed tree and changes ID values to corresponding
-    mangled names.
-    """
+_insignificant_tokens = frozenset(["ws", "comment", "linecomment"])
+_brackets = {"(": ")", "[": "]", "{": "}"}
 
-    def __init__(self):
-        self.free_variables = set()
+# the tokens after which a "function" keyword starts a declaration
+# rather than a function expression
+_statement_starts = frozenset([None, ";", "{", "}"])
 
-    @staticmethod
-    def _is_mangle_candidate(id_node):
-        """Return True if Identifier node is a candidate for mangling.
-
-        There are 5 cases when Identifier is a mangling candidate:
-        1. Function declaration identifier
-        2. Function expression identifier
-        3. Function declaration/expression parameter
-        4. Variable declaration identifier
-        5. Identifier is a part of an expression (primary_expr_no_brace rule)
-        """
-        return getattr(id_node, "_mangle_candidate", False)
+_funcspec_re = re.compile(r"\s*([^\d\W][\w$]*)\s*\((.*)\)\s*\Z", re.S)
 
-    def visit_Identifier(self, node):
-        """Mangle names."""
+# the operators that need an operand after them, and the tokens that
+# cannot start one
+_binary_operators = frozenset(
+    """
+    = == === != !== < > <= >= + - * / % & | ^ << >> >>> && || ! ~ .
+    += -= *= /= %= &= |= ^= <<= >>= >>>=
+    """.split()
+)
+_operand_ends = frozenset([None, ")", "]", "}", ",", ";"])
 
-        if not self._is_mangle_candidate(node):
-            return
 
-        name = node.value
-        symbol = node.scope.resolve(node.value)
-        if symbol is None:
-            self.free_variables.add(name)
+def iter_tokens(code):
+    """
+    Yield the ``(type, value)`` pairs of the significant tokens in the
+    JavaScript code, skipping whitespace and comments.
+    """
 
+    for token in JsLexer().lex(code):
+        if token[0] not in _insignificant_tokens:
+            yield token
 
-try:
-    import sysconfig
 
-    HAS_ASSERT = bool(sysconfig.get_config_var("Py_DEBUG"))
-    del sysconfig
-except ImportError:
-    HAS_ASSERT = False
+class JsString(object):
+    """A string constant in the generated code"""
 
-name_counter = 0
-ALWAYS_BUILTINS = """
-    undefined
-""".split()
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, ensure_ascii=False)
 
 
 def Str(s):
-    return String(json.dumps(s, ensure_ascii=False))
+    return JsString(s)
+
+
+def as_argument(expression):
+    """
+    Make the expression safe to use as a single function argument
+    """
 
+    expression = str(expression).strip()
+    if "," in expression:
+        return "(%s)" % expression
 
-def Name(id, ctx=None):
-    return Identifier(id)
+    return expression
 
 
-def Load():
-    pass
+class JsStatement(object):
+    def render(self, indent):  # pragma: no cover
+        """Return the list of the lines of code of this statement"""
 
+        raise NotImplementedError("abstract method not implemented")
 
-Store = Load
-Expr = ExprStatement
+    def to_code(self, indent=""):
+        return "\n".join(self.render(indent))
 
 
-def Attribute(value, attr, ctx=None):
-    return DotAccessor(value, Name(attr))
+def render_body(body, indent):
+    lines = []
+    for statement in coalesce_outputs(body):
+        lines.extend(statement.render(indent))
 
+    return lines
 
-def SimpleCall(func, args=None):
-    # bad naming?
-    return FunctionCall(identifier=func, args=args)
 
+class Code(JsStatement):
+    """Statements given as code, emitted verbatim"""
 
-def Assign(targets, value):
-    if len(targets) != 1:
-        raise TypeError("Only single assignments supported")
+    def __init__(self, code):
+        self.code = code
 
-    return JSAssign(op="=", left=targets[0], right=value)
+    def render(self, indent):
+        return [indent + self.code]
 
 
-def AssignNewVariable(targets, value):
-    return VarStatement([VarDecl(targets[0], value)])
+class Output(JsStatement):
+    def __init__(self, args):
+        self.args = list(args)
 
+    def render(self, indent):
+        args = ", ".join(as_argument(i) for i in self.args)
+        return [indent + "__TK__output(%s);" % args]
 
-def Return(value=None):
-    return JSReturn(expr=value)
 
+class If(JsStatement):
+    def __init__(self, test, body):
+        self.test = test
+        self.body = body
 
-def SimpleFunctionDef(name, arguments=()):
-    arguments = list(arguments)
-    return FuncDecl(identifier=Name(name), parameters=arguments, elements=[])
+    def render(self, indent):
+        return (
+            [indent + "if (%s) {" % str(self.test).strip()]
+            + render_body(self.body, indent + INDENT)
+            + [indent + "}"]
+        )
+
+
+class Function(JsStatement):
+    """
+    A function declaration; ``render_expression`` renders it as a function
+    expression instead
+    """
+
+    def __init__(self, name, params, body):
+        self.name = name
+        self.params = params
+        self.body = body
 
+    def render_expression(self, indent):
+        head = "function %s(%s) {" % (self.name, self.params.strip())
+        if not self.name:
+            head = "function (%s) {" % self.params.strip()
 
-def assign_func_body(funcdecl, new_body=None):
-    funcdecl.elements = [] if new_body is None else new_body
-    return new_body
+        body = render_body(self.body, indent + INDENT)
+        return [head] + body + [indent + "}"]
 
+    def render(self, indent):
+        lines = self.render_expression(indent)
+        lines[0] = indent + lines[0]
+        return lines
 
-def get_body(funcdecl):
-    return funcdecl.elements
 
+class Call(JsStatement):
+    """A call statement whose last argument is a function expression"""
 
-def NameX(id, store=False):
-    return Name(id=id, ctx=Load() if not store else Store())
+    def __init__(self, prefix, function, suffix=");"):
+        self.prefix = prefix
+        self.function = function
+        self.suffix = suffix
+
+    def render(self, indent):
+        lines = self.function.render_expression(indent)
+        lines[0] = indent + self.prefix + lines[0]
+        lines[-1] += self.suffix
+        return lines
+
+
+def coalesce_outputs(body):
+    """
+    Coalesce the consecutive output statements
+
+        __TK__output('foo');
+        __TK__output('bar');
+        __TK__output(baz);
+        __TK__output('xyzzy');
+
+    into
+
+        __TK__output('foobar', baz, 'xyzzy');
+    """
+
+    rv = []
+    for statement in body:
+        if not isinstance(statement, Output):
+            rv.append(statement)
+            continue
+
+        if not rv or not isinstance(rv[-1], Output):
+            rv.append(Output(statement.args))
+            continue
+
+        args = rv[-1].args
+        for arg in statement.args:
+            if isinstance(arg, JsString) and args and isinstance(args[-1], JsString):
+                args[-1] = JsString(args[-1].value + arg.value)
+            else:
+                args.append(arg)
+
+    return rv
+
+
+class _Scope(object):
+    def __init__(self, parent, declared=()):
+        self.parent = parent
+        self.declared = set(declared)
+
+    def resolves(self, name):
+        scope = self
+        while scope is not None:
+            if name in scope.declared:
+                return True
+
+            scope = scope.parent
+
+        return False
 
 
 class FreeVarFinder(object):
-    def __init__(self, tree):
-        self.tree = tree
+    """
+    Finds the free variables of generated code by scanning its tokens.
+
+    Function parameters, ``var``, ``let`` and ``const`` declarations,
+    function names and ``catch`` variables declare names in the scope of
+    the enclosing function (the declarations are hoisted); any other
+    identifier that is not a property name refers to a variable, which
+    is free unless declared in an enclosing function.
+    """
+
+    def __init__(self, code):
+        self.code = code
 
     @classmethod
     def for_ast(cls, tree):
+        if isinstance(tree, JsStatement):
+            tree = tree.to_code()
+
         return cls(tree)
 
     def get_free_variables(self):
-        sym_table = SymbolTable()
-        visitor = ScopeTreeVisitor(sym_table)
-        visitor.visit(self.tree)
-        fill_scope_references(self.tree)
+        tokens = list(iter_tokens(self.code))
+        n_tokens = len(tokens)
+
+        scope = _Scope(None)
+        references = []
+
+        # stack of (closing bracket, the scope to restore when closed)
+        brackets = []
+
+        # stack of (bracket depth, scope to restore) of arrow functions
+        # with an expression body
+        arrow_scopes = []
+
+        pending_params = None
+        declaration_depth = None
+        expect_declaration = False
+
+        def value_at(index):
+            if 0 <= index < n_tokens:
+                return tokens[index][1]
+
+            return None
+
+        i = 0
+        while i < n_tokens:
+            type_, value = tokens[i]
+            prev = value_at(i - 1)
+
+            if type_ == "punct" and value in (",", ";", ")", "]", "}"):
+                if value in (")", "]", "}") and brackets:
+                    closing, restored = brackets.pop()
+                    if restored is not None:
+                        scope = restored
+
+                depth = len(brackets)
+                while arrow_scopes and (
+                    depth < arrow_scopes[-1][0]
+                    or (depth == arrow_scopes[-1][0] and value in (",", ";"))
+                ):
+                    scope = arrow_scopes.pop()[1]
+
+                if declaration_depth is not None:
+                    if depth < declaration_depth or (
+                        depth == declaration_depth and value == ";"
+                    ):
+                        declaration_depth = None
+
+                    elif depth == declaration_depth and value == ",":
+                        expect_declaration = True
+
+            elif type_ == "punct" and value in _brackets:
+                restored = None
+                if value == "{" and pending_params is not None:
+                    restored = scope
+                    scope = _Scope(scope, pending_params)
+                    pending_params = None
+
+                brackets.append((_brackets[value], restored))
+
+            elif type_ == "punct" and value == "=" and value_at(i + 1) == ">":
+                params = self.get_arrow_params(tokens, i)
+                references = [r for r in references if r[2] not in params]
+                params = set(tokens[j][1] for j in params)
+                i += 2
+                if value_at(i) == "{":
+                    pending_params = params
+                    continue
+
+                arrow_scopes.append((len(brackets), scope))
+                scope = _Scope(scope, params)
+                continue
+
+            elif type_ == "keyword" and value == "function":
+                i += 1
+                name = None
+                if i < n_tokens and tokens[i][0] == "id":
+                    name = tokens[i][1]
+                    i += 1
+
+                params = set()
+                if value_at(i) == "(":
+                    i += 1
+                    while i < n_tokens and tokens[i][1] != ")":
+                        if tokens[i][0] == "id":
+                            params.add(tokens[i][1])
+
+                        i += 1
+
+                    i += 1
+
+                if name is not None:
+                    params.add(name)
+                    if prev in _statement_starts:
+                        scope.declared.add(name)
+
+                pending_params = params
+                continue
+
+            elif value in ("var", "const") or (
+                value == "let" and i + 1 < n_tokens and tokens[i + 1][0] == "id"
+            ):
+                declaration_depth = len(brackets)
+                expect_declaration = True
+
+            elif type_ == "keyword" and value == "catch":
+                if value_at(i + 1) == "(" and i + 2 < n_tokens:
+                    scope.declared.add(tokens[i + 2][1])
+                    brackets.append((")", None))
+                    i += 3
+                    continue
+
+            elif value in ("in", "of"):
+                if declaration_depth is not None and not expect_declaration:
+                    declaration_depth = None
+
+            elif type_ == "id":
+                if expect_declaration:
+                    scope.declared.add(value)
+                    expect_declaration = False
+
+                elif prev == ".":
+                    pass
+
+                elif (
+                    value_at(i + 1) == ":"
+                    and prev in ("{", ",")
+                    and brackets
+                    and brackets[-1][0] == "}"
+                ):
+                    # a property name in an object literal
+                    pass
+
+                else:
+                    references.append((value, scope, i))
+
+            i += 1
+
+        return set(name for name, scope, i in references if not scope.resolves(name))
 
-        free_var_analysis = FreeVariableAnalyzerVisitor()
-        free_var_analysis.visit(self.tree)
-        return free_var_analysis.free_variables
+    @staticmethod
+    def get_arrow_params(tokens, arrow_index):
+        """
+        Return the indices of the parameter tokens of the arrow function
+        whose ``=>`` starts at the given index
+        """
 
+        before = arrow_index - 1
+        if before < 0:
+            return set()
 
-def parse(expression, mode="eval"):
-    if mode == "eval":
-        return Parser().parse(expression).children()[0].expr
-    elif mode == "exec":
-        return Parser().parse(expression).children()
+        if tokens[before][0] == "id":
+            return {before}
 
-    raise TypeError("Only eval, exec modes allowed")
+        params = set()
+        if tokens[before][1] == ")":
+            depth = 0
+            for j in range(before, -1, -1):
+                value = tokens[j][1]
+                if value == ")":
+                    depth += 1
+                elif value == "(":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif tokens[j][0] == "id" and depth == 1:
+                    params.add(j)
+
+        return params
+
+
+def check_syntax(code, mode="eval"):
+    """
+    Return an error message if the tokens of the expression (or of the
+    statements in exec mode) are not balanced: a bracket is not closed
+    or is closed by another, a string is not terminated, an operator is
+    missing its right operand or the expression is empty; None if no
+    error is found. The code with template literals is not checked, as
+    the lexer does not know them.
+    """
+
+    tokens = [value for type_, value in iter_tokens(code)]
+    if not tokens and mode == "eval":
+        return "Empty expression"
+
+    if "`" in tokens:
+        return None
+
+    brackets = []
+    for value, following in zip(tokens, tokens[1:] + [None]):
+        if value in _brackets:
+            brackets.append(_brackets[value])
+        elif value in _brackets.values():
+            if not brackets or brackets.pop() != value:
+                return "Unexpected %s" % value
+        elif value in ("'", '"'):
+            return "Unterminated string"
+        elif value in _binary_operators and following in _operand_ends:
+            return "Missing operand after %s" % value
+
+    if brackets:
+        return "Unclosed %s" % {v: k for k, v in _brackets.items()}[brackets[-1]]
+
+    return None
 
 
 def get_fragment_ast(expression, mode="eval"):
-    if not isinstance(expression, str):
-        return expression
+    """
+    Return the code of the expression (or the statements in exec mode);
+    kept for the interface shared with the Python generator. Raises
+    TemplateSyntaxError if the tokens of the code are not balanced.
+    """
 
-    tree = parse(expression, mode=mode)
-    return tree
+    if mode not in ("eval", "exec"):
+        raise TypeError("Only eval, exec modes allowed")
 
+    code = str(expression).strip()
+    error = check_syntax(code, mode)
+    if error is not None:
+        raise TemplateSyntaxError(
+            "%s in JavaScript code %s" % (error, code), node=expression
+        )
 
-def get_func_name(func):
-    return func.identifier.value
+    return code
 
 
 def gen_name():
-    global name_counter
-    name_counter += 1
-    return "__TK__%d__" % name_counter
+    return "__TK__%d__" % next(name_counter)
 
 
 def static_expr_to_bool(expr):
@@ -191,49 +480,26 @@ class JavascriptNode(LanguageNode):
     is_top_level = False
 
     def generate_output_ast(self, code, generator, parent, escape=False):
-        func = Name(id="__TK__output", ctx=Load())
-
         if not isinstance(code, list):
             code = [code]
 
-        rv = []
-        for i in code:
-            e = Expr(SimpleCall(func, [i]))
-            e.output_args = [i]
-            rv.append(e)
-        return rv
+        return [Output([i]) for i in code]
 
     def make_buffer_frame(self, body):
-        new_body = []
-        new_body.append(
-            AssignNewVariable(
-                targets=[
-                    NameX("__TK__output", store=True),
-                ],
-                value=SimpleCall(NameX("__TK__mkbuffer")),
-            )
-        )
-
+        new_body = [Code("var __TK__output = __TK__mkbuffer();")]
         new_body.extend(body)
-        new_body.append(Return(value=NameX("__TK__output")))
+        new_body.append(Code("return __TK__output;"))
         return new_body
 
     def make_function(self, name, body, add_buffer=False, arguments=()):
-        func = SimpleFunctionDef(name, arguments=arguments)
-        new_body = assign_func_body(func, [])
-
         if add_buffer:
-            new_body.extend(self.make_buffer_frame(body))
-
-        else:
-            new_body.extend(body)
+            body = self.make_buffer_frame(body)
 
-        return func
+        return Function(name, ", ".join(arguments), body)
 
     def generate_varscope(self, body):
         name = gen_name()
-        rv = [self.make_function(name, body), Expr(SimpleCall(NameX(name), []))]
-        return rv
+        return [self.make_function(name, body), Code("%s();" % name)]
 
 
 class JsOutputNode(JavascriptNode):
@@ -264,11 +530,7 @@ class JsTranslatableOutputNode(JsOutputNode):
         if self.needs_escape:
             name = "egettext"
 
-        expr = SimpleCall(
-            NameX(name),
-            [Str(s=self.text)],
-        )
-        return expr
+        return "%s(%s)" % (name, Str(s=self.text))
 
 
 class JsExpressionNode(JavascriptNode):
@@ -280,13 +542,13 @@ class JsExpressionNode(JavascriptNode):
         return [self.get_expression()]
 
     def get_expression(self):
-        return SimpleCall(NameX("__TK__escape"), [self.get_unescaped_expression()])
+        return "__TK__escape(%s)" % as_argument(self.get_unescaped_expression())
 
     def get_unescaped_expression(self):
         return get_fragment_ast(self.expr)
 
     def generate_ast(self, generator, parent):
-        return self.generate_output_ast(self.get_expression(), generator, parent)
+        return self.generate_output_ast([self.get_expression()], generator, parent)
 
 
 class JsCodeNode(JavascriptNode):
@@ -295,29 +557,7 @@ class JsCodeNode(JavascriptNode):
         self.source = source
 
     def generate_ast(self, generator, parent):
-        return get_fragment_ast(self.source, mode="exec")
-
-
-#
-# def coalesce_strings(args):
-#     rv = []
-#     str_on = None
-#
-#     for i in args:
-#         if isinstance(i, Str):
-#             if str_on:
-#                 str_on.s += i.s
-#                 continue
-#
-#             str_on = i
-#
-#         else:
-#             str_on = None
-#
-#         rv.append(i)
-#
-#     return rv
-#
+        return [Code(get_fragment_ast(self.source, mode="exec"))]
 
 
 class JsComplexNode(ComplexNode, JavascriptNode):
@@ -344,17 +584,13 @@ class JsIfNode(JsComplexNode):
         if boolean is True:
             return self.generate_child_ast(generator, parent)
 
-        node = If(
-            test,
-            Block(self.generate_child_ast(generator, self)),
-        )
+        node = If(test, self.generate_child_ast(generator, self))
         return [node]
 
 
 def JsUnlessNode(self, expression):
     expression = get_fragment_ast(expression)
-    expression = UnaryOp(op="!", value=expression)
-    return JsIfNode(expression)
+    return JsIfNode("!(%s)" % expression)
 
 
 class JsImportNode(JavascriptNode):
@@ -364,14 +600,9 @@ class JsImportNode(JavascriptNode):
         self.href = href
 
     def generate_ast(self, generator, parent):
-        node = Assign(
-            targets=[NameX(str(self.alias), store=True)],
-            value=SimpleCall(
-                func=Attribute(
-                    value=NameX("__TK__", store=False), attr="importDefs", ctx=Load()
-                ),
-                args=[NameX("__TK__context"), Str(s=self.href)],
-            ),
+        node = Code(
+            "%s = __TK__.importDefs(__TK__context, %s);"
+            % (self.alias, Str(s=self.href))
         )
 
         generator.add_import_source(self.href)
@@ -400,17 +631,11 @@ class JsAttributeNode(JsComplexNode):
             # expression, these are handled by
             # _TK_output.output_boolean_attr,
             # given the name, and unescaped expression!
+            expression = self.children[0].get_unescaped_expression()
             return [
-                Expr(
-                    SimpleCall(
-                        func=Attribute(
-                            value=NameX("__TK__output"), attr="attr", ctx=Load()
-                        ),
-                        args=[
-                            Str(s=self.name),
-                            self.children[0].get_unescaped_expression(),
-                        ],
-                    )
+                Code(
+                    "__TK__output.attr(%s, %s);"
+                    % (Str(s=self.name), as_argument(expression))
                 )
             ]
 
@@ -430,9 +655,7 @@ class JsAttrsNode(JavascriptNode):
 
     def generate_ast(self, generator, parent):
         expression = get_fragment_ast(self.expression)
-
-        output = SimpleCall(NameX("__TK__output_attrs"), args=[expression])
-
+        output = "__TK__output_attrs(%s)" % as_argument(expression)
         return self.generate_output_ast(output, generator, parent)
 
 
@@ -443,15 +666,10 @@ class JsForNode(JsComplexNode):
         self.expression = parts[1]
 
     def generate_contents(self, generator, parent):
-        body = get_fragment_ast(
-            "__TK__foreach(%s, function (%s) { });" % (self.expression, self.vars),
-            "exec",
-        )
-
-        for_node = body[0]
-        func_frame = for_node.expr.args[1]
-        func_frame.elements = self.generate_child_ast(generator, self)
-        return [for_node]
+        func_frame = Function("", self.vars, self.generate_child_ast(generator, self))
+        expression = get_fragment_ast(self.expression)
+        prefix = "__TK__foreach(%s, " % as_argument(expression)
+        return [Call(prefix, func_frame)]
 
     def generate_ast(self, generator, parent):
         return self.generate_contents(generator, parent)
@@ -466,19 +684,22 @@ class JsDefineNode(JsComplexNode):
         self.funcspec = funcspec
 
     def generate_ast(self, generator, parent):
-        body = get_fragment_ast("function %s{}" % self.funcspec, "exec")
-
-        def_node = body[0]
-        assign_func_body(
-            def_node,
-            self.make_buffer_frame(
-                self.generate_child_ast(generator, self),
-            ),
+        match = _funcspec_re.match(self.funcspec)
+        if not match:
+            raise TemplateSyntaxError(
+                "Invalid function specification %s" % self.funcspec
+            )
+
+        name, params = match.groups()
+        def_node = Function(
+            name,
+            params,
+            self.make_buffer_frame(self.generate_child_ast(generator, self)),
         )
 
         # move the function out of the closure
         if parent.is_top_level:
-            generator.add_top_def(get_func_name(def_node), def_node)
+            generator.add_top_def(name, def_node)
             return []
 
         return [def_node]
@@ -491,13 +712,29 @@ class JsWithNode(JsComplexNode):
 
     def generate_ast(self, generator, parent):
         var_defs = get_fragment_ast(self.vars, "exec")
-        for i in var_defs:
-            if not isinstance(i, ast.ExprStatement):
+
+        # only expression statements are allowed; check the first
+        # token of each statement
+        statement_start = True
+        depth = 0
+        for type_, value in iter_tokens(var_defs):
+            if statement_start and type_ == "keyword":
                 raise TemplateSyntaxError(
                     "Only assignment statements allowed in With; not %s" % self.vars
                 )
 
-        body = var_defs + self.generate_child_ast(generator, self)
+            statement_start = False
+            if value in _brackets:
+                depth += 1
+            elif value in _brackets.values():
+                depth -= 1
+            elif value == ";" and depth == 0:
+                statement_start = True
+
+        if not var_defs.endswith(";"):
+            var_defs += ";"
+
+        body = [Code(var_defs)] + self.generate_child_ast(generator, self)
         return self.generate_varscope(body)
 
 
@@ -525,23 +762,17 @@ class JsBlockNode(JsComplexNode):
     def generate_ast(self, generator, parent):
         is_extended = isinstance(parent, JsExtendsNode)
 
-        body = get_fragment_ast("function %s () {}" % self.name, "exec")
-
-        def_node = body[0]
-        assign_func_body(
-            def_node,
-            self.make_buffer_frame(
-                self.generate_child_ast(generator, self),
-            ),
+        def_node = Function(
+            self.name,
+            "",
+            self.make_buffer_frame(self.generate_child_ast(generator, self)),
         )
 
         generator.add_block(self.name, def_node)
 
         if not is_extended:
             # call the block in place
-            return self.generate_output_ast(
-                [SimpleCall(NameX(self.name), [])], self, parent
-            )
+            return self.generate_output_ast(["%s()" % self.name], self, parent)
 
         else:
             return []
@@ -559,104 +790,6 @@ class JsExtendsNode(JsComplexNode):
         return self.generate_child_ast(generator, self)
 
 
-def ast_equals(tree1, tree2):
-    x1 = ast.dump(tree1)
-    x2 = ast.dump(tree2)
-    return x1 == x2
-
-
-def coalesce_outputs(tree):
-    """
-    Coalesce the constant output expressions
-
-        __output__('foo')
-        __output__('bar')
-        __output__(baz)
-        __output__('xyzzy')
-
-    into
-
-        __output__('foobar', baz, 'xyzzy')
-    """
-
-    return tree
-    #
-    # coalesce_all_outputs = True
-    # if coalesce_all_outputs:
-    #     should_coalesce = lambda n: True
-    # else:
-    #     should_coalesce = lambda n: n.output_args[0].__class__ is Str
-    #
-    # class OutputCoalescer(NodeVisitor):
-    #     def visit(self, node):
-    #         # if - else expression also has a body! it is not we want, though.
-    #         if hasattr(node, 'body') and isinstance(node.body, Iterable):
-    #             # coalesce continuous string output nodes
-    #             new_body = []
-    #             output_node = None
-    #
-    #             def coalesce_strs():
-    #                 if output_node:
-    #                     output_node.value.args[:] = \
-    #                         coalesce_strings(output_node.value.args)
-    #
-    #             for i in node.body:
-    #                 if hasattr(i, 'output_args') and should_coalesce(i):
-    #                     if output_node:
-    #                         output_node.value.args.extend(i.output_args)
-    #                         continue
-    #
-    #                     output_node = i
-    #
-    #                 else:
-    #                     coalesce_strs()
-    #                     output_node = None
-    #
-    #                 new_body.append(i)
-    #
-    #             coalesce_strs()
-    #             node.body[:] = new_body
-    #
-    #         NodeVisitor.visit(self, node)
-    #
-    #     def check(self, node):
-    #         """
-    #         Coalesce _TK_output(_TK_escape(literal(x))) into
-    #         _TK_output(x).
-    #         """
-    #         if not ast_equals(node.func, NameX('__TK__output')):
-    #             return
-    #
-    #         for i in range(len(node.args)):
-    #             arg1 = node.args[i]
-    #             if not arg1.__class__.__name__ == 'Call':
-    #                 continue
-    #
-    #             if not ast_equals(arg1.func, NameX('__TK__escape')):
-    #                 continue
-    #
-    #             if len(arg1.args) != 1:
-    #                 continue
-    #
-    #             arg2 = arg1.args[0]
-    #             if not arg2.__class__.__name__ == 'Call':
-    #                 continue
-    #
-    #             if not ast_equals(arg2.func, NameX('literal')):
-    #                 continue
-    #
-    #             if len(arg2.args) != 1:
-    #                 continue
-    #
-    #             node.args[i] = arg2.args[0]
-    #
-    #     def visit_Call(self, node):
-    #         self.check(node)
-    #         self.generic_visit(node)
-    #
-    # OutputCoalescer().visit(tree)
-
-
 class JsRootNode(JsComplexNode):
     def __init__(self):
         super(JsRootNode, self).__init__()
@@ -689,20 +822,17 @@ class JsRootNode(JsComplexNode):
             if i.startswith("__TK__") or i in ALWAYS_BUILTINS:
                 free_variables.discard(i)
 
-        # discard the names of toplevel funcs from free variables
-        # free_variables.difference_update(generator.top_level_names)
+        free_variables = sorted(free_variables)
 
         modules = ["tonnikala/runtime"] + list(generator.import_sources)
 
         if extended:
             modules.append(extended)
 
-        # var_statement_vars = set(free_variables)|set(
-
         code = "define(%s, function(__TK__) {\n" % json.dumps(modules)
         code += '    "use strict";\n'
         code += "    var __TK__mkbuffer = __TK__.Buffer,\n"
-        code += "        __TK__escape = __TK__.escape,\n"
+        code += "        __TK__escape = __TK__.escapeString,\n"
         code += "        __TK__foreach = __TK__.foreach,\n"
         code += "        literal = __TK__.literal,\n"
 
@@ -714,48 +844,29 @@ class JsRootNode(JsComplexNode):
         code += "        __TK__output_attrs = __TK__.outputAttrs,\n"
         code += "        __TK__ctxadd = __TK__.addToContext,\n"
         code += "        __TK__ctxbind = __TK__.bindFromContext;\n"
-        code += "    return function __TK__binder (__TK__context) {\n"
-        code += "        var %s;\n" % ",\n            ".join(free_variables)
+        code += "    return function __TK__binder(__TK__context) {\n"
+
+        if free_variables:
+            code += "        var %s;\n" % ",\n            ".join(free_variables)
+
+        indent = INDENT * 2
+        for i in generator.imports + toplevel_funcs:
+            code += "\n".join(i.render(indent)) + "\n"
 
         if extended:
             # an extended template does not have a __main__ (it is inherited)
-            code += "        __TK__parent_template(__TK__context)\n"
+            code += "        __TK__parent_template(__TK__context);\n"
 
         for i in free_variables:
-            code += '        %s = __TK__ctxbind(__TK__context, "%s");\n' % (i, i)
+            code += "        %s = __TK__ctxbind(__TK__context, %s);\n" % (
+                i,
+                json.dumps(i),
+            )
 
         code += "        return new __TK__.BoundTemplate(__TK__context);\n"
         code += "    };\n"
         code += "});\n"
-
-        tree = parse(code)
-
-        class LocatorAndTransformer(Visitor):
-            binder = None
-
-            def visit_FuncExpr(self, node):
-                if not node.identifier:
-                    self.generic_visit(node)
-                    return
-
-                name = node.identifier.value
-                if name == "__TK__binder" and not self.binder:
-                    self.binder = node
-                    return
-
-                self.generic_visit(node)
-                return node
-
-        locator = LocatorAndTransformer()
-        locator.visit(tree)
-
-        # inject the other top level funcs in the binder
-        binder = locator.binder
-        get_body(binder)[1:1] = toplevel_funcs
-        get_body(binder)[1:1] = generator.imports
-
-        coalesce_outputs(tree)
-        return tree.to_ecma()
+        return code
 
 
 class Generator(BaseGenerator):
@@ -786,20 +897,17 @@ class Generator(BaseGenerator):
         self.imports = []
         self.import_sources = []
 
-    def add_bind_decorator(self, block):
-        name = block.identifier.value
-        return Expr(
-            SimpleCall(Name("__TK__ctxadd"), [Name("__TK__context"), Str(name), block])
-        )
+    def add_bind_decorator(self, name, block):
+        return Call("__TK__ctxadd(__TK__context, %s, " % Str(name), block)
 
     def add_block(self, name, block):
         self.top_level_names.add(name)
-        block = self.add_bind_decorator(block)
+        block = self.add_bind_decorator(name, block)
         self.blocks.append(block)
 
     def add_top_def(self, name, defblock):
         self.top_level_names.add(name)
-        defblock = self.add_bind_decorator(defblock)
+        defblock = self.add_bind_decorator(name, defblock)
         self.top_defs.append(defblock)
 
     def add_top_level_import(self, name, node):
@@ -1,4 +1,6 @@
 import ast
+import copy
+import itertools
 import sys
 from ast import (
     Call,
@@ -47,8 +49,9 @@ from collections.abc import Iterable
 
 from .astalyzer import FreeVarFinder
 from ..base import LanguageNode, ComplexNode, BaseGenerator
-from ...helpers import StringWithLocation
+from ...helpers import StringWithLocation, escape
 from ...runtime.debug import TemplateSyntaxError
+from ...runtime.python import LAZY_VALUES_KEY
 
 try:  # pragma: no cover
     import sysconfig
@@ -58,7 +61,9 @@ try:  # pragma: no cover
 except ImportError:  # pragma: no cover
     HAS_ASSERT = False
 
-name_counter = 0
+# itertools.count is used instead of a global integer so that templates
+# compiled concurrently in several threads never get clashing names
+name_counter = itertools.count(1)
 ALWAYS_BUILTINS = """
     False
     True
@@ -189,12 +194,11 @@ def get_fragment_ast(expression, mode="eval", adjust=(0, 0)):
 
 
 def gen_name(typename=None):
-    global name_counter
-    name_counter += 1
+    number = next(name_counter)
     if typename:
-        return "__TK__typed__%s__%d__" % (typename, name_counter)
+        return "__TK__typed__%s__%d__" % (typename, number)
     else:
-        return "__TK_%d__" % (name_counter)
+        return "__TK_%d__" % (number)
 
 
 def static_eval(expr):
@@ -225,6 +229,7 @@ class PythonNode(LanguageNode):
         for i in code:
             if position is not None:
                 i.lineno, i.col_offset = position
+                i.end_lineno, i.end_col_offset = position
 
             e = Expr(simple_call(func, [i]))
             e.output_args = [i]
@@ -409,13 +414,61 @@ class PyImportNode(PythonNode):
             ),
         )
 
+        generator.add_template_href(self.href)
         if parent.is_top_level:
-            generator.add_top_level_import(str(self.alias), node)
+            generator.add_top_level_import(str(self.alias), node, self.href)
             return []
 
         return [node]
 
 
+class PyIncludeNode(PythonNode):
+    def __init__(self, href):
+        super(PyIncludeNode, self).__init__()
+        self.href = href
+
+    def get_href_expression(self):
+        from tonnikala.expr import handle_text_node
+        from tonnikala.ir.nodes import DynamicText, Text
+
+        node = handle_text_node(self.href)
+        if isinstance(node, Text):
+            return Str(s=node.text)
+
+        parts = node.children if isinstance(node, DynamicText) else [node]
+        values = []
+        for i in parts:
+            if isinstance(i, Text):
+                values.append(Str(s=i.text))
+            else:
+                values.append(
+                    ast.FormattedValue(
+                        value=get_fragment_ast(i.expression),
+                        conversion=-1,
+                        format_spec=None,
+                    )
+                )
+
+        return ast.JoinedStr(values=values)
+
+    def generate_ast(self, generator, parent):
+        href = self.get_href_expression()
+        if is_str_node(href):
+            generator.add_template_href(literal_eval(href))
+
+        include = simple_call(
+            func=Attribute(
+                value=NameX("__TK__runtime", store=False),
+                attr="include",
+                ctx=Load(),
+            ),
+            args=[NameX("__TK__original_context"), href],
+        )
+
+        # the Buffer of the included template is output as is
+        return self.generate_output_ast([include], generator, parent)
+
+
 class PyAttributeNode(PyComplexNode):
     def __init__(self, name, value):
         super(PyAttributeNode, self).__init__()
@@ -467,8 +520,17 @@ class PyAttrsNode(PythonNode):
     def generate_ast(self, generator, parent):
         expression = get_fragment_ast(self.expression)
 
-        output = simple_call(NameX("__TK__output_attrs"), args=[expression])
-        return self.generate_output_ast([output], generator, parent)
+        # the attributes are written directly into the output buffer
+        return [
+            Expr(
+                simple_call(
+                    func=Attribute(
+                        value=NameX("__TK__output"), attr="output_attrs", ctx=Load()
+                    ),
+                    args=[expression],
+                )
+            )
+        ]
 
 
 class PyForNode(PyComplexNode):
@@ -703,6 +765,797 @@ def coalesce_outputs(tree):
     OutputCoalescer().visit(tree)
 
 
+def get_loop_access_path(node, target):
+    """
+    Return the access path from the loop variable ``target`` to the
+    expression ``node`` in the format understood by
+    ``Buffer.output_loop``: a tuple of steps, each either an attribute
+    name or a 1-tuple containing a constant subscript key. Return ``None``
+    if the expression is anything more complicated than that.
+    """
+
+    path = []
+    while True:
+        if isinstance(node, Name):
+            if node.id != target:
+                return None
+
+            path.reverse()
+            return tuple(path)
+
+        if isinstance(node, Attribute):
+            path.append(node.attr)
+
+        elif isinstance(node, ast.Subscript):
+            key = node.slice
+            if sys.version_info < (3, 9) and isinstance(key, ast.Index):
+                key = key.value
+
+            if not isinstance(key, ast.Constant) or key.value.__class__ not in (
+                str,
+                int,
+            ):
+                return None
+
+            path.append((key.value,))
+
+        else:
+            return None
+
+        node = node.value
+
+
+def get_loop_output_parts(for_node):
+    """
+    If the body of the for loop consists only of a single
+    ``__TK__output`` call of constant strings and escaped access paths
+    of the loop variable, return the parts tuple for
+    ``Buffer.output_loop``, else ``None``.
+    """
+
+    if for_node.orelse or not isinstance(for_node.target, Name):
+        return None
+
+    if len(for_node.body) != 1 or not isinstance(for_node.body[0], Expr):
+        return None
+
+    call = for_node.body[0].value
+    if not isinstance(call, Call) or call.keywords:
+        return None
+
+    if not ast_equals(call.func, NameX("__TK__output")):
+        return None
+
+    target = for_node.target.id
+    parts = []
+    for i in call.args:
+        if is_str_node(i):
+            parts.append(i.value)
+            continue
+
+        if (
+            not isinstance(i, Call)
+            or i.keywords
+            or len(i.args) != 1
+            or not ast_equals(i.func, NameX("__TK__escape"))
+        ):
+            return None
+
+        path = get_loop_access_path(i.args[0], target)
+        if path is None:
+            return None
+
+        parts.append(path)
+
+    return tuple(parts)
+
+
+def iter_statement_lists(node):
+    """
+    Yield all statement lists within the given node, not descending
+    into nested function or class definitions.
+    """
+
+    for field in ("body", "orelse", "finalbody"):
+        statements = getattr(node, field, None)
+        if not isinstance(statements, list):
+            continue
+
+        yield statements
+        for i in statements:
+            if not isinstance(i, (FunctionDef, ast.ClassDef)):
+                yield from iter_statement_lists(i)
+
+    for handler in getattr(node, "handlers", ()):
+        yield from iter_statement_lists(handler)
+
+
+def loaded_names(node):
+    return [
+        i.id
+        for i in ast.walk(node)
+        if isinstance(i, Name) and not isinstance(i.ctx, Store)
+    ]
+
+
+def batch_simple_loops(tree):
+    """
+    Replace the simple loops
+
+        for x in items:
+            __TK__output('<li>', __TK__escape(x.name), '</li>')
+
+    with a single call
+
+        __TK__output.output_loop(items, ('<li>', ('name',), '</li>'))
+
+    that iterates, escapes and appends without running Python bytecode
+    for each item. The loop variable must not be read anywhere else in
+    the enclosing function, as it is never bound by the batched call.
+    """
+
+    for func in ast.walk(tree):
+        if not isinstance(func, FunctionDef):
+            continue
+
+        func_loads = None
+        for statements in iter_statement_lists(func):
+            for index, node in enumerate(statements):
+                if not isinstance(node, ast.For):
+                    continue
+
+                parts = get_loop_output_parts(node)
+                if parts is None:
+                    continue
+
+                if func_loads is None:
+                    func_loads = loaded_names(func)
+
+                target = node.target.id
+                if target in loaded_names(node.iter):
+                    continue
+
+                if func_loads.count(target) != loaded_names(node).count(target):
+                    continue
+
+                call = simple_call(
+                    Attribute(
+                        value=NameX("__TK__output"), attr="output_loop", ctx=Load()
+                    ),
+                    [node.iter, ast.Constant(value=parts)],
+                )
+                statements[index] = ast.copy_location(Expr(call), node)
+
+
+# the maximum number of AST nodes in a def that is inlined at its call sites
+INLINE_MAX_NODES = 60
+
+# the maximum depth of expanding the inlined defs within inlined defs
+INLINE_MAX_DEPTH = 4
+
+_non_inlinable_nodes = tuple(
+    getattr(ast, i)
+    for i in [
+        "Lambda",
+        "ListComp",
+        "SetComp",
+        "DictComp",
+        "GeneratorExp",
+        "NamedExpr",
+        "Yield",
+        "YieldFrom",
+        "Await",
+    ]
+    if hasattr(ast, i)
+)
+
+
+def is_output_statement(node):
+    return (
+        isinstance(node, Expr)
+        and isinstance(node.value, Call)
+        and not node.value.keywords
+        and ast_equals(node.value.func, NameX("__TK__output"))
+    )
+
+
+def make_output_statement(args):
+    node = Expr(simple_call(NameX("__TK__output"), args))
+    node.output_args = list(args)
+    return node
+
+
+class InlineDef(object):
+    """
+    A def that only outputs, to be inlined at its call sites
+    """
+
+    def __init__(self, name, params, defaults, statements, free_names):
+        self.name = name
+        self.params = params
+        self.defaults = defaults
+        self.statements = statements
+        self.free_names = free_names
+
+    @classmethod
+    def for_function(cls, func, max_nodes=INLINE_MAX_NODES):
+        """
+        Return the ``InlineDef`` for the function definition, or None
+        if it cannot be inlined: it must have only plain parameters with
+        constant defaults, its body must only make output calls, and it
+        must not have more than ``max_nodes`` AST nodes
+        """
+
+        args = func.args
+        if args.vararg or args.kwarg or args.kwonlyargs:
+            return None
+
+        if getattr(args, "posonlyargs", None):
+            return None
+
+        if not all(isinstance(i, ast.Constant) for i in args.defaults):
+            return None
+
+        body = func.body
+        if len(body) < 2 or not isinstance(body[-1], Return):
+            return None
+
+        statements = body[1:-1]
+        if not all(is_output_statement(i) for i in statements):
+            return None
+
+        nodes = list(ast.walk(func))
+        if len(nodes) > max_nodes:
+            return None
+
+        if any(isinstance(i, _non_inlinable_nodes) for i in nodes):
+            return None
+
+        params = [i.arg for i in args.args]
+        defaults = dict(zip(params[len(params) - len(args.defaults) :], args.defaults))
+
+        free_names = set()
+        for i in statements:
+            free_names.update(loaded_names(i))
+
+        free_names.difference_update(params)
+        free_names.discard("__TK__output")
+        return cls(func.name, params, defaults, copy.deepcopy(statements), free_names)
+
+    def bind_arguments(self, call):
+        """
+        Return the argument expressions of the call by parameter name,
+        or None if they do not match the parameters
+        """
+
+        if len(call.args) > len(self.params):
+            return None
+
+        bound = dict(zip(self.params, call.args))
+        for keyword in call.keywords:
+            if keyword.arg is None or keyword.arg not in self.params:
+                return None
+
+            if keyword.arg in bound:
+                return None
+
+            bound[keyword.arg] = keyword.value
+
+        if any(isinstance(i, ast.Starred) for i in call.args):
+            return None
+
+        for name in self.params:
+            if name not in bound:
+                if name not in self.defaults:
+                    return None
+
+                bound[name] = self.defaults[name]
+
+        return bound
+
+    def expand(self, call, location):
+        """
+        Return the statements that output the same as the call; the
+        arguments that are not names or constants are evaluated into
+        temporary variables first, once, in the order of the call
+        """
+
+        bound = self.bind_arguments(call)
+        if bound is None:
+            return None
+
+        rv = []
+        values = {}
+        temps = {}
+        for name in self.params:
+            value = bound[name]
+            if isinstance(value, (ast.Constant, Name)):
+                values[name] = value
+                continue
+
+            temp = gen_name("inline")
+            values[name] = NameX(temp)
+            temps[id(value)] = Assign(targets=[NameX(temp, store=True)], value=value)
+
+        # evaluate the arguments in the order they are given in the call
+        for value in list(call.args) + [i.value for i in call.keywords]:
+            if id(value) in temps:
+                rv.append(temps[id(value)])
+
+        class Substitute(ast.NodeTransformer):
+            def visit_Name(self, node):
+                if isinstance(node.ctx, Load) and node.id in values:
+                    return copy.deepcopy(values[node.id])
+
+                return node
+
+        for statement in copy.deepcopy(self.statements):
+            statement = Substitute().visit(statement)
+            rv.append(make_output_statement(statement.value.args))
+
+        for statement in rv:
+            set_location(statement, location)
+
+        return rv
+
+
+def set_location(tree, location):
+    """
+    Set the location of all nodes in the tree to the start of the
+    location, a tuple of line number and column offset
+    """
+
+    lineno, col_offset = location
+    for node in ast.walk(tree):
+        if "lineno" in node._attributes:
+            node.lineno = node.end_lineno = lineno
+            node.col_offset = node.end_col_offset = col_offset
+
+
+def get_location(tree):
+    for node in ast.walk(tree):
+        if getattr(node, "lineno", None) is not None:
+            return node.lineno, node.col_offset
+
+    return None
+
+
+def get_local_names(func):
+    """
+    Return the names that are assigned in the function or in the
+    functions nested in it, including their parameters
+    """
+
+    names = set()
+    for node in ast.walk(func):
+        if isinstance(node, Name) and not isinstance(node.ctx, Load):
+            names.add(node.id)
+
+        elif isinstance(node, (FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+
+    return names
+
+
+def inline_defs(binder, imported_defs, max_nodes=INLINE_MAX_NODES):
+    """
+    Inline the calls of the small defs of the imported templates (see
+    ``InlineDef``)
+
+        __TK__output(__TK__escape(m.button('OK')))
+
+    with the body of the def, with the parameters substituted:
+
+        __TK__output('<button>', __TK__escape('OK'), '</button>')
+
+    ``imported_defs`` maps the alias of a top-level import to the
+    function definitions in the imported template. The defs are only
+    inlined if they use nothing but their parameters. The top-level
+    defs of the template itself are not inlined, as an extending
+    template or the context can replace them. A call is not inlined if
+    a name that the def uses is assigned in the function making the
+    call, or in the functions enclosing it, as the name would refer to
+    a different variable.
+    """
+
+    candidates = {}
+    for alias, funcs in imported_defs.items():
+        for func in funcs:
+            inline_def = InlineDef.for_function(func, max_nodes)
+            if inline_def is None:
+                continue
+
+            if any(not i.startswith("__TK__") for i in inline_def.free_names):
+                continue
+
+            candidates[alias, func.name] = inline_def
+
+    if not candidates:
+        return
+
+    def get_candidate(arg, local_names):
+        if not (
+            isinstance(arg, Call)
+            and not arg.keywords
+            and len(arg.args) == 1
+            and ast_equals(arg.func, NameX("__TK__escape"))
+            and isinstance(arg.args[0], Call)
+        ):
+            return None
+
+        call = arg.args[0]
+        if not (isinstance(call.func, Attribute) and isinstance(call.func.value, Name)):
+            return None
+
+        name = call.func.value.id
+        key = name, call.func.attr
+
+        inline_def = candidates.get(key)
+        if inline_def is None or name in local_names:
+            return None
+
+        if inline_def.free_names & local_names:
+            return None
+
+        return inline_def
+
+    def expand_statement(statement, local_names, depth):
+        if depth > INLINE_MAX_DEPTH or not is_output_statement(statement):
+            return None
+
+        expanded = False
+        rv = []
+        pending = []
+        for call_arg in statement.value.args:
+            inline_def = get_candidate(call_arg, local_names)
+            statements = None
+            if inline_def is not None:
+                location = get_location(call_arg) or get_location(statement) or (1, 0)
+                statements = inline_def.expand(call_arg.args[0], location)
+
+            if statements is None:
+                pending.append(call_arg)
+                continue
+
+            expanded = True
+            if pending:
+                rv.append(make_output_statement(pending))
+                pending = []
+
+            for i in statements:
+                rv.extend(expand_statement(i, local_names, depth + 1) or [i])
+
+        if not expanded:
+            return None
+
+        if pending:
+            rv.append(make_output_statement(pending))
+
+        return rv
+
+    def inline_in_function(func, enclosing_names):
+        local_names = enclosing_names | get_local_names(func)
+        for statements in iter_statement_lists(func):
+            new_statements = []
+            for statement in statements:
+                if isinstance(statement, FunctionDef):
+                    inline_in_function(statement, local_names)
+
+                expanded = expand_statement(statement, local_names, 0)
+                new_statements.extend(expanded or [statement])
+
+            statements[:] = new_statements
+
+    for func in binder.body:
+        if isinstance(func, FunctionDef):
+            inline_in_function(func, set())
+
+
+_numeric_ops = (
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.LShift,
+    ast.RShift,
+    ast.BitOr,
+    ast.BitXor,
+    ast.BitAnd,
+)
+
+
+def is_import_defs_call(node):
+    return (
+        isinstance(node, Call)
+        and isinstance(node.func, Attribute)
+        and node.func.attr == "import_defs"
+        and ast_equals(node.func.value, NameX("__TK__runtime"))
+    )
+
+
+def get_bindings(func):
+    """
+    Return the kinds of the bindings of the names local to the function,
+    as a set by name: ``"def"`` for nested function definitions, ``"import"``
+    for the aliases of imported templates and ``"other"`` for anything
+    else. The bindings in nested scopes are included as ``"other"``,
+    which can only make the result more conservative.
+    """
+
+    bindings = {}
+
+    def add(name, kind):
+        bindings.setdefault(name, set()).add(kind)
+
+    args = func.args
+    for i in args.args + args.kwonlyargs + getattr(args, "posonlyargs", []):
+        add(i.arg, "other")
+
+    for i in (args.vararg, args.kwarg):
+        if i is not None:
+            add(i.arg, "other")
+
+    stack = list(func.body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, FunctionDef):
+            add(node.name, "def")
+            continue
+
+        if isinstance(node, (ast.AsyncFunctionDef, ast.ClassDef)):
+            add(node.name, "other")
+            continue
+
+        if (
+            isinstance(node, Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], Name)
+            and is_import_defs_call(node.value)
+        ):
+            add(node.targets[0].id, "import")
+            continue
+
+        if isinstance(node, Name) and not isinstance(node.ctx, Load):
+            add(node.id, "other")
+
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            for i in node.names:
+                add(i, "other")
+
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for i in node.names:
+                add((i.asname or i.name).partition(".")[0], "other")
+
+        else:
+            # except handlers and the capture patterns of match statements
+            name = getattr(node, "name", None)
+            if isinstance(name, str):
+                add(name, "other")
+
+            rest = getattr(node, "rest", None)
+            if isinstance(rest, str):
+                add(rest, "other")
+
+        stack.extend(iter_child_nodes(node))
+
+    return bindings
+
+
+class SafeValues(object):
+    """
+    The names known in a scope to have values that are safe to output
+    without escaping: ``callables`` are bound to template functions
+    returning a Buffer, and ``imports`` to imported templates whose
+    attributes are such functions. The names of the ``callables`` whose
+    escape calls are removed are added to ``elided``, shared by the
+    nested scopes. The names that the rendering context can replace,
+    such as those of the builtins, are never trusted.
+    """
+
+    def __init__(self, callables, imports, elided=None):
+        self.callables = callables
+        self.imports = imports
+        self.elided = set() if elided is None else elided
+
+    def enter(self, func):
+        """
+        Return the safe values of the scope of the nested function
+        """
+
+        bindings = get_bindings(func)
+
+        def of_kind(inherited, kind):
+            rv = {i for i in inherited if i not in bindings}
+            rv.update(k for k, v in bindings.items() if v == {kind})
+            return rv
+
+        return SafeValues(
+            callables=of_kind(self.callables, "def"),
+            imports=of_kind(self.imports, "import"),
+            elided=self.elided,
+        )
+
+    def is_number(self, node):
+        if isinstance(node, ast.Constant):
+            return node.value.__class__ in (int, float, bool)
+
+        if isinstance(node, ast.BinOp):
+            return (
+                isinstance(node.op, _numeric_ops)
+                and self.is_number(node.left)
+                and self.is_number(node.right)
+            )
+
+        if isinstance(node, UnaryOp):
+            return self.is_number(node.operand)
+
+        return False
+
+    def is_buffer(self, node):
+        if not isinstance(node, Call):
+            return False
+
+        func = node.func
+        if isinstance(func, Name):
+            if func.id not in self.callables:
+                return False
+
+            self.elided.add(func.id)
+            return True
+
+        return (
+            isinstance(func, Attribute)
+            and isinstance(func.value, Name)
+            and func.value.id in self.imports
+        )
+
+    def unescaped(self, arg):
+        """
+        Return the output argument without the escape call if the
+        escaped value is known to be safe, else the argument as is
+        """
+
+        if (
+            not isinstance(arg, Call)
+            or len(arg.args) != 1
+            or arg.keywords
+            or not ast_equals(arg.func, NameX("__TK__escape"))
+        ):
+            return arg
+
+        value = arg.args[0]
+        if isinstance(value, ast.Constant):
+            if value.value.__class__ is str:
+                return ast.copy_location(Str(s=escape(value.value)), value)
+
+            if self.is_number(value):
+                return ast.copy_location(Str(s=str(value.value)), value)
+
+            return arg
+
+        if self.is_number(value) or self.is_buffer(value):
+            return value
+
+        return arg
+
+
+def elide_escapes(func, safe_values):
+    """
+    Remove the escape calls of the output arguments that are known to be
+    safe (see ``SafeValues``) within the function and the functions
+    nested in it
+
+        __TK__output(__TK__escape(len(items)), __TK__escape(button('OK')))
+
+    into
+
+        __TK__output(len(items), button('OK'))
+
+    Constant strings are escaped at compile time, and constant numbers
+    converted into strings, to be coalesced with the surrounding output.
+    """
+
+    for statements in iter_statement_lists(func):
+        for node in statements:
+            if isinstance(node, FunctionDef):
+                elide_escapes(node, safe_values.enter(node))
+
+            elif is_output_statement(node):
+                args = [safe_values.unescaped(i) for i in node.value.args]
+                node.value.args[:] = coalesce_strings(args)
+
+
+def insert_deadline_checks(binder):
+    """
+    Call ``__TK__check_deadline()`` on entering each function within the
+    binder and on each iteration of each loop
+    """
+
+    for node in ast.walk(binder):
+        if node is binder:
+            continue
+
+        if isinstance(node, (FunctionDef, ast.For, ast.While)):
+            check = Expr(simple_call(NameX("__TK__check_deadline")))
+            node.body.insert(0, ast.copy_location(check, node.body[0]))
+
+
+class LazyValueResolver(ast.NodeTransformer):
+    """
+    Replaces the loads of the given names, the variables that the binder
+    takes from the context, with ``x.resolve(__TK__lazy_values)`` if
+    ``x`` is a ``lazy`` value and ``x`` otherwise, in the scopes where they are not shadowed
+    """
+
+    def __init__(self, names):
+        super(LazyValueResolver, self).__init__()
+        self.names = names
+
+    def visit_function(self, node):
+        args = node.args
+        params = [i.arg for i in args.posonlyargs + args.args + args.kwonlyargs]
+        params.extend(i.arg for i in (args.vararg, args.kwarg) if i is not None)
+
+        # the decorators and defaults are evaluated in the enclosing scope
+        node.decorator_list = [
+            self.visit(i) for i in getattr(node, "decorator_list", [])
+        ]
+        node.args = self.visit(args)
+
+        finder = FreeVarFinder(params)
+        finder.generic_visit(node)
+        names = self.names
+        self.names = names - finder.masked - finder.generated
+        if isinstance(node.body, list):
+            node.body = [self.visit(i) for i in node.body]
+        else:
+            node.body = self.visit(node.body)
+
+        self.names = names
+        return node
+
+    visit_FunctionDef = visit_Lambda = visit_function
+
+    def visit_Name(self, node):
+        if not isinstance(node.ctx, Load) or node.id not in self.names:
+            return node
+
+        resolved = ast.IfExp(
+            test=ast.Compare(
+                left=Attribute(value=NameX(node.id), attr="__class__", ctx=Load()),
+                ops=[ast.Is()],
+                comparators=[NameX("__TK__lazy")],
+            ),
+            body=simple_call(
+                Attribute(value=NameX(node.id), attr="resolve", ctx=Load()),
+                [NameX("__TK__lazy_values")],
+            ),
+            orelse=NameX(node.id),
+        )
+        return ast.copy_location(resolved, node)
+
+
+def resolve_lazy_values(binder, names):
+    """
+    Make the top-level functions of the binder resolve the ``lazy``
+    context values of the given names when they are first used
+    """
+
+    if not names:
+        return
+
+    resolver = LazyValueResolver(frozenset(names))
+    for node in binder.body:
+        if isinstance(node, FunctionDef):
+            resolver.visit(node)
+
+
 def remove_locations(node):
     """
     Removes locations from the given AST tree completely
@@ -760,23 +1613,40 @@ class PyRootNode(PyComplexNode):
         code = "__TK__mkbuffer = __TK__runtime.Buffer\n"
         code += "__TK__escape = __TK__escape_g = __TK__runtime.escape\n"
         code += "__TK__output_attrs = __TK__runtime.output_attrs\n"
+        if generator.lazy_values:
+            code += "__TK__lazy = __TK__runtime.lazy\n"
 
         if extended:
             code += "__TK__parent_template = __TK__runtime.load(%r)\n" % extended
 
         code += "def __TK__binder(__TK__context):\n"
+        if generator.lazy_values:
+            # shared by the templates bound to copies of the context
+            code += "    __TK__lazy_values = __TK__context.setdefault(%r, {})\n" % (
+                LAZY_VALUES_KEY
+            )
+
         code += "    __TK__original_context = __TK__context.copy()\n"
         code += "    __TK__bind = __TK__runtime.bind(__TK__context)\n"
         code += (
             "    __TK__bindblock = __TK__runtime.bind(__TK__context, " "block=True)\n"
         )
 
+        if generator.check_deadline:
+            code += "    __TK__check_deadline = __TK__runtime.deadline_checker()\n"
+
         # bind gettext early!
         for i in ["egettext"]:
             if i in free_variables:
                 free_variables.add("gettext")
                 free_variables.discard(i)
 
+        # the blocks are put in the context by the template itself
+        generator.free_variables = frozenset(
+            free_variables.difference(
+                i.name[len("__TK__block__") :] for i in generator.blocks
+            )
+        )
         if "gettext" in free_variables:
             code += "    def egettext(msg):\n"
             code += "        return __TK__escape(gettext(msg))\n"
@@ -829,7 +1699,45 @@ class PyRootNode(PyComplexNode):
         binder.body[i : i + 1] = toplevel_funcs
         binder.body[i:i] = generator.imports
 
+        if generator.inline_defs:
+            inline_defs(binder, generator.get_imported_defs())
+
         coalesce_outputs(tree)
+        if generator.check_deadline:
+            insert_deadline_checks(binder)
+
+        batch_simple_loops(tree)
+
+        # the blocks are not trusted, as the context can replace them
+        # with callables whose return values are output as is
+        safe_values = SafeValues(
+            callables={i.name for i in generator.top_defs},
+            imports=set(generator.import_hrefs),
+        )
+        for i in binder.body:
+            if isinstance(i, FunctionDef):
+                elide_escapes(i, safe_values.enter(i))
+
+        # the replacements of the defs whose calls are output without
+        # escaping are escaped when bound instead
+        for i in generator.top_defs:
+            if i.name in safe_values.elided:
+                i.decorator_list = [
+                    Call(
+                        func=Attribute(
+                            value=NameX("__TK__runtime"), attr="bind", ctx=Load()
+                        ),
+                        args=[NameX("__TK__context")],
+                        keywords=[
+                            ast.keyword(arg="block", value=ast.Constant(True)),
+                            ast.keyword(arg="escaped", value=ast.Constant(True)),
+                        ],
+                    )
+                ]
+
+        if generator.lazy_values:
+            resolve_lazy_values(binder, free_variables)
+
         return tree
 
 
@@ -871,6 +1779,7 @@ class Generator(BaseGenerator):
     ComplexExprNode = PyComplexExprNode
     ExpressionNode = PyExpressionNode
     ImportNode = PyImportNode
+    IncludeNode = PyIncludeNode
     RootNode = PyRootNode
     AttributeNode = PyAttributeNode
     AttrsNode = PyAttrsNode
@@ -880,15 +1789,44 @@ class Generator(BaseGenerator):
     CodeNode = PyCodeNode
     WithNode = PyWithNode
 
-    def __init__(self, ir_tree):
-        super(Generator, self).__init__(ir_tree)
+    def __init__(
+        self,
+        ir_tree,
+        translations=None,
+        inline_defs=False,
+        get_defs=None,
+        check_deadline=False,
+        lazy_values=False,
+    ):
+        super(Generator, self).__init__(ir_tree, translations=translations)
         self.blocks = []
         self.top_defs = []
         self.top_level_names = set()
         self.extended_href = None
         self.imports = []
+        self.import_hrefs = {}
         self.lnotab = None
 
+        # the names that the template reads from the context, and the
+        # literal hrefs of the templates that it extends, imports or
+        # includes at render time
+        self.free_variables = frozenset()
+        self.template_hrefs = []
+
+        # inline the small imported defs at their call sites;
+        # ``get_defs(href)`` returns the top-level function definitions
+        # of the imported template, or None if they are not known at
+        # compile time
+        self.inline_defs = inline_defs
+        self.get_defs = get_defs
+
+        # check the render deadline of the runtime on entering functions
+        # and on each loop iteration
+        self.check_deadline = check_deadline
+
+        # resolve the ``lazy`` values read from the context
+        self.lazy_values = lazy_values
+
     def add_bind_decorator(self, func, block=True):
         binder_call = NameX("__TK__bind" + ("block" if block else ""))
         decors = [binder_call]
@@ -904,12 +1842,38 @@ class Generator(BaseGenerator):
         self.add_bind_decorator(defblock)
         self.top_defs.append(defblock)
 
-    def add_top_level_import(self, name, node):
+    def add_top_level_import(self, name, node, href=None):
         self.top_level_names.add(name)
         self.imports.append(node)
+        self.import_hrefs[name] = href
+
+    def get_imported_defs(self):
+        """
+        Return the top-level function definitions of the templates
+        imported at the top level, by alias
+        """
+
+        rv = {}
+        if self.get_defs is None:
+            return rv
+
+        for alias, href in self.import_hrefs.items():
+            if href is None or "$" in href:
+                continue
+
+            defs = self.get_defs(href)
+            if defs is not None:
+                rv[alias] = defs
+
+        return rv
 
     def make_extended_template(self, href):
         self.extended_href = href
+        self.add_template_href(href)
+
+    def add_template_href(self, href):
+        if "$" not in href and href not in self.template_hrefs:
+            self.template_hrefs.append(href)
 
     def lnotab_info(self):
         return self.lnotab
@@ -1,34 +1,28 @@
 import codecs
 import errno
+import functools
+import hashlib
 import os
 import sys
+import threading
 import time
-from typing import Iterable, Optional
+from typing import Iterable, List, Optional
 
-from .helpers import reraise
-from .languages.python.generator import Generator as PythonGenerator
+from .helpers import reraise, split_lineno
 from .runtime import python, exceptions
-from .syntaxes.chameleon import parse as parse_chameleon
-from .syntaxes.tonnikala import parse as parse_tonnikala, parse_js as parse_js_tonnikala
 
-has_slimit = True
-
-try:
-    from .languages.javascript.generator import Generator as JavascriptGenerator
-except ImportError as e:
-    try:
-        import slimit as _slimit
-
-        del _slimit
-    except ImportError:
-        has_slimit = False
-
-    else:
-        raise e
+# The compile pipeline (parsers, IR and code generators) and the
+# JavaScript support are imported only when a template is actually
+# compiled; a process that only renders already loaded templates
+# does not pay for importing them.
 
 _make_traceback = None
+_annotate_exception = None
 MIN_CHECK_INTERVAL = 0.25
 
+# the default size of the chunks yielded by Template.render_iter
+CHUNK_SIZE = 16384
+
 try:  # pragma: python3
     import builtins as __builtin__
 except ImportError:  # pragma: python2
@@ -106,11 +100,70 @@ def handle_exception(exc_info=None, source_hint=None, tb_override=_NO):
     reraise(exc_type, exc_value, tb)
 
 
+def etag_digest(data):
+    """
+    The default digest of ``Template.render_with_digest``: a 128-bit
+    BLAKE2b, short enough for an ETag header
+    """
+
+    return hashlib.blake2b(data, digest_size=16)
+
+
+def annotate_exception(exc_info=None):
+    """
+    Exception handling helper of the templates compiled without
+    translating tracebacks: the exception is reraised with its original
+    traceback, with the template locations of the traceback attached to
+    it as ``template_locations``.
+    """
+
+    global _annotate_exception
+    if exc_info is None:  # pragma: no cover
+        exc_info = sys.exc_info()
+
+    if _annotate_exception is None:
+        from .runtime.debug import annotate_exception as _annotate_exception
+
+    _annotate_exception(exc_info)
+    reraise(*exc_info)
+
+
 class Template(object):
     handle_exception = staticmethod(handle_exception)
 
+    # the paths and modification times of the files compiled into the
+    # template besides its own file
+    dependencies = {}
+
+    # the names read from the context by the template itself, and the
+    # literal hrefs of the templates it uses at render time
+    own_free_variables = frozenset()
+    template_hrefs = ()
+
     def __init__(self, binder):
         self.binder_func = binder
+        self._free_variables = None
+
+    @property
+    def free_variables(self):
+        """
+        The names that the template reads from the context, including
+        those read by the templates that it extends, imports or includes
+        with literal hrefs. The names of the builtins are included if the
+        template uses them; the values that are not named here are not
+        used by the rendering.
+        """
+
+        if self._free_variables is None:
+            # set first, for the templates that import each other
+            self._free_variables = free_variables = set(self.own_free_variables)
+            runtime = self.binder_func.__globals__["__TK__runtime"]
+            for href in self.template_hrefs:
+                free_variables.update(runtime.load(href).free_variables)
+
+            self._free_variables = frozenset(free_variables)
+
+        return self._free_variables
 
     def bind(self, context):
         self.binder_func(context)
@@ -132,6 +185,83 @@ class Template(object):
     def render(self, context, funcname="__main__"):
         return self.render_to_buffer(context, funcname).join()
 
+    def render_to(self, writer, context, funcname="__main__"):
+        """
+        Render the template and write its output to ``writer``, an object
+        with a ``writelines`` or a ``write`` method, such as a text file or
+        a ``tonnikala.writers.SocketWriter``, fragment by fragment without
+        joining the whole output into a single string. Errors in rendering
+        are raised before anything is written.
+        """
+
+        parts = self.render_to_buffer(context, funcname).buffer
+        writelines = getattr(writer, "writelines", None)
+        if writelines is not None:
+            writelines(parts)
+            return
+
+        write = writer.write
+        for part in parts:
+            write(part)
+
+    def render_with_digest(
+        self, context, funcname="__main__", encoding="UTF-8", digest=etag_digest
+    ):
+        """
+        Render the template and return a tuple of the output encoded in
+        ``encoding`` and the hex digest of the encoded output computed
+        with ``digest``, a ``hashlib``-style constructor, for example for
+        a strong ETag. The encoded output is hashed as it is, so that it
+        can be used as the response body without being encoded again.
+        """
+
+        body = self.render_to_buffer(context, funcname).join().encode(encoding)
+        return body, digest(body).hexdigest()
+
+    def render_iter(self, context, funcname="__main__", chunk_size=CHUNK_SIZE):
+        """
+        Render the template and return an iterator over its output in
+        chunks of at least ``chunk_size`` characters (save for the last
+        one), without joining the whole output into a single string.
+        Errors are raised by this call, not by the iteration.
+        """
+
+        buffer = self.render_to_buffer(context, funcname)
+        return _iter_chunks(buffer.buffer, chunk_size)
+
+
+def _iter_chunks(parts, chunk_size):
+    chunk = []
+    length = 0
+    for part in parts:
+        chunk.append(part)
+        length += len(part)
+        if length >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+
+    if chunk:
+        yield "".join(chunk)
+
+
+def parse_tonnikala(*args, **kwargs):
+    from .syntaxes.tonnikala import parse
+
+    return parse(*args, **kwargs)
+
+
+def parse_js_tonnikala(*args, **kwargs):
+    from .syntaxes.tonnikala import parse_js
+
+    return parse_js(*args, **kwargs)
+
+
+def parse_chameleon(*args, **kwargs):
+    from .syntaxes.chameleon import parse
+
+    return parse(*args, **kwargs)
+
 
 parsers = {
     "tonnikala": parse_tonnikala,
@@ -141,12 +271,25 @@ parsers = {
 
 
 class TemplateInfo(object):
-    def __init__(self, filename, lnotab):
+    def __init__(self, filename, lnotab, sources=()):
         self.filename = filename
         self.lnotab = lnotab
 
+        # the files merged into the template at compile time, the
+        # template itself first
+        self.sources = list(sources) or [filename]
+
+    def get_location(self, line):
+        """
+        Return the ``(filename, lineno)`` of the template source line of
+        the line of the compiled code
+        """
+
+        index, lineno = split_lineno(self.lnotab.get(line, line))
+        return self.sources[index], lineno
+
     def get_corresponding_lineno(self, line):
-        return self.lnotab.get(line, line)
+        return self.get_location(line)[1]
 
 
 def _new_globals(runtime):
@@ -163,7 +306,20 @@ class Loader(object):
     handle_exception = staticmethod(handle_exception)
     runtime = python.TonnikalaRuntime
 
-    def __init__(self, debug=False, syntax="tonnikala", translatable=False):
+    def __init__(
+        self,
+        debug=False,
+        syntax="tonnikala",
+        translatable=False,
+        minify=False,
+        translations=None,
+        flatten_extends=False,
+        inline_defs=False,
+        lazy_values=False,
+        max_output_size=None,
+        render_timeout=None,
+        translate_tracebacks=True,
+    ):
         # Allow debug to be enabled via environment variable
         self.debug = debug or os.environ.get("TONNIKALA_DEBUG", "").lower() in (
             "1",
@@ -172,20 +328,274 @@ class Loader(object):
         )
         self.syntax = syntax
         self.translatable = translatable
+        self.minify = minify
+
+        # gettext translations by locale, for compiling locale-specific
+        # templates with the translations inlined
+        self.translations = translations or {}
+
+        # merge the parent templates with literal hrefs into the
+        # extending templates at compile time
+        self.flatten_extends = flatten_extends
+
+        # inline the small defs, including the defs of the templates
+        # imported with literal hrefs, at their call sites
+        self.inline_defs = inline_defs
 
-    def load_string(self, string, filename="<string>"):
+        # resolve the ``tonnikala.lazy`` values of the context when the
+        # templates first use them; off by default, as it costs a check
+        # on every read of a context variable
+        self.lazy_values = lazy_values
+
+        # the limits of rendering the templates compiled by this loader:
+        # the maximum number of characters output, and the maximum
+        # duration in seconds; exceeding either raises RenderLimitError
+        self.max_output_size = max_output_size
+        self.render_timeout = render_timeout
+
+        # rewrite the tracebacks of the errors raised in rendering to
+        # point to the template lines; if false, the template locations
+        # are only attached to the exceptions, which is faster
+        self.translate_tracebacks = translate_tracebacks
+
+    def get_translations(self, locale):
+        try:
+            return self.translations[locale]
+        except KeyError:
+            raise ValueError("No translations given for locale %r" % (locale,))
+
+    def get_template_source(self, href):
+        """
+        Return the ``(source, path, mtime)`` of the template ``href`` for
+        compiling it into another template, or None if this loader
+        cannot find templates by name.
+        """
+
+        return None
+
+    def parse(self, string, filename, translatable):
         parser_func = parsers.get(self.syntax)
         if not parser_func:
             raise ValueError(
                 "Invalid parser syntax %s: valid syntaxes: %r" % sorted(parsers.keys())
             )
 
+        return parser_func(
+            filename, string, translatable=translatable, minify=self.minify
+        )
+
+    def parse_merged(self, string, filename, translatable, sources):
+        """
+        Parse a template merged into the one being compiled, appending
+        its ``(filename, source)`` to ``sources``; the line numbers of
+        the tree are offset by its index in them.
+        """
+
+        from .ir.sources import relocate
+
+        tree = self.parse(string, filename, translatable)
+        sources.append((filename, string))
+        return relocate(tree, len(sources) - 1)
+
+    def splice_includes(self, tree, translatable, dependencies, sources, seen=()):
+        """
+        Splice the templates included with literal hrefs into the tree,
+        recording the files spliced in ``dependencies`` and ``sources``.
+        The templates that cannot be found, that extend another template
+        or that define defs, blocks or imports are included at render
+        time instead, with the rendering context; a TemplateSyntaxError
+        is raised if such a template reads names that are local to the
+        including template at the include.
+        """
+
+        from .ir.inclusion import defines_names, expand_includes, get_free_names
+        from .ir.inheritance import get_extends
+
+        def get_included(include, local_names):
+            try:
+                source = self.get_template_source(include.href)
+            except OSError:
+                return None
+
+            if source is None:
+                return None
+
+            string, path, mtime = source
+            if path in seen:
+                raise exceptions.TemplateSyntaxError(
+                    "Template %s includes itself" % path, node=include
+                )
+
+            try:
+                included = self.parse_merged(string, path, translatable, sources)
+                included_dependencies = {path: mtime}
+                self.splice_includes(
+                    included,
+                    translatable,
+                    included_dependencies,
+                    sources,
+                    seen + (path,),
+                )
+            except exceptions.TemplateSyntaxError as e:
+                if e.source is None:
+                    e.source = string
+                if e.filename is None:
+                    e.filename = path
+
+                raise
+
+            root = included.get_root()
+            if get_extends(included) is not None or defines_names(root):
+                names = get_free_names(root) & local_names
+                if names:
+                    raise exceptions.TemplateSyntaxError(
+                        "Template %s is included at render time, as it extends "
+                        "a template or defines defs, blocks or imports, and "
+                        "cannot read the local names %s of the including "
+                        "template" % (path, ", ".join(sorted(names))),
+                        node=include,
+                    )
+
+                return None
+
+            dependencies.update(included_dependencies)
+            return included
+
+        expand_includes(tree.get_root(), get_included)
+        return tree
+
+    def flatten(self, tree, translatable, dependencies, sources, seen=()):
+        """
+        Merge the chain of parent templates into the tree of an extending
+        template, recording the files merged in ``dependencies`` and
+        ``sources``. The tree is returned as is if the parent cannot be
+        merged.
+        """
+
+        from .ir.inheritance import get_extends, is_literal_href, merge_extends
+
+        extends = get_extends(tree)
+        if extends is None or not is_literal_href(extends.href):
+            return tree
+
+        source = self.get_template_source(extends.href)
+        if source is None:
+            return tree
+
+        string, path, mtime = source
+        if path in seen:
+            raise exceptions.TemplateSyntaxError(
+                "Template %s extends itself" % path, node=extends
+            )
+
+        try:
+            parent_tree = self.parse_merged(string, path, translatable, sources)
+            parent_dependencies = {path: mtime}
+            parent_tree = self.splice_includes(
+                parent_tree, translatable, parent_dependencies, sources, seen + (path,)
+            )
+            parent_tree = self.flatten(
+                parent_tree, translatable, parent_dependencies, sources, seen + (path,)
+            )
+        except exceptions.TemplateSyntaxError as e:
+            if e.source is None:
+                e.source = string
+            if e.filename is None:
+                e.filename = path
+
+            raise
+
+        merged = merge_extends(parent_tree, extends)
+        if merged is None:
+            return tree
+
+        dependencies.update(parent_dependencies)
+        return merged
+
+    def get_imported_defs(
+        self, href, translatable, translations, dependencies, sources
+    ):
+        """
+        Return the function definitions of the top-level defs of the
+        template ``href`` for inlining them into the templates importing
+        it, or None if they cannot be known at compile time; the files
+        they are compiled from are recorded in ``sources``. The import
+        errors are left to be raised at render time.
+        """
+
+        from .languages.python.generator import Generator as PythonGenerator
+
         try:
-            tree = parser_func(filename, string, translatable=self.translatable)
-            gen = PythonGenerator(tree)
+            source = self.get_template_source(href)
+            if source is None:
+                return None
+
+            string, path, mtime = source
+            imported_dependencies = {path: mtime}
+            tree = self.splice_includes(
+                self.parse_merged(string, path, translatable, sources),
+                translatable,
+                imported_dependencies,
+                sources,
+                (path,),
+            )
+            gen = PythonGenerator(tree, translations=translations)
+            gen.generate_ast()
+        except (OSError, exceptions.TemplateSyntaxError):
+            return None
+
+        if gen.extended_href is not None:
+            return None
+
+        dependencies.update(imported_dependencies)
+        return gen.top_defs
+
+    def load_string(self, string, filename="<string>", locale=None):
+        """
+        Compile the template source. If ``locale`` is given, the
+        translatable texts are translated at compile time with the
+        translations of that locale.
+        """
+
+        from .languages.python.generator import Generator as PythonGenerator
+
+        translations = None
+        if locale is not None:
+            translations = self.get_translations(locale)
+
+        translatable = self.translatable or translations is not None
+        dependencies = {}
+
+        # the (filename, source) of the files compiled into the template
+        sources = [(filename, string)]
+        try:
+            tree = self.parse(string, filename, translatable)
+            tree = self.splice_includes(
+                tree, translatable, dependencies, sources, (filename,)
+            )
+            if self.flatten_extends:
+                tree = self.flatten(
+                    tree, translatable, dependencies, sources, (filename,)
+                )
+
+            gen = PythonGenerator(
+                tree,
+                translations=translations,
+                inline_defs=self.inline_defs,
+                get_defs=lambda href: self.get_imported_defs(
+                    href, translatable, translations, dependencies, sources
+                ),
+                check_deadline=self.render_timeout is not None,
+                lazy_values=self.lazy_values,
+            )
             code = gen.generate_ast()
             exc_info = None
         except exceptions.TemplateSyntaxError as e:
+            index, lineno = split_lineno(e.lineno or 0)
+            if index:
+                # raised on a line of a file merged into the template
+                e.filename, e.source = sources[index]
+                e.lineno = lineno
             if e.source is None:
                 e.source = string
             if e.filename is None:
@@ -194,7 +604,7 @@ class Loader(object):
             exc_info = sys.exc_info()
 
         if exc_info:
-            self.handle_exception(exc_info, string, tb_override=None)
+            self.handle_exception(exc_info, exc_info[1].source, tb_override=None)
             return
 
         if self.debug:
@@ -220,15 +630,31 @@ class Loader(object):
 
         runtime = self.runtime()
         runtime.loader = self
+        runtime.locale = locale
+        runtime.render_timeout = self.render_timeout
+        if self.max_output_size is not None:
+            runtime.Buffer = functools.partial(
+                runtime.Buffer, max_size=self.max_output_size
+            )
+
         glob = _new_globals(runtime)
 
         compiled = compile(code, filename, "exec")
-        glob["__TK_template_info__"] = TemplateInfo(filename, gen.lnotab_info())
+        glob["__TK_template_info__"] = TemplateInfo(
+            filename, gen.lnotab_info(), [i[0] for i in sources]
+        )
 
         exec(compiled, glob, glob)
 
         template_func = glob["__TK__binder"]
-        return Template(template_func)
+        template = Template(template_func)
+        template.dependencies = dependencies
+        template.own_free_variables = gen.free_variables
+        template.template_hrefs = tuple(gen.template_hrefs)
+        if not self.translate_tracebacks:
+            template.handle_exception = annotate_exception
+
+        return template
 
 
 class FileLoader(Loader):
@@ -243,12 +669,20 @@ class FileLoader(Loader):
         super(FileLoader, self).__init__(*args, debug=debug, syntax=syntax, **kwargs)
 
         self.cache = {}
+
+        # template name -> the path it resolved to, or None if not found
+        self.resolved = {}
         self.paths = list(paths)
         self.reload = False
         self._last_reload_check = time.time()
 
+        # serializes compiling templates into and purging the cache;
+        # reentrant, as compiling a template loads its parent template
+        self._lock = threading.RLock()
+
     def add_path(self, *a: str) -> None:
         self.paths.extend(a)
+        self.resolved.clear()
 
     def resolve(self, name: str) -> Optional[str]:
         if os.path.isabs(name):
@@ -262,99 +696,343 @@ class FileLoader(Loader):
 
         return None
 
+    def cached_resolve(self, name: str) -> Optional[str]:
+        """
+        Resolve the name like ``resolve``, memoising the result. Names
+        that were not found are cached too; with reloading enabled the
+        memoised results are discarded whenever the templates are
+        checked for changes.
+        """
+
+        try:
+            return self.resolved[name]
+        except KeyError:
+            pass
+
+        path = self.resolved[name] = self.resolve(name)
+        return path
+
     def set_reload(self, flag: bool) -> None:
         self.reload = flag
+        self.resolved.clear()
+
+    def read_template(self, path):
+        with codecs.open(path, "r", encoding="UTF-8") as f:
+            contents = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime
+
+        return contents, mtime
+
+    def get_template_source(self, href):
+        path = self.cached_resolve(href)
+        if not path:
+            raise OSError(errno.ENOENT, "File not found: %s" % href)
+
+        contents, mtime = self.read_template(path)
+        return contents, path, mtime
+
+    def get_search_dirs(self) -> List[str]:
+        """
+        Return the directories that the template names are resolved in
+        """
+
+        return list(self.paths)
+
+    def find_templates(self, pattern: str) -> List[str]:
+        """
+        Return the names of the template files matching the glob pattern
+        in the search directories; ``**`` matches any subdirectories.
+        Absolute patterns are matched as is.
+        """
+
+        import glob
+
+        if os.path.isabs(pattern):
+            return sorted(
+                i for i in glob.glob(pattern, recursive=True) if os.path.isfile(i)
+            )
+
+        names = []
+        for directory in self.get_search_dirs():
+            paths = glob.glob(os.path.join(directory, pattern), recursive=True)
+            for path in sorted(paths):
+                if os.path.isfile(path):
+                    names.append(os.path.relpath(path, directory).replace(os.sep, "/"))
+
+        return names
+
+    def preload(self, *patterns: str) -> list:
+        """
+        Compile all templates matching the glob patterns (see
+        ``find_templates``) into the cache, and return them. Useful for
+        compiling the templates in a server process before it forks
+        the workers.
+        """
+
+        templates = {}
+        for pattern in patterns:
+            for name in self.find_templates(pattern):
+                if name not in templates:
+                    templates[name] = self.load(name)
+
+        return list(templates.values())
 
     def _maybe_purge_cache(self):
         """
         If enough time since last check has elapsed, check if any
         of the cached templates has changed. If any of the template
         files were deleted, remove that file only. If any were
-        changed, then purge the entire cache.
+        changed, or any of the files merged into them at compile
+        time were changed or deleted, then purge the entire cache.
+        The memoised name resolutions are always discarded, as
+        templates might have been added or removed.
         """
 
         if self._last_reload_check + MIN_CHECK_INTERVAL > time.time():
             return
 
-        for name, tmpl in list(self.cache.items()):
-            if not os.stat(tmpl.path):
-                self.cache.pop(name)
-                continue
+        with self._lock:
+            # some other thread might have just done the check
+            if self._last_reload_check + MIN_CHECK_INTERVAL > time.time():
+                return
 
-            if os.stat(tmpl.path).st_mtime > tmpl.mtime:
-                self.cache.clear()
-                break
+            self.resolved.clear()
+            for name, tmpl in list(self.cache.items()):
+                try:
+                    mtime = os.stat(tmpl.path).st_mtime
+                except OSError:
+                    self.cache.pop(name, None)
+                    continue
 
-        self._last_reload_check = time.time()
+                if mtime > tmpl.mtime or self._dependencies_changed(tmpl):
+                    self.cache.clear()
+                    break
 
-    def load(self, name):
+            self._last_reload_check = time.time()
+
+    def _dependencies_changed(self, template):
+        for path, mtime in template.dependencies.items():
+            try:
+                if os.stat(path).st_mtime > mtime:
+                    return True
+            except OSError:
+                return True
+
+        return False
+
+    def load(self, name, locale=None):
         """
         If not yet in the cache, load the named template and compiles it,
         placing it into the cache.
 
         If in cache, return the cached template.
+
+        If ``locale`` is given, the template is compiled and cached
+        separately for that locale, with its translations inlined.
         """
 
         if self.reload:
             self._maybe_purge_cache()
 
-        template = self.cache.get(name)
+        key = name if locale is None else (name, locale)
+        template = self.cache.get(key)
         if template:
             return template
 
-        path = self.resolve(name)
-        if not path:
-            raise OSError(errno.ENOENT, "File not found: %s" % name)
+        with self._lock:
+            # another thread might have compiled it while we waited
+            template = self.cache.get(key)
+            if template:
+                return template
 
-        with codecs.open(path, "r", encoding="UTF-8") as f:
-            contents = f.read()
-            mtime = os.fstat(f.fileno()).st_mtime
+            path = self.cached_resolve(name)
+            if not path:
+                raise OSError(errno.ENOENT, "File not found: %s" % name)
 
-        template = self.load_string(contents, filename=path)
-        template.mtime = mtime
-        template.path = path
+            contents, mtime = self.read_template(path)
+            if locale is None:
+                template = self.load_string(contents, filename=path)
+            else:
+                template = self.load_string(contents, filename=path, locale=locale)
+
+            template.mtime = mtime
+            template.path = path
+
+            self.cache[key] = template
+            return template
 
-        self.cache[name] = template
-        return template
 
+def get_javascript_generator():
+    """
+    Import and return the JavaScript code generator class
+    """
 
-if not has_slimit:
+    from .languages.javascript.generator import Generator
 
-    class JSLoader(object):
-        def __init__(self, *args, **kwargs):
-            raise ImportError("Use of JSLoader requires slimit3k")
+    return Generator
 
-else:
 
-    class JSLoader(object):
-        def __init__(
-            self,
-            debug: bool = False,
-            syntax: str = "js_tonnikala",
-            minify: bool = False,
-        ):
-            self.debug = debug
-            self.syntax = syntax
-            self.minify = minify
+def __getattr__(name):
+    # has_slimit is computed on first access, as it imports slimit;
+    # slimit is needed only for minifying the JavaScript templates
+    if name == "has_slimit":
+        try:
+            import slimit as _slimit
 
-        def load_string(self, string: str, filename: str = "<string>"):
-            parser_func = parsers.get(self.syntax)
-            if not parser_func:
-                raise ValueError(
-                    "Invalid parser syntax %s: valid syntaxes: %r"
-                    % (self.syntax, sorted(parsers.keys()))
-                )
+            del _slimit
+        except ImportError:
+            return False
+
+        return True
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+# bump when the compiled output of an unchanged template might differ
+JS_CACHE_VERSION = 2
+
+
+class JSLoader(object):
+    def __init__(
+        self,
+        debug: bool = False,
+        syntax: str = "js_tonnikala",
+        minify: bool = False,
+        cache_dir: Optional[str] = None,
+    ):
+        if minify:
+            try:
+                import slimit as _slimit
+
+                del _slimit
+            except ImportError:
+                raise ImportError("Minifying JavaScript templates requires slimit3k")
+
+        self.generator = get_javascript_generator()
+        self.debug = debug
+        self.syntax = syntax
+        self.minify = minify
+
+        # if set, the compiled (and minified) code is cached there
+        # by the hash of the template source
+        self.cache_dir = cache_dir
+
+    def get_cache_path(self, string: str) -> str:
+        from . import __version__
+
+        key = "\0".join(
+            [str(JS_CACHE_VERSION), __version__, self.syntax, str(self.minify), string]
+        )
+        digest = hashlib.sha256(key.encode("UTF-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".js")
+
+    def load_string(self, string: str, filename: str = "<string>"):
+        cache_path = None
+        if self.cache_dir and not self.debug:
+            cache_path = self.get_cache_path(string)
+            try:
+                with codecs.open(cache_path, "r", encoding="UTF-8") as f:
+                    return f.read()
+            except OSError:
+                pass
+
+        code = self.compile_string(string, filename)
 
-            tree = parser_func(filename, string)
-            code = JavascriptGenerator(tree).generate_ast()
+        if cache_path:
+            os.makedirs(self.cache_dir, exist_ok=True)
 
-            if self.debug:
-                print("JS template output code for %s" % filename)
-                print(code)
+            # written atomically, the cache can be shared by processes
+            tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+            with codecs.open(tmp_path, "w", encoding="UTF-8") as f:
+                f.write(code)
 
-            if self.minify:
-                from slimit import minify
+            os.replace(tmp_path, cache_path)
+
+        return code
+
+    def compile_string(self, string: str, filename: str = "<string>"):
+        parser_func = parsers.get(self.syntax)
+        if not parser_func:
+            raise ValueError(
+                "Invalid parser syntax %s: valid syntaxes: %r"
+                % (self.syntax, sorted(parsers.keys()))
+            )
+
+        tree = parser_func(filename, string)
+        code = self.generator(tree).generate_ast()
+
+        if self.debug:
+            print("JS template output code for %s" % filename)
+            print(code)
+
+        if self.minify:
+            from slimit import minify
+
+            code = minify(code, mangle=True)
+
+        return code
+
+
+def compile_js_file(source, target, **loader_options):
+    """
+    Compile the JavaScript template file ``source`` into ``target``,
+    with a ``JSLoader`` constructed with the given options.
+    """
+
+    with codecs.open(source, "r", encoding="UTF-8") as f:
+        contents = f.read()
+
+    compiled = JSLoader(**loader_options).load_string(contents, filename=source)
+
+    target_dir = os.path.dirname(target)
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+
+    with codecs.open(target, "w", encoding="UTF-8") as f:
+        f.write(compiled)
+
+
+def compile_js_directory(
+    source_dir: str,
+    target_dir: str,
+    extension: str = ".tk",
+    processes: Optional[int] = None,
+    **loader_options,
+):
+    """
+    Compile all the JavaScript templates with the given extension in
+    ``source_dir`` and its subdirectories into ``.js`` files at the same
+    relative paths in ``target_dir``. The templates are compiled in a
+    pool of ``processes`` worker processes (by default one per CPU);
+    with ``processes=1`` they are compiled in this process. Returns the
+    list of the target files.
+    """
+
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.endswith(extension):
+                continue
+
+            source = os.path.join(dirpath, name)
+            relative = os.path.relpath(source, source_dir)
+            target = os.path.join(target_dir, relative[: -len(extension)] + ".js")
+            jobs.append((source, target))
+
+    if processes == 1 or len(jobs) < 2:
+        for source, target in jobs:
+            compile_js_file(source, target, **loader_options)
+
+    else:
+        from concurrent.futures import ProcessPoolExecutor
 
-                code = minify(code, mangle=True)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(compile_js_file, source, target, **loader_options)
+                for source, target in jobs
+            ]
+            for future in futures:
+                future.result()
 
-            return code
+    return [target for source, target in jobs]
@@ -0,0 +1,202 @@
+"""
+Memory allocation profiling of template rendering with ``tracemalloc``
+"""
+
+import sys
+import tracemalloc
+
+# the number of frames stored per allocation when tracing is started for
+# the report; enough to reach a template frame from the runtime internals
+TRACEBACK_LIMIT = 25
+
+
+class Allocation(object):
+    """
+    The memory allocated at a location: the template line, or the
+    Python source line if no template frame was on the stack
+    """
+
+    def __init__(self, filename, lineno, size, count):
+        self.filename = filename
+        self.lineno = lineno
+        self.size = size
+        self.count = count
+
+    def __repr__(self):
+        return "<Allocation %s:%s size=%d count=%d>" % (
+            self.filename,
+            self.lineno,
+            self.size,
+            self.count,
+        )
+
+
+class AllocationReport(object):
+    """
+    The memory allocated by rendering a template and in use at the
+    highest point of the memory use seen between the lines executed,
+    by location: the output buffer, and the temporary objects alive at
+    that point, such as the copy of the context, the closures of the
+    template functions and the escaped values. ``peak`` is the peak of
+    the traced memory during the rendering, or None if it cannot be
+    measured on this Python version.
+    """
+
+    def __init__(self, allocations, peak):
+        self.allocations = allocations
+        self.peak = peak
+
+    @property
+    def size(self):
+        return sum(i.size for i in self.allocations)
+
+    @property
+    def count(self):
+        return sum(i.count for i in self.allocations)
+
+    def format(self, limit=10):
+        lines = [
+            "%d blocks, %d bytes allocated, peak %s bytes"
+            % (self.count, self.size, "unknown" if self.peak is None else self.peak)
+        ]
+
+        for i in self.allocations[:limit]:
+            lines.append(
+                "%s:%s: %d blocks, %d bytes" % (i.filename, i.lineno, i.count, i.size)
+            )
+
+        return lines
+
+    def __str__(self):
+        return "\n".join(self.format())
+
+
+class PeakTracer(object):
+    """
+    A trace function that takes a snapshot of the traced memory whenever
+    the memory in use is higher than before, between the lines executed
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.highest = -1
+
+        # the memory used by the snapshot itself
+        self.overhead = 0
+
+    def __call__(self, frame, event, arg):
+        self.check()
+        return self
+
+    def check(self):
+        current = tracemalloc.get_traced_memory()[0] - self.overhead
+        if current > self.highest:
+            self.highest = current
+            self.snapshot = None
+            base = tracemalloc.get_traced_memory()[0]
+            self.snapshot = tracemalloc.take_snapshot()
+            self.overhead = tracemalloc.get_traced_memory()[0] - base
+
+
+def get_template_info(template):
+    return template.binder_func.__globals__["__TK_template_info__"]
+
+
+def get_template_files(template):
+    """
+    Return the template infos by file name of the template and of the
+    templates cached by its loader, such as the imported templates
+    """
+
+    template_files = {}
+    loader = template.binder_func.__globals__["__TK__runtime"].loader
+    for i in getattr(loader, "cache", {}).values():
+        info = get_template_info(i)
+        template_files[info.filename] = info
+
+    info = get_template_info(template)
+    template_files[info.filename] = info
+    return template_files
+
+
+def get_location(traceback, template_files):
+    """
+    Return the location of the most recent template frame in the
+    traceback, mapped to the template source line, or the most recent
+    frame if there is no template frame in it
+    """
+
+    for frame in reversed(traceback):
+        info = template_files.get(frame.filename)
+        if info is not None:
+            return info.get_location(frame.lineno)
+
+    frame = traceback[-1]
+    return frame.filename, frame.lineno
+
+
+def allocation_report(template, context, funcname="__main__"):
+    """
+    Render the template with the context and return an
+    ``AllocationReport`` of the memory it allocated, attributed to the
+    lines of the template and of the templates compiled into it. If
+    ``tracemalloc`` is not yet tracing, it is started for the rendering
+    only; if it is, its traceback limit applies. The rendering is traced
+    with ``sys.settrace``, replacing any trace function for its duration.
+    """
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(TRACEBACK_LIMIT)
+
+    try:
+        before = tracemalloc.take_snapshot()
+        current = tracemalloc.get_traced_memory()[0]
+        reset_peak = getattr(tracemalloc, "reset_peak", None)
+        if reset_peak is not None:
+            reset_peak()
+
+        tracer = PeakTracer()
+        trace = sys.gettrace()
+        sys.settrace(tracer)
+        try:
+            buffer = template.render_to_buffer(context, funcname)
+        finally:
+            sys.settrace(trace)
+
+        peak = None
+        if reset_peak is not None:
+            peak = max(tracemalloc.get_traced_memory()[1] - current, 0)
+
+        tracer.check()
+        after = tracer.snapshot
+        del buffer
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+
+    template_files = get_template_files(template)
+    by_location = {}
+    for diff in after.compare_to(before, "traceback"):
+        if diff.size_diff <= 0 or diff.count_diff <= 0:
+            continue
+
+        location = get_location(diff.traceback, template_files)
+        if location in by_location:
+            allocation = by_location[location]
+            allocation.size += diff.size_diff
+            allocation.count += diff.count_diff
+        else:
+            by_location[location] = Allocation(
+                location[0], location[1], diff.size_diff, diff.count_diff
+            )
+
+    allocations = sorted(by_location.values(), key=lambda i: i.size, reverse=True)
+    return AllocationReport(allocations, peak)
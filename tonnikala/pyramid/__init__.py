@@ -6,6 +6,8 @@ http://pypi.python.org/pypi/tonnikala/
 http://docs.pylonshq.com/
 """
 
+import gc
+import glob
 import os
 
 try:
@@ -34,6 +36,9 @@ from pyramid.settings import asbool, aslist
 
 import tonnikala.loader
 
+# preload the templates after the other configuration actions
+PHASE_PRELOAD = 10
+
 
 class PyramidTonnikalaLoader(tonnikala.loader.FileLoader):
     def __init__(self):
@@ -48,6 +53,7 @@ class PyramidTonnikalaLoader(tonnikala.loader.FileLoader):
         """
 
         self.search_paths.append((module, directory))
+        self.resolved.clear()
 
     def resolve(self, name):
         """
@@ -74,12 +80,47 @@ class PyramidTonnikalaLoader(tonnikala.loader.FileLoader):
 
         return super(PyramidTonnikalaLoader, self).resolve(name)
 
+    def get_search_dirs(self):
+        dirs = []
+        for module, directory in self.search_paths:
+            if module:
+                try:
+                    directory = resource_filepath(module, directory)
+                except Exception:
+                    continue
+
+            dirs.append(directory)
+
+        return dirs + super(PyramidTonnikalaLoader, self).get_search_dirs()
+
+    def find_templates(self, pattern):
+        """
+        Find the templates matching the pattern; a
+        ``package:directory/*.tk``-style pattern yields asset specs
+        """
+
+        if ":" not in pattern or os.path.isabs(pattern):
+            return super(PyramidTonnikalaLoader, self).find_templates(pattern)
+
+        module, pattern = pattern.split(":", 1)
+        names = []
+        for path in sorted(
+            glob.glob(resource_filepath(module, pattern), recursive=True)
+        ):
+            if os.path.isfile(path):
+                path = os.path.relpath(path, resource_filepath(module, ""))
+                names.append("%s:%s" % (module, path.replace(os.sep, "/")))
+
+        return names
+
 
 class TonnikalaTemplateRenderer(object):
-    def __init__(self, info, loader, debug=True):
+    def __init__(self, info, loader, debug=True, streaming=False, etag=False):
         self.info = info
         self.loader = loader
         self.debug = debug
+        self.streaming = streaming
+        self.etag = etag
 
     def implementation(self):
         return self
@@ -94,6 +135,16 @@ class TonnikalaTemplateRenderer(object):
         * ``renderer_name`` (the template name or simple name of the renderer),
         * ``context`` (the context object passed to the view), and
         * ``request`` (the request object passed to the view).
+
+        If streaming is enabled and the value is rendered for a view,
+        the result is an iterator of encoded chunks of the output, which
+        Pyramid uses as the ``app_iter`` of the response. A view can
+        enable or disable streaming for its response by setting
+        ``request.tonnikala_streaming``.
+
+        Otherwise, if ETags are enabled and the value is rendered for a
+        view, the result is the encoded output, and the digest of it is
+        set as the strong ETag of the response.
         """
 
         name = system["renderer_name"]
@@ -106,12 +157,52 @@ class TonnikalaTemplateRenderer(object):
                 "TonnikalaTemplateRenderer was passed a " "non-dictionary as value."
             )
 
+        if not fragment and self.is_streaming(system):
+            return self.stream(compiled, system)
+
+        if not fragment and self.etag and system.get("view") is not None:
+            response = getattr(system.get("request"), "response", None)
+            if response is not None:
+                return self.render_with_etag(compiled, system, response)
+
         rendered = compiled.render(system)
         if not fragment:
             rendered = str(rendered)
 
         return rendered
 
+    def is_streaming(self, system):
+        # pyramid.renderers.render and render_to_response do not
+        # pass the view; their callers expect a string
+        if system.get("view") is None:
+            return False
+
+        streaming = getattr(system.get("request"), "tonnikala_streaming", None)
+        if streaming is None:
+            return self.streaming
+
+        return streaming
+
+    def get_charset(self, system):
+        response = getattr(system.get("request"), "response", None)
+        if response is not None and response.charset:
+            return response.charset
+
+        return "UTF-8"
+
+    def stream(self, compiled, system):
+        charset = self.get_charset(system)
+        chunks = compiled.render_iter(system)
+        return (chunk.encode(charset) for chunk in chunks)
+
+    def render_with_etag(self, compiled, system, response):
+        body, digest = compiled.render_with_digest(
+            system, encoding=self.get_charset(system)
+        )
+        response.etag = digest
+        response.conditional_response = True
+        return body
+
     def fragment(self, tmpl, value, system):
         system["renderer_name"] = tmpl
         return self(value, system, fragment=True)
@@ -120,6 +211,8 @@ class TonnikalaTemplateRenderer(object):
 class TonnikalaRendererFactory(object):
     def __init__(self):
         self.debug = False
+        self.streaming = False
+        self.etag = False
         self.loader = PyramidTonnikalaLoader()
 
     def set_l10n(self, flag):
@@ -128,11 +221,23 @@ class TonnikalaRendererFactory(object):
     def set_reload(self, flag):
         self.loader.set_reload(flag)
 
+    def set_streaming(self, flag):
+        self.streaming = flag
+
+    def set_etag(self, flag):
+        self.etag = flag
+
     def add_search_path(self, module, path):
         self.loader.add_search_path(module, path)
 
     def __call__(self, info):
-        return TonnikalaTemplateRenderer(info, self.loader, debug=self.debug)
+        return TonnikalaTemplateRenderer(
+            info,
+            self.loader,
+            debug=self.debug,
+            streaming=self.streaming,
+            etag=self.etag,
+        )
 
 
 def add_tonnikala_extensions(config, *extensions):
@@ -173,6 +278,47 @@ def set_tonnikala_l10n(config, flag):
     config.registry.tonnikala_renderer_factory.set_l10n(flag)
 
 
+def set_tonnikala_streaming(config, flag):
+    """
+    Set the streaming flag for tonnikala template renderer.
+    If True, the rendered output is returned as the response app_iter
+    in chunks instead of a single string
+    """
+
+    config.registry.tonnikala_renderer_factory.set_streaming(flag)
+
+
+def set_tonnikala_etag(config, flag):
+    """
+    Set the ETag flag for tonnikala template renderer.
+    If True, the digest of the output of templates rendered for views
+    is set as the strong ETag of the response, and the response is made
+    conditional; streamed responses do not get an ETag
+    """
+
+    config.registry.tonnikala_renderer_factory.set_etag(flag)
+
+
+def preload_tonnikala_templates(config, *patterns, freeze=True):
+    """
+    Compile the templates matching the glob patterns when the
+    configuration is committed, so that a server that forks its workers
+    after loading the application compiles them only once. If
+    ``freeze`` is true, ``gc.freeze()`` is called afterwards so that the
+    compiled templates stay in pages shared by the forked workers.
+    """
+
+    loader = config.registry.tonnikala_renderer_factory.loader
+
+    def preload():
+        loader.preload(*patterns)
+        if freeze and hasattr(gc, "freeze"):
+            gc.collect()
+            gc.freeze()
+
+    config.action(("tonnikala-preload",) + patterns, preload, order=PHASE_PRELOAD)
+
+
 def includeme(config):
     if hasattr(config.registry, "tonnikala_renderer_factory"):
         return
@@ -183,6 +329,9 @@ def includeme(config):
     config.add_directive("add_tonnikala_search_paths", add_tonnikala_search_paths)
     config.add_directive("set_tonnikala_reload", set_tonnikala_reload)
     config.add_directive("set_tonnikala_l10n", set_tonnikala_l10n)
+    config.add_directive("set_tonnikala_streaming", set_tonnikala_streaming)
+    config.add_directive("set_tonnikala_etag", set_tonnikala_etag)
+    config.add_directive("preload_tonnikala_templates", preload_tonnikala_templates)
 
     settings = config.registry.settings
 
@@ -206,5 +355,32 @@ def includeme(config):
 
     config.set_tonnikala_reload(asbool(tk_reload))
 
+    loader = config.registry.tonnikala_renderer_factory.loader
+    loader.flatten_extends = asbool(settings.get("tonnikala.flatten_extends"))
+
+    if settings.get("tonnikala.max_output_size"):
+        loader.max_output_size = int(settings["tonnikala.max_output_size"])
+
+    if settings.get("tonnikala.render_timeout"):
+        loader.render_timeout = float(settings["tonnikala.render_timeout"])
+
+    loader.translate_tracebacks = asbool(
+        settings.get("tonnikala.translate_tracebacks", True)
+    )
+
     l10n = asbool(settings.get("tonnikala.l10n"))
     config.set_tonnikala_l10n(l10n)
+
+    streaming = asbool(settings.get("tonnikala.streaming"))
+    config.set_tonnikala_streaming(streaming)
+
+    etag = asbool(settings.get("tonnikala.etag"))
+    config.set_tonnikala_etag(etag)
+
+    if "tonnikala.preload" in settings:
+        patterns = settings["tonnikala.preload"]
+        if not is_nonstr_iter(patterns):
+            patterns = aslist(patterns, flatten=True)
+
+        freeze = asbool(settings.get("tonnikala.preload_gc_freeze", True))
+        config.preload_tonnikala_templates(*patterns, freeze=freeze)
@@ -4,6 +4,8 @@
 
 struct Buffer_module_state {
     PyObject *escape;
+    PyObject *limit_error;
+    PyObject *mapping;
     PyObject *equals_quot;
     PyObject *quot;
     PyObject *space;
@@ -13,6 +15,40 @@ static PyModuleDef buffermodule;
 
 #define GETSTATE(m) ((struct Buffer_module_state*)PyModule_GetState(m))
 
+/*
+ * The Buffer type is a heap type created per module object, and the
+ * module state is reached through it. Python 3.8 has no way to get from
+ * a type to its module, and no per-interpreter GIL either, so there the
+ * module is remembered in a static variable and can be loaded only once.
+ */
+#if PY_VERSION_HEX >= 0x03090000
+#define GETTYPESTATE(type) \
+    ((struct Buffer_module_state*)PyType_GetModuleState(type))
+#define TYPEMODULE(type) PyType_GetModule(type)
+#else
+static PyObject *legacy_module = NULL;
+#define GETTYPESTATE(type) GETSTATE(legacy_module)
+#define TYPEMODULE(type) legacy_module
+#endif
+
+/*
+ * The module state is shared by all threads. On the free-threaded build
+ * the reads in Buffer_new and the swap in _set_escape_method are done in
+ * a critical section on the module; with the GIL these are no-ops.
+ * Dicts are iterated in a critical section too.
+ */
+#if PY_VERSION_HEX >= 0x030D0000
+#define STATE_LOCK(m) Py_BEGIN_CRITICAL_SECTION(m)
+#define STATE_UNLOCK() Py_END_CRITICAL_SECTION()
+#else
+#define STATE_LOCK(m) {
+#define STATE_UNLOCK() }
+#endif
+
+/*
+ * A Buffer with a max_size of -1 does not limit its size, and does not
+ * keep count of it either
+ */
 typedef struct {
     PyObject_HEAD
     PyObject *buffer_list;
@@ -20,47 +56,160 @@ typedef struct {
     PyObject *equals_quot;
     PyObject *quot;
     PyObject *space;
+    Py_ssize_t max_size;
+    Py_ssize_t size;
 } Buffer;
 
 static void
 Buffer_dealloc(Buffer* self)
 {
     Py_XDECREF(self->buffer_list);
-    Py_TYPE(self)->tp_free((PyObject*)self);
+    Py_XDECREF(self->escape_func);
+    Py_XDECREF(self->equals_quot);
+    Py_XDECREF(self->quot);
+    Py_XDECREF(self->space);
+
+    // instances of heap types own a reference to their type
+    PyTypeObject *type = Py_TYPE(self);
+    type->tp_free((PyObject*)self);
+    Py_DECREF(type);
 }
 
-static PyTypeObject buffer_BufferType;
-
 static PyObject *
 Buffer_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 {
+    static char *_keywords[] = {"max_size", NULL};
+
     Buffer *self;
+    PyObject *max_size = Py_None;
+
+    if ((kwds != NULL || PyTuple_GET_SIZE(args) != 0)
+            && !PyArg_ParseTupleAndKeywords(args, kwds, "|O:Buffer",
+                                            _keywords, &max_size)) {
+        return NULL;
+    }
 
     self = (Buffer *)type->tp_alloc(type, 0);
     if (self != NULL) {
-        PyObject* module = PyState_FindModule(&buffermodule);
+        self->max_size = -1;
+        self->size = 0;
+        if (max_size != Py_None) {
+            self->max_size = PyLong_AsSsize_t(max_size);
+            if (self->max_size < 0) {
+                if (!PyErr_Occurred()) {
+                    PyErr_SetString(PyExc_ValueError,
+                        "max_size must not be negative");
+                }
+
+                Py_DECREF(self);
+                return NULL;
+            }
+        }
+
+        struct Buffer_module_state *state = GETTYPESTATE(type);
         self->buffer_list = PyList_New(0);
         if (self->buffer_list == NULL) {
             Py_DECREF(self);
             return NULL;
         }
 
-        self->escape_func = GETSTATE(module)->escape;
+        STATE_LOCK(TYPEMODULE(type));
+        self->escape_func = state->escape;
         Py_INCREF(self->escape_func);
+        STATE_UNLOCK();
 
-        self->equals_quot = GETSTATE(module)->equals_quot;
+        self->equals_quot = state->equals_quot;
         Py_INCREF(self->equals_quot);
 
-        self->quot = GETSTATE(module)->quot;
+        self->quot = state->quot;
         Py_INCREF(self->quot);
 
-        self->space = GETSTATE(module)->space;
+        self->space = state->space;
         Py_INCREF(self->space);
     }
 
     return (PyObject *)self;
 }
 
+/*
+ * Count the length of the output to be added to a Buffer that has a
+ * maximum size, raising the limit error if it would be exceeded
+ */
+static int
+_grow(Buffer *self, Py_ssize_t length) {
+    PyObject *error;
+
+    if (length <= self->max_size - self->size) {
+        self->size += length;
+        return 0;
+    }
+
+    error = GETTYPESTATE(Py_TYPE(self))->limit_error;
+    if (error == Py_None) {
+        error = PyExc_RuntimeError;
+    }
+
+    PyErr_Format(error,
+        "The template output exceeds the maximum size of %zd characters",
+        self->max_size);
+    return -1;
+}
+
+static Py_ssize_t
+_buffer_size(Buffer *buffer) {
+    Py_ssize_t i, size = 0;
+
+    if (buffer->max_size >= 0) {
+        return buffer->size;
+    }
+
+    for (i = 0; i < PyList_GET_SIZE(buffer->buffer_list); i++) {
+        size += PyUnicode_GET_LENGTH(PyList_GET_ITEM(buffer->buffer_list, i));
+    }
+
+    return size;
+}
+
+static inline int
+_append_unicode(Buffer *self, PyObject *obj) {
+    if (self->max_size >= 0 && _grow(self, PyUnicode_GET_LENGTH(obj)) != 0) {
+        return -1;
+    }
+
+    return PyList_Append(self->buffer_list, obj);
+}
+
+static int
+_append_object(Buffer *self, PyObject *obj) {
+    // Buffers of the same module share the type
+    if (Py_TYPE(obj) == Py_TYPE(self)) {
+        if (self->max_size >= 0
+                && _grow(self, _buffer_size((Buffer*)obj)) != 0) {
+            return -1;
+        }
+
+        // Use PyList_SetSlice for efficient bulk append
+        PyObject *other_list = ((Buffer*)obj)->buffer_list;
+        return PyList_SetSlice(self->buffer_list, PY_SSIZE_T_MAX, PY_SSIZE_T_MAX, other_list);
+    }
+
+    if (! PyUnicode_CheckExact(obj)) {
+        int rv;
+
+        obj = PyObject_Str(obj);
+        if (! obj) {
+            return -1;
+        }
+
+        rv = _append_unicode(self, obj);
+        // it is a new reference
+        Py_DECREF(obj);
+        return rv;
+    }
+
+    return _append_unicode(self, obj);
+}
+
 static PyObject *
 _do_append(Buffer *self, PyObject *args) {
     Py_ssize_t tuple_size;
@@ -68,32 +217,8 @@ _do_append(Buffer *self, PyObject *args) {
 
     tuple_size = PyTuple_GET_SIZE(args);
     for (i = 0; i < tuple_size; i++) {
-        PyObject* obj;
-        obj = PyTuple_GET_ITEM(args, i);
-        if (Py_TYPE(obj) == &buffer_BufferType) {
-            // Use PyList_SetSlice for efficient bulk append
-            PyObject *other_list = ((Buffer*)obj)->buffer_list;
-            if (PyList_SetSlice(self->buffer_list, PY_SSIZE_T_MAX, PY_SSIZE_T_MAX, other_list) != 0) {
-                return NULL;
-            }
-        }
-        else {
-            if (! PyUnicode_CheckExact(obj)) {
-                obj = PyObject_Str(obj);
-                if (! obj) {
-                    return NULL;
-                }
-                if (PyList_Append(self->buffer_list, obj) != 0) {
-                    return NULL;
-                }
-                // it is a new reference
-                Py_DECREF(obj);
-            }
-            else {
-                if (PyList_Append(self->buffer_list, obj) != 0) {
-                    return NULL;
-                }
-            }
+        if (_append_object(self, PyTuple_GET_ITEM(args, i)) != 0) {
+            return NULL;
         }
     }
 
@@ -114,78 +239,362 @@ Buffer_call(PyObject *self, PyObject *args, PyObject *other)
     return _do_append((Buffer*)self, args);
 }
 
+/*
+ * Resolve the attribute / constant subscript path of an output_loop part
+ * against the loop item. A str step is an attribute name, a 1-tuple step
+ * is a subscript key. Returns a new reference.
+ */
 static PyObject *
-Buffer_output_boolean_attr(Buffer *self, PyObject *args) {
-    ternaryfunc call;
-    Py_ssize_t tuple_size;
+_resolve_loop_path(PyObject *item, PyObject *path) {
+    Py_ssize_t path_size;
+    Py_ssize_t i;
+    PyObject *value = item;
 
-    tuple_size = PyTuple_GET_SIZE(args);
-    if (tuple_size != 2) {
-        PyErr_SetString(PyExc_TypeError,
-            "output_boolean_attr takes 2 arguments: name and value");
-        return NULL;
+    Py_INCREF(value);
+    path_size = PyTuple_GET_SIZE(path);
+    for (i = 0; i < path_size; i++) {
+        PyObject *step = PyTuple_GET_ITEM(path, i);
+        PyObject *next;
+
+        if (PyUnicode_CheckExact(step)) {
+            next = PyObject_GetAttr(value, step);
+        }
+        else {
+            next = PyObject_GetItem(value, PyTuple_GET_ITEM(step, 0));
+        }
+
+        Py_DECREF(value);
+        if (next == NULL) {
+            return NULL;
+        }
+
+        value = next;
     }
 
-    PyObject *value = PyTuple_GET_ITEM(args, 1);
+    return value;
+}
+
+/*
+ * Escape a value like the escape function would, but without calling it
+ * for exact str objects that have no characters needing escaping, and for
+ * exact ints and floats whose string representation never needs escaping.
+ * Returns a new reference.
+ */
+static PyObject *
+_escape_value(Buffer *self, PyObject *value) {
+    if (PyUnicode_CheckExact(value)) {
+        Py_ssize_t length, i;
+        const void *data;
+        int kind;
+
+#if PY_VERSION_HEX < 0x030C0000
+        if (PyUnicode_READY(value) < 0) {
+            return NULL;
+        }
+#endif
+        length = PyUnicode_GET_LENGTH(value);
+        kind = PyUnicode_KIND(value);
+        data = PyUnicode_DATA(value);
+        for (i = 0; i < length; i++) {
+            switch (PyUnicode_READ(kind, data, i)) {
+                case '&': case '<': case '>': case '"': case '\'':
+                    goto call_escape;
+            }
+        }
+
+        Py_INCREF(value);
+        return value;
+    }
+
+    if (PyLong_CheckExact(value) || PyFloat_CheckExact(value)) {
+        return PyObject_Str(value);
+    }
+
+call_escape:
+    return PyObject_CallFunctionObjArgs(self->escape_func, value, NULL);
+}
+
+/*
+ * Output an attribute with a single expression as its value: nothing
+ * for None and False, name="name" for True, and the escaped value
+ * otherwise. The pieces are appended directly to the buffer list.
+ */
+static int
+_output_boolean_attr(Buffer *self, PyObject *name, PyObject *value) {
+    PyObject *escaped;
+    int rv;
+
     if (value == Py_None || value == Py_False) {
-        Py_INCREF(Py_None);
-        return Py_None;
+        return 0;
     }
 
-    PyObject *name = PyTuple_GET_ITEM(args, 0);
-    PyObject *tmp = PyTuple_New(5);
-    if (! tmp) {
-        goto error;
+    if (_append_unicode(self, self->space) != 0
+            || _append_object(self, name) != 0
+            || _append_unicode(self, self->equals_quot) != 0) {
+        return -1;
     }
 
     if (value == Py_True) {
-        Py_INCREF(name);
-        value = name;
+        rv = _append_object(self, name);
     }
     else {
-        call = self->escape_func->ob_type->tp_call;
-        if (call == NULL) {
-            PyErr_SetString(PyExc_TypeError,
-                "escape function is not callable");
+        escaped = _escape_value(self, value);
+        if (escaped == NULL) {
+            return -1;
+        }
+
+        rv = _append_object(self, escaped);
+        Py_DECREF(escaped);
+    }
+
+    if (rv != 0) {
+        return -1;
+    }
+
+    return _append_unicode(self, self->quot);
+}
+
+static PyObject *
+Buffer_output_boolean_attr(Buffer *self, PyObject *const *args,
+                           Py_ssize_t nargs) {
+    if (nargs != 2) {
+        PyErr_SetString(PyExc_TypeError,
+            "output_boolean_attr takes 2 arguments: name and value");
+        return NULL;
+    }
+
+    if (_output_boolean_attr(self, args[0], args[1]) != 0) {
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static int
+_output_attr_pair(Buffer *self, PyObject *pair) {
+    PyObject *tuple;
+    int rv;
+
+    if (PyTuple_CheckExact(pair)) {
+        Py_INCREF(pair);
+        tuple = pair;
+    }
+    else {
+        tuple = PySequence_Tuple(pair);
+        if (tuple == NULL) {
+            return -1;
+        }
+    }
+
+    if (PyTuple_GET_SIZE(tuple) != 2) {
+        PyErr_SetString(PyExc_ValueError,
+            "py:attrs items must be (name, value) pairs");
+        Py_DECREF(tuple);
+        return -1;
+    }
+
+    rv = _output_boolean_attr(self,
+        PyTuple_GET_ITEM(tuple, 0), PyTuple_GET_ITEM(tuple, 1));
+    Py_DECREF(tuple);
+    return rv;
+}
+
+/*
+ * Output the attributes of a mapping or an iterable of (name, value)
+ * pairs, as evaluated from py:attrs.
+ */
+static PyObject *
+Buffer_output_attrs(Buffer *self, PyObject *const *args, Py_ssize_t nargs) {
+    PyObject *values, *iterator, *item;
+    int truth, rv = 0;
+
+    if (nargs != 1) {
+        PyErr_SetString(PyExc_TypeError,
+            "output_attrs takes exactly 1 argument");
+        return NULL;
+    }
+
+    values = args[0];
+    truth = PyObject_IsTrue(values);
+    if (truth <= 0) {
+        goto done;
+    }
+
+    if (PyDict_CheckExact(values)) {
+        PyObject *key, *value;
+        Py_ssize_t pos = 0;
+
+        STATE_LOCK(values);
+        while (PyDict_Next(values, &pos, &key, &value)) {
+            // escaping may run arbitrary code that changes the dict
+            Py_INCREF(key);
+            Py_INCREF(value);
+            rv = _output_boolean_attr(self, key, value);
+            Py_DECREF(key);
+            Py_DECREF(value);
+            if (rv != 0) {
+                break;
+            }
+        }
+        STATE_UNLOCK();
+
+        truth = rv;
+        goto done;
+    }
+
+    truth = PyObject_IsInstance(values,
+        GETTYPESTATE(Py_TYPE(self))->mapping);
+    if (truth < 0) {
+        goto done;
+    }
+
+    if (truth) {
+        values = PyMapping_Items(values);
+        if (values == NULL) {
             return NULL;
         }
+    }
+    else {
+        Py_INCREF(values);
+    }
 
-        PyObject *escape_args = PyTuple_New(1);
-        Py_INCREF(value);
-        PyTuple_SET_ITEM(escape_args, 0, value);
+    iterator = PyObject_GetIter(values);
+    Py_DECREF(values);
+    if (iterator == NULL) {
+        return NULL;
+    }
 
-        PyObject *result = (*call)(self->escape_func, escape_args, NULL);
-        if (result == NULL) {
-            goto error;
+    while ((item = PyIter_Next(iterator)) != NULL) {
+        rv = _output_attr_pair(self, item);
+        Py_DECREF(item);
+        if (rv != 0) {
+            break;
         }
+    }
+
+    Py_DECREF(iterator);
+    truth = (rv != 0 || PyErr_Occurred()) ? -1 : 0;
+
+done:
+    if (truth < 0) {
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
 
-        Py_DECREF(escape_args);
-        value = result;
+static int
+_check_loop_parts(PyObject *parts) {
+    Py_ssize_t n_parts;
+    Py_ssize_t i, j;
+
+    if (! PyTuple_CheckExact(parts)) {
+        PyErr_SetString(PyExc_TypeError,
+            "output_loop parts must be a tuple");
+        return -1;
     }
 
-    Py_INCREF(self->space);
-    PyTuple_SET_ITEM(tmp, 0, self->space);
+    n_parts = PyTuple_GET_SIZE(parts);
+    for (i = 0; i < n_parts; i++) {
+        PyObject *part = PyTuple_GET_ITEM(parts, i);
+        if (PyUnicode_CheckExact(part)) {
+            continue;
+        }
 
-    Py_INCREF(name);
-    PyTuple_SET_ITEM(tmp, 1, name);
+        if (! PyTuple_CheckExact(part)) {
+            goto invalid;
+        }
 
-    Py_INCREF(self->equals_quot);
-    PyTuple_SET_ITEM(tmp, 2, self->equals_quot);
+        for (j = 0; j < PyTuple_GET_SIZE(part); j++) {
+            PyObject *step = PyTuple_GET_ITEM(part, j);
+            if (PyUnicode_CheckExact(step)) {
+                continue;
+            }
 
-    PyTuple_SET_ITEM(tmp, 3, value);
+            if (! PyTuple_CheckExact(step) || PyTuple_GET_SIZE(step) != 1) {
+                goto invalid;
+            }
+        }
+    }
 
-    Py_INCREF(self->quot);
-    PyTuple_SET_ITEM(tmp, 4, self->quot);
+    return 0;
 
-    PyObject *rv = _do_append(self, tmp);
-    Py_DECREF(tmp);
+invalid:
+    PyErr_SetString(PyExc_TypeError,
+        "output_loop parts must be strings or tuples of access steps");
+    return -1;
+}
+
+static PyObject *
+Buffer_output_loop(Buffer *self, PyObject *args) {
+    PyObject *iterable, *parts, *iterator, *item;
+    Py_ssize_t n_parts;
+    Py_ssize_t i;
+
+    if (! PyArg_ParseTuple(args, "OO:output_loop", &iterable, &parts)) {
+        return NULL;
+    }
+
+    if (_check_loop_parts(parts) != 0) {
+        return NULL;
+    }
+
+    iterator = PyObject_GetIter(iterable);
+    if (iterator == NULL) {
+        return NULL;
+    }
+
+    n_parts = PyTuple_GET_SIZE(parts);
+    while ((item = PyIter_Next(iterator)) != NULL) {
+        for (i = 0; i < n_parts; i++) {
+            PyObject *part = PyTuple_GET_ITEM(parts, i);
+            PyObject *value, *escaped;
+            int rv;
+
+            if (PyUnicode_CheckExact(part)) {
+                if (_append_unicode(self, part) != 0) {
+                    goto error;
+                }
+                continue;
+            }
+
+            value = _resolve_loop_path(item, part);
+            if (value == NULL) {
+                goto error;
+            }
+
+            escaped = _escape_value(self, value);
+            Py_DECREF(value);
+            if (escaped == NULL) {
+                goto error;
+            }
+
+            rv = _append_object(self, escaped);
+            Py_DECREF(escaped);
+            if (rv != 0) {
+                goto error;
+            }
+        }
+
+        Py_DECREF(item);
+    }
+
+    Py_DECREF(iterator);
+    if (PyErr_Occurred()) {
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
 
-    return rv;
 error:
+    Py_DECREF(item);
+    Py_DECREF(iterator);
     return NULL;
 }
 
-
 static PyObject *
 Buffer_join(PyObject *self, PyObject *args) {
     PyObject *sep, *rv;
@@ -211,17 +620,22 @@ _set_escape_method(PyObject *self, PyObject *args, PyObject *kwargs) {
     static char *_keywords[] = {"escape", NULL};
 
     PyObject *escape = NULL;
+    PyObject *old;
     if (!PyArg_ParseTupleAndKeywords(args, kwargs,
-        "|O:_set_escape_method", _keywords,
+        "O:_set_escape_method", _keywords,
         &escape))
         goto exit;
 
-    PyObject *old = GETSTATE(self)->escape;
-
-    Py_DECREF(old);
+    // store the new function before releasing the old one, so that
+    // a Buffer being created concurrently never sees a freed object
     Py_INCREF(escape);
 
+    STATE_LOCK(self);
+    old = GETSTATE(self)->escape;
     GETSTATE(self)->escape = escape;
+    STATE_UNLOCK();
+
+    Py_DECREF(old);
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -230,9 +644,35 @@ exit:
     return NULL;
 }
 
+static PyObject *
+_set_limit_error(PyObject *self, PyObject *args, PyObject *kwargs) {
+    static char *_keywords[] = {"error", NULL};
+
+    PyObject *error = NULL;
+    PyObject *old;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs,
+        "O:_set_limit_error", _keywords,
+        &error))
+        return NULL;
+
+    Py_INCREF(error);
+
+    STATE_LOCK(self);
+    old = GETSTATE(self)->limit_error;
+    GETSTATE(self)->limit_error = error;
+    STATE_UNLOCK();
+
+    Py_DECREF(old);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static PyMemberDef Buffer_members[] = {
     {"buffer", T_OBJECT_EX, offsetof(Buffer, buffer_list), 0,
      "The buffer list"},
+    {"max_size", T_PYSSIZET, offsetof(Buffer, max_size), READONLY,
+     "The maximum size of the output, or -1 if not limited"},
     {NULL}  /* Sentinel */
 };
 
@@ -242,9 +682,17 @@ static PyMethodDef Buffer_methods[] = {
     { "join", Buffer_join, METH_NOARGS,
         "Returns the contents of the buffer as a string" },
     { "output_boolean_attr",
-        (PyCFunction)Buffer_output_boolean_attr,
+        (PyCFunction)(void(*)(void))Buffer_output_boolean_attr,
+        METH_FASTCALL,
+        "Outputs a boolean or string attribute" },
+    { "output_attrs",
+        (PyCFunction)(void(*)(void))Buffer_output_attrs,
+        METH_FASTCALL,
+        "Outputs the attributes of a mapping or of (name, value) pairs" },
+    { "output_loop",
+        (PyCFunction)Buffer_output_loop,
         METH_VARARGS,
-        "Outputs a bool	ean or string attribute" },
+        "Outputs the given parts for each item of an iterable" },
     {NULL}  /* Sentinel */
 };
 
@@ -253,92 +701,144 @@ static PyMethodDef Buffer_module_methods[] = {
      (PyCFunction)_set_escape_method,
      METH_VARARGS | METH_KEYWORDS,
      "Sets the escape method used by buffer to escape strings"},
+    {"_set_limit_error",
+     (PyCFunction)_set_limit_error,
+     METH_VARARGS | METH_KEYWORDS,
+     "Sets the exception raised when a buffer exceeds its maximum size"},
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
 
-static PyTypeObject buffer_BufferType = {
-    PyVarObject_HEAD_INIT(NULL, 0)
-    "buffer.Buffer",           /* tp_name */
-    sizeof(Buffer),            /* tp_basicsize */
-    0,                         /* tp_itemsize */
-    (destructor)Buffer_dealloc,            /* tp_dealloc */
-    0,                         /* tp_print */
-    0,                         /* tp_getattr */
-    0,                         /* tp_setattr */
-    0,                         /* tp_reserved */
-    0,                         /* tp_repr */
-    0,                         /* tp_as_number */
-    0,                         /* tp_as_sequence */
-    0,                         /* tp_as_mapping */
-    0,                         /* tp_hash  */
-    Buffer_call,               /* tp_call */
-    Buffer_str,                /* tp_str (is a reprfunc) */
-    0,                         /* tp_getattro */
-    0,                         /* tp_setattro */
-    0,                         /* tp_as_buffer */
-    Py_TPFLAGS_DEFAULT,        /* tp_flags */
-    "Buffer objects",          /* tp_doc */
-    0,                         /* tp_traverse */
-    0,                         /* tp_clear */
-    0,                         /* tp_richcompare */
-    0,                         /* tp_weaklistoffset */
-    0,                         /* tp_iter */
-    0,                         /* tp_iternext */
-    Buffer_methods,            /* tp_methods */
-    Buffer_members,            /* tp_members */
-    0,                         /* tp_getset */
-    0,                         /* tp_base */
-    0,                         /* tp_dict */
-    0,                         /* tp_descr_get */
-    0,                         /* tp_descr_set */
-    0,                         /* tp_dictoffset */
-    0,                         /* tp_init */
-    0,                         /* tp_alloc */
-    Buffer_new,                /* tp_new */
+static PyType_Slot Buffer_slots[] = {
+    {Py_tp_dealloc, Buffer_dealloc},
+    {Py_tp_call, Buffer_call},
+    {Py_tp_str, Buffer_str},
+    {Py_tp_doc, "Buffer objects"},
+    {Py_tp_methods, Buffer_methods},
+    {Py_tp_members, Buffer_members},
+    {Py_tp_new, Buffer_new},
+    {0, NULL}
 };
 
-#define BUFFER_DOC "Accelerated Buffer type for speeding up" \
-                   "output ops on Tonnikala templates"
-
-static PyModuleDef buffermodule = {
-    PyModuleDef_HEAD_INIT,
-    "buffer",
-    BUFFER_DOC,
-    sizeof(struct Buffer_module_state),
-    Buffer_module_methods,
-    NULL,
-    NULL,
-    NULL,
-    NULL
+static PyType_Spec Buffer_spec = {
+    "buffer.Buffer",
+    sizeof(Buffer),
+    0,
+    Py_TPFLAGS_DEFAULT,
+    Buffer_slots
 };
 
-PyMODINIT_FUNC
-PyInit__buffer(void)
+static int
+buffer_exec(PyObject *m)
 {
-    PyObject* m;
-
-    m = PyModule_Create(&buffermodule);
+    struct Buffer_module_state *st = GETSTATE(m);
+    PyObject *type, *abc;
 
-#define ERROR_RET NULL
+#if PY_VERSION_HEX < 0x03090000
+    if (legacy_module != NULL) {
+        PyErr_SetString(PyExc_ImportError,
+            "the _buffer module can be loaded only once on Python 3.8");
+        return -1;
+    }
 
-    if (m == NULL)
-        return ERROR_RET;
+    legacy_module = m;
+    type = PyType_FromSpec(&Buffer_spec);
+#else
+    type = PyType_FromModuleAndSpec(m, &Buffer_spec, NULL);
+#endif
+    if (type == NULL) {
+        return -1;
+    }
 
-    if (PyType_Ready(&buffer_BufferType) < 0)
-        return ERROR_RET;
+    if (PyModule_AddObject(m, "Buffer", type) < 0) {
+        Py_DECREF(type);
+        return -1;
+    }
 
-    Py_INCREF(&buffer_BufferType);
-    PyModule_AddObject(m, "Buffer", (PyObject *)&buffer_BufferType);
+    abc = PyImport_ImportModule("collections.abc");
+    if (abc == NULL) {
+        return -1;
+    }
 
-    struct Buffer_module_state *st = GETSTATE(m);
+    st->mapping = PyObject_GetAttrString(abc, "Mapping");
+    Py_DECREF(abc);
+    if (st->mapping == NULL) {
+        return -1;
+    }
 
     Py_INCREF(Py_None);
-
     st->escape = Py_None;
+    Py_INCREF(Py_None);
+    st->limit_error = Py_None;
     st->equals_quot = PyUnicode_FromString("=\"");
     st->space = PyUnicode_FromString(" ");
     st->quot = PyUnicode_FromString("\"");
+    if (st->equals_quot == NULL || st->space == NULL || st->quot == NULL) {
+        return -1;
+    }
+
+    return 0;
+}
+
+static int
+buffer_traverse(PyObject *m, visitproc visit, void *arg)
+{
+    struct Buffer_module_state *st = GETSTATE(m);
+    Py_VISIT(st->escape);
+    Py_VISIT(st->limit_error);
+    Py_VISIT(st->mapping);
+    return 0;
+}
+
+static int
+buffer_clear(PyObject *m)
+{
+    struct Buffer_module_state *st = GETSTATE(m);
+    Py_CLEAR(st->escape);
+    Py_CLEAR(st->limit_error);
+    Py_CLEAR(st->mapping);
+    Py_CLEAR(st->equals_quot);
+    Py_CLEAR(st->quot);
+    Py_CLEAR(st->space);
+    return 0;
+}
+
+static void
+buffer_free(void *m)
+{
+    buffer_clear((PyObject *)m);
+}
 
-    return m;
+static PyModuleDef_Slot buffer_slots[] = {
+    {Py_mod_exec, buffer_exec},
+#if PY_VERSION_HEX >= 0x030C0000
+    {Py_mod_multiple_interpreters, Py_MOD_PER_INTERPRETER_GIL_SUPPORTED},
+#endif
+#if PY_VERSION_HEX >= 0x030D0000
+    // the module state is protected by critical sections and Buffer
+    // objects are not shared between threads during a render
+    {Py_mod_gil, Py_MOD_GIL_NOT_USED},
+#endif
+    {0, NULL}
+};
+
+#define BUFFER_DOC "Accelerated Buffer type for speeding up" \
+                   "output ops on Tonnikala templates"
+
+static PyModuleDef buffermodule = {
+    PyModuleDef_HEAD_INIT,
+    "buffer",
+    BUFFER_DOC,
+    sizeof(struct Buffer_module_state),
+    Buffer_module_methods,
+    buffer_slots,
+    buffer_traverse,
+    buffer_clear,
+    buffer_free
+};
+
+PyMODINIT_FUNC
+PyInit__buffer(void)
+{
+    return PyModuleDef_Init(&buffermodule);
 }
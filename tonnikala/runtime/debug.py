@@ -39,6 +39,7 @@ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import functools
 import sys
 import traceback
 
@@ -217,8 +218,8 @@ def translate_exception(exc_info, initial_skip=0):
         # fake template exceptions
         template = tb.tb_frame.f_globals.get("__TK_template_info__")
         if template is not None:
-            lineno = template.get_corresponding_lineno(tb.tb_lineno)
-            tb = fake_exc_info(exc_info[:2] + (tb,), template.filename, lineno)[2]
+            filename, lineno = template.get_location(tb.tb_lineno)
+            tb = fake_exc_info(exc_info[:2] + (tb,), filename, lineno)[2]
 
         frames.append(make_frame_proxy(tb))
         tb = next
@@ -259,6 +260,91 @@ else:
         )
 
 
+# the number of fake code objects cached by template location
+FAKE_CODE_CACHE_SIZE = 1024
+
+
+def get_location_name(function):
+    """
+    Return the description of the template function named ``function``
+    used in place of the function name in the translated tracebacks
+    """
+
+    if function is None:
+        return "template"
+    if function == "__main__":
+        return "top-level template code"
+    if function.startswith("__TK__block__"):
+        return 'block "%s"' % function[13:]
+    if function.startswith("__TK__typed__"):
+        return function[13:].split("__")[0].replace("_", " ")
+    if function.startswith("__TK_"):
+        return "template"
+    return 'def "%s"' % function
+
+
+@functools.lru_cache(maxsize=FAKE_CODE_CACHE_SIZE)
+def get_fake_code(filename, lineno, function):
+    """
+    Return the code object that raises the exception at the line of the
+    template file, named after the template function; cached, as the
+    same errors tend to be raised repeatedly
+    """
+
+    code = compile("\n" * (lineno - 1) + raise_helper, filename, "exec")
+
+    # if it's possible, change the name of the code.  This won't work
+    # on some python environments such as google appengine
+    try:
+        code = code_with_custom_location(code, filename, get_location_name(function))
+    except Exception:
+        pass
+
+    return code
+
+
+def get_template_locations(tb):
+    """
+    Return the ``(filename, lineno, location)`` of the template frames
+    in the traceback, outermost first
+    """
+
+    locations = []
+    while tb is not None:
+        template = tb.tb_frame.f_globals.get("__TK_template_info__")
+        if template is not None:
+            filename, lineno = template.get_location(tb.tb_lineno)
+            function = tb.tb_frame.f_code.co_name
+            locations.append((filename, lineno, get_location_name(function)))
+
+        tb = tb.tb_next
+
+    return locations
+
+
+def annotate_exception(exc_info):
+    """
+    Attach the template locations of the traceback to the exception as
+    ``template_locations``, and as notes on Python 3.11+, without
+    rewriting the traceback
+    """
+
+    exc_value = exc_info[1]
+    if getattr(exc_value, "template_locations", None) is not None:
+        return
+
+    locations = get_template_locations(exc_info[2])
+    try:
+        exc_value.template_locations = locations
+    except AttributeError:  # pragma: no cover
+        return
+
+    add_note = getattr(exc_value, "add_note", None)
+    if add_note is not None:
+        for filename, lineno, location in locations:
+            add_note('  Template "%s", line %d, in %s' % (filename, lineno, location))
+
+
 def fake_exc_info(exc_info, filename, lineno):
     """Helper for `translate_exception`."""
     exc_type, exc_value, tb = exc_info
@@ -284,32 +370,8 @@ def fake_exc_info(exc_info, filename, lineno):
     }
 
     # and fake the exception
-    lineno = lineno or 0
-    code = compile("\n" * (lineno - 1) + raise_helper, filename, "exec")
-
-    # if it's possible, change the name of the code.  This won't work
-    # on some python environments such as google appengine
-    try:
-        if tb is None:
-            location = "template"
-        else:
-            function = tb.tb_frame.f_code.co_name
-            if function == "__main__":
-                location = "top-level template code"
-            elif function.startswith("__TK__block__"):
-                location = 'block "%s"' % function[13:]
-            elif function.startswith("__TK__typed__"):
-                functype = function[13:].split("__")[0].replace("_", " ")
-                location = functype
-            elif function.startswith("__TK_"):
-                location = "template"
-            else:
-                location = 'def "%s"' % function
-
-        code = code_with_custom_location(code, filename, location)
-
-    except Exception:
-        pass
+    function = None if tb is None else tb.tb_frame.f_code.co_name
+    code = get_fake_code(filename, lineno or 0, function)
 
     # execute the code and catch the new traceback
     try:
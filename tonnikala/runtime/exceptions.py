@@ -46,3 +46,10 @@ class TemplateSyntaxError(TemplateError):
                 lines.append("    " + line.strip())
 
         return "\n".join(lines)
+
+
+class RenderLimitError(TemplateError):
+    """
+    Raised when rendering a template exceeds the maximum output size
+    or the deadline configured on the loader.
+    """
@@ -1,7 +1,6 @@
 define([], function () {
     'use strict';
-    var globals = typeof window == 'undefined' ? global : window,
-        map = Array.prototype.map;
+    var globals = typeof window == 'undefined' ? global : window;
 
     function Markup(s) {
         this.s = s;
@@ -49,53 +48,71 @@ define([], function () {
         }
     };
 
+    var escapeTest = /[&<>'"]/,
+        escapeReplace = /[&<>'"]/g,
+        escapeTable = {
+            '&': '&amp;',
+            '<': '&lt;',
+            '>': '&gt;',
+            "'": '&#39;',
+            '"': '&#34;'
+        };
+
+    function replaceChar(c) {
+        return escapeTable[c];
+    }
+
+    // escapes to a plain string; most values have nothing to escape,
+    // and are returned without running the replace at all
+    function escapeString(s) {
+        if (typeof s !== 'string') {
+            if (typeof s === 'number') {
+                return String(s);
+            }
+            if (s && s.html) {
+                return String(s.html());
+            }
+            s = String(s);
+        }
+
+        return escapeTest.test(s) ? s.replace(escapeReplace, replaceChar) : s;
+    }
+
     function doEscape(s) {
         if (s && s.html) {
             return s.html();
         }
-        return new Markup(
-            String(s).replace(
-                /([&<>'"])/g,
-                function (c) {
-                    return {
-                        '&': '&amp;',
-                        '<': '&lt;',
-                        '>': '&gt;',
-                        "'": '&#39;',
-                        '"': '&#34;'
-                    }[c];
-                }
-            )
-        );
+        return new Markup(escapeString(s));
     }
 
     function isKindOfBoolean(value) {
         return value == null || typeof(value) === 'boolean';
     }
 
+    // the output is accumulated by string concatenation, which the
+    // JavaScript engines optimize with ropes
     function Buffer() {
-        this.buffer = [];
+        this.s = '';
     }
     Buffer.prototype = {
 
-        e: function (list) {
-            this.buffer = this.buffer.concat(list);
-        },
-
-        a: function (obj) {
-            this.buffer.push(obj);
+        outputOne: function (arg) {
+            if (typeof arg === 'string') {
+                this.s += arg;
+            } else if (arg instanceof Buffer) {
+                this.s += arg.s;
+            } else if (arg && arg.buffer instanceof Buffer) {
+                this.s += arg.buffer.s;
+            } else {
+                this.s += String(arg);
+            }
         },
 
         doOutput: function () {
-            var i, an = arguments.length, arg;
+            var i, an = arguments.length;
 
             for (i = 0; i < an; i++) {
-                arg = arguments[i];
-                if (arg && arg.buffer) {
-                    this.e(arg.buffer);
-                } else {
-                    this.a(String(arg));
-                }
+                this.outputOne(arguments[i]);
             }
         },
 
@@ -104,17 +121,21 @@ define([], function () {
         },
 
         escape: function () {
-            this.doOutput.apply(this, map.call(arguments, doEscape));
+            var i, an = arguments.length;
+
+            for (i = 0; i < an; i++) {
+                this.s += escapeString(arguments[i]);
+            }
         },
 
         outputBooleanAttr: function (name, value) {
             if (isKindOfBoolean(value)) {
                 if (value) {
                     // asserts that name is never user supplied directly
-                    this.doOutput(' ' + name + '="' + name + '"');
+                    this.s += ' ' + name + '="' + name + '"';
                 }
             } else {
-                this.doOutput(' ' + name + '="' + doEscape(value) + '"');
+                this.s += ' ' + name + '="' + escapeString(value) + '"';
             }
         },
 
@@ -123,11 +144,11 @@ define([], function () {
         },
 
         join: function () {
-            return this.buffer.join('');
+            return this.s;
         },
 
         toString: function () {
-            return this.join();
+            return this.s;
         }
 
     };
@@ -171,10 +192,14 @@ define([], function () {
         // A magical factory for creating a callable with attrs
         Buffer: function () {
             var buffer = new Buffer(),
-                bo = buffer.output,
-                rv = function () {
-                    bo.apply(buffer, arguments);
+                rv = function (arg) {
+                    if (arguments.length === 1) {
+                        buffer.outputOne(arg);
+                    } else {
+                        buffer.doOutput.apply(buffer, arguments);
+                    }
                 };
+            rv.buffer = buffer;
             rv.attr = buffer.outputBooleanAttr.bind(buffer);
             rv.html = buffer.html.bind(buffer);
             rv.escape = buffer.escape.bind(buffer);
@@ -186,6 +211,8 @@ define([], function () {
 
         escape: doEscape,
 
+        escapeString: escapeString,
+
         foreach: foreach,
 
         BoundTemplate: BoundTemplate,
@@ -1,14 +1,45 @@
 from collections.abc import Mapping
+from time import monotonic
+
 from markupsafe import escape
 
+from .exceptions import RenderLimitError
+
 NoneType = type(None)
 
 
 class _TKPythonBufferImpl(object):
-    def __init__(self):
+    def __init__(self, max_size=None):
         self._buffer = buffer = []
-        e = buffer.extend
-        a = buffer.append
+
+        # the size is only counted if it is limited
+        self.max_size = -1
+        if max_size is None:
+            e = buffer.extend
+            a = buffer.append
+
+        else:
+            if max_size < 0:
+                raise ValueError("max_size must not be negative")
+
+            self.max_size = max_size
+            size = [0]
+
+            def grow(length):
+                size[0] += length
+                if size[0] > max_size:
+                    raise RenderLimitError(
+                        "The template output exceeds the maximum size of %d "
+                        "characters" % max_size
+                    )
+
+            def e(parts):
+                grow(sum(map(len, parts)))
+                buffer.extend(parts)
+
+            def a(part):
+                grow(len(part))
+                buffer.append(part)
 
         def do_output(*objs):
             for obj in objs:
@@ -33,12 +64,46 @@ class _TKPythonBufferImpl(object):
 
         self.output_boolean_attr = output_boolean_attr
 
+        def output_attrs(values):
+            if not values:
+                return
+
+            if isinstance(values, Mapping):
+                values = values.items()
+
+            for k, v in values:
+                output_boolean_attr(k, v)
+
+        self.output_attrs = output_attrs
+
+        def output_loop(iterable, parts):
+            for item in iterable:
+                for part in parts:
+                    if part.__class__ is str:
+                        a(part)
+                        continue
+
+                    value = item
+                    for step in part:
+                        if step.__class__ is str:
+                            value = getattr(value, step)
+                        else:
+                            value = value[step[0]]
+
+                    do_output(escape(value))
+
+        self.output_loop = output_loop
+
     def __call__(self, *a):
         self.output(*a)
 
     def __html__(self):
         return self
 
+    @property
+    def buffer(self):
+        return self._buffer
+
     def join(self):
         return "".join(self._buffer)
 
@@ -46,59 +111,131 @@ class _TKPythonBufferImpl(object):
 
 
 try:  # pragma: no cover
-    from ._buffer import Buffer, _set_escape_method
+    from ._buffer import Buffer, _set_escape_method, _set_limit_error
 
     _set_escape_method(escape)
+    _set_limit_error(RenderLimitError)
 except ImportError:  # pragma: no cover
     Buffer = _TKPythonBufferImpl
-    _set_escape_method = None
+    _set_escape_method = _set_limit_error = None
 
-del _set_escape_method
+del _set_escape_method, _set_limit_error
 
 
 def output_attrs(values):
     if not values:
         return ""
 
-    if not isinstance(values, Mapping):
-        values = iter(values)
-    else:
-        values = values.items()
-
     rv = Buffer()
-    for k, v in values:
-        rv.output_boolean_attr(k, v)
-
+    rv.output_attrs(values)
     return rv
 
 
-def bind(context, block=False):
+# the context key of the ``tonnikala.session.RenderSession`` that wraps
+# the template functions of a rendering
+SESSION_KEY = "__TK__session"
+
+# the context key of the dict of the lazy values resolved in the render
+LAZY_VALUES_KEY = "__TK__lazy_values"
+
+
+def is_template_function(value):
+    value = getattr(value, "__wrapped__", value)
+    return "__TK__runtime" in getattr(value, "__globals__", ())
+
+
+def escaping(func):
+    """
+    Wrap a callable that replaces a template function so that its return
+    value is escaped, as the template outputs the return values of the
+    template functions without escaping them
+    """
+
+    def wrapper(*args, **kwargs):
+        return escape(func(*args, **kwargs))
+
+    wrapper.__name__ = getattr(func, "__name__", "wrapper")
+    return wrapper
+
+
+def bind(context, block=False, escaped=False):
     """
     Given the context, returns a decorator wrapper;
     the binder replaces the wrapped func with the
     value from the context OR puts this function in
-    the context with the name.
+    the context with the name. If the context has a render session, the
+    functions put in the context are wrapped by it. If ``escaped`` is
+    true, the return values of the callables in the context that are not
+    template functions are escaped, for the functions whose output the
+    template does not escape.
     """
 
+    session = context.get(SESSION_KEY)
+
     if block:
 
         def decorate(func):
             name = func.__name__.replace("__TK__block__", "")
             if name not in context:
+                if session is not None:
+                    func = session.wrap(func)
+
                 context[name] = func
-            return context[name]
+                return func
+
+            value = context[name]
+            if escaped and callable(value) and not is_template_function(value):
+                value = escaping(value)
+
+            return value
 
         return decorate
 
     def decorate(func):
         name = func.__name__
         if name not in context:
+            if session is not None:
+                func = session.wrap(func)
+
             context[name] = func
         return context[name]
 
     return decorate
 
 
+_NOT_RESOLVED = object()
+
+
+class lazy(object):
+    """
+    A context value that is computed by calling ``func`` when a template
+    first uses it, so that the values that the template does not use on
+    its rendered branches are never computed. The value is computed at
+    most once per render: a ``lazy`` passed to several renders calls
+    ``func`` again in each of them.
+    """
+
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __repr__(self):  # pragma: no cover
+        return "<lazy %r>" % (self.func,)
+
+    def resolve(self, values):
+        """
+        Return the value, computing it unless it is in ``values``, the
+        dict of the values resolved in the render
+        """
+
+        value = values.get(self, _NOT_RESOLVED)
+        if value is _NOT_RESOLVED:
+            value = values[self] = self.func()
+
+        return value
+
+
 class ImportedTemplate(object):
     def __init__(self, name):
         self._name = name
@@ -117,16 +254,48 @@ class TonnikalaRuntime(object):
     Buffer = staticmethod(Buffer)
     output_attrs = staticmethod(output_attrs)
     escape = staticmethod(escape)
+    lazy = lazy
 
     def __init__(self):
         self.loader = None
+        self.locale = None
+
+        # the maximum duration of rendering in seconds, for the templates
+        # compiled with deadline checks
+        self.render_timeout = None
+
+    def deadline_checker(self):
+        """
+        Return a function that raises ``RenderLimitError`` when called
+        after ``render_timeout`` seconds from now
+        """
+
+        timeout = self.render_timeout
+        deadline = monotonic() + timeout
+
+        def check_deadline():
+            if monotonic() > deadline:
+                raise RenderLimitError(
+                    "The rendering took longer than %s seconds" % timeout
+                )
+
+        return check_deadline
 
     def load(self, href):
-        return self.loader.load(href)
+        # the templates of a locale-specific template are of the same locale
+        if self.locale is None:
+            return self.loader.load(href)
+
+        return self.loader.load(href, locale=self.locale)
+
+    def include(self, context, href):
+        context = context.copy()
+        self.load(href).bind(context)
+        return context["__main__"]()
 
     def import_defs(self, context, href):
         modified_context = context.copy()
-        self.loader.load(href).bind(modified_context)
+        self.load(href).bind(modified_context)
         container = ImportedTemplate(href)
 
         for k, v in modified_context.items():
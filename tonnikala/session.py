@@ -0,0 +1,232 @@
+"""
+Incremental re-rendering of templates whose context changes little
+between renders
+"""
+
+import sys
+
+from .runtime.python import SESSION_KEY, ImportedTemplate, is_template_function
+
+# the name of the binder variable that the functions using the whole
+# context (dynamic imports and includes) read
+ORIGINAL_CONTEXT = "__TK__original_context"
+
+UNCACHEABLE = object()
+
+
+class Uncacheable(Exception):
+    """
+    Raised when the output of a function cannot be cached, because it
+    depends on the whole context
+    """
+
+
+class CachedFunction(object):
+    """
+    A block or top-level def of a template, wrapped by a ``RenderSession``
+    """
+
+    def __init__(self, session, func):
+        self.session = session
+        self.__wrapped__ = func
+        self.__name__ = func.__name__
+
+    def __repr__(self):  # pragma: no cover
+        return "<CachedFunction %s>" % self.__name__
+
+    def __call__(self, *args, **kwargs):
+        return self.session.call(self, args, kwargs)
+
+
+class RenderSession(object):
+    """
+    Renders a template repeatedly, caching the output of each block and
+    top-level def by its arguments, together with the values it reads
+    from the context: the free variables of the function, and those of
+    the functions it calls. On the next render the functions whose
+    values are unchanged are not executed; their cached output is used
+    instead.
+
+    The values are compared with ``==``; ``stamp(value)``, if given,
+    returns a version stamp that is compared instead, for the values
+    that are mutated in place or are expensive to compare. The output
+    of the functions that import or include templates at render time
+    is not cached, as they pass the whole context to them.
+
+    After each completed render, the cache keeps only the outputs used
+    in that render, directly or by the cached functions that used them,
+    so the arguments seen in earlier renders do not accumulate.
+
+    A session is not thread-safe.
+    """
+
+    def __init__(self, template, stamp=None):
+        self.template = template
+        self.stamp = stamp
+
+        # (code, args, kwargs) -> (inputs, output, the keys of the
+        # functions called by the function)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+        # the inputs of the functions of the current rendering, and the
+        # depths of the functions whose inputs are being computed
+        self._inputs = None
+        self._computing = None
+        self._lowest = sys.maxsize
+
+        # the cache entries used in the current rendering, and the keys
+        # of the functions called by the functions being executed
+        self._used = None
+        self._called = None
+
+    def render_to_buffer(self, context, funcname="__main__"):
+        context = dict(context)
+        context[SESSION_KEY] = self
+        self._inputs = {}
+        self._computing = {}
+        self._lowest = sys.maxsize
+        self._used = {}
+        self._called = [[]]
+        try:
+            buffer = self.template.render_to_buffer(context, funcname)
+            self.cache = self._used
+            return buffer
+        finally:
+            self._inputs = self._computing = None
+            self._used = self._called = None
+
+    def render(self, context, funcname="__main__"):
+        return self.render_to_buffer(context, funcname).join()
+
+    def clear(self):
+        self.cache.clear()
+
+    def wrap(self, func):
+        return CachedFunction(self, func)
+
+    def call(self, function, args, kwargs):
+        func = function.__wrapped__
+        try:
+            key = (func.__code__, args, tuple(sorted(kwargs.items())))
+            entry = self.cache.get(key)
+            inputs = self.get_inputs(function)
+        except (TypeError, Uncacheable):
+            return func(*args, **kwargs)
+
+        self._called[-1].append(key)
+        if entry is not None and entry[0] == inputs:
+            self.hits += 1
+            self.keep(key, entry)
+            return entry[1]
+
+        self.misses += 1
+        self._called.append([])
+        try:
+            output = func(*args, **kwargs)
+        finally:
+            called = self._called.pop()
+
+        self.cache[key] = self._used[key] = inputs, output, tuple(called)
+        return output
+
+    def keep(self, key, entry):
+        """
+        Keep the cache entry, and those of the functions it called, for
+        the next rendering
+        """
+
+        stack = [(key, entry)]
+        while stack:
+            key, entry = stack.pop()
+            if key in self._used:
+                continue
+
+            self._used[key] = entry
+            for i in entry[2]:
+                called = self.cache.get(i)
+                if called is not None:
+                    stack.append((i, called))
+
+    def get_inputs(self, function):
+        """
+        Return the stamps of the values that the function reads in the
+        current rendering, directly or through the functions it calls
+        """
+
+        inputs = self._inputs.get(function)
+        if inputs is UNCACHEABLE:
+            raise Uncacheable(function.__name__)
+
+        if inputs is not None:
+            return inputs
+
+        depth = self._computing.get(function)
+        if depth is not None:
+            # a recursive call; the inputs of the function are those
+            # being computed at that depth
+            self._lowest = min(self._lowest, depth)
+            return ()
+
+        depth = len(self._computing)
+        self._computing[function] = depth
+        lowest = self._lowest
+        self._lowest = depth
+        try:
+            inputs = self.get_closure_stamps(function.__wrapped__)
+        except Uncacheable:
+            self._inputs[function] = UNCACHEABLE
+            raise
+        finally:
+            del self._computing[function]
+            reached = self._lowest
+            self._lowest = min(lowest, reached)
+
+        # the inputs of a function in a cycle of calls are complete only
+        # once those of the function that started the cycle are
+        if reached >= depth:
+            self._inputs[function] = inputs
+
+        return inputs
+
+    def get_closure_stamps(self, func):
+        names = func.__code__.co_freevars
+        if ORIGINAL_CONTEXT in names:
+            raise Uncacheable(func.__name__)
+
+        stamps = []
+        for name, cell in zip(names, func.__closure__ or ()):
+            if name.startswith("__TK__"):
+                continue
+
+            try:
+                value = cell.cell_contents
+            except ValueError:
+                # not in the context
+                stamps.append((name,))
+                continue
+
+            stamps.append((name, self.get_stamp(value)))
+
+        return tuple(stamps)
+
+    def get_stamp(self, value):
+        if isinstance(value, CachedFunction) and value.session is self:
+            return self.get_inputs(value)
+
+        if isinstance(value, ImportedTemplate):
+            return tuple(
+                (name, self.get_stamp(i))
+                for name, i in vars(value).items()
+                if name != "_name"
+            )
+
+        # the functions created by the template on each rendering
+        if is_template_function(value) and hasattr(value, "__code__"):
+            return value.__code__, self.get_closure_stamps(value)
+
+        if self.stamp is not None:
+            return self.stamp(value)
+
+        return value
@@ -4,7 +4,7 @@ from tonnikala.ir.nodes import Element, If, For, EscapedText, Expression
 from xml.dom.minidom import Node
 
 from tonnikala.expr import handle_text_node  # TODO: move this elsewhere.
-from tonnikala.ir.generate import BaseDOMIRGenerator
+from tonnikala.ir.generate import BaseDOMIRGenerator, is_conditional_comment
 from tonnikala.syntaxes.docparser import TonnikalaHTMLParser
 
 
@@ -130,20 +130,25 @@ class ChameleonIRGenerator(BaseDOMIRGenerator):
             return ir_node
 
         if node_t == Node.COMMENT_NODE:
+            if self.minify and not is_conditional_comment(dom_node.nodeValue):
+                return None
+
             ir_node = EscapedText("<!--" + dom_node.nodeValue + "-->")
             return ir_node
 
         raise ValueError("Unhandled node type %d" % node_t)
 
 
-def parse(filename, string, translatable=False):
+def parse(filename, string, translatable=False, minify=False):
     if translatable:
         raise ValueError("L10n not implemented for Chameleon templates")
 
     parser = TonnikalaHTMLParser(filename, string)
     parsed = parser.parse()
-    generator = ChameleonIRGenerator(parsed)
+    generator = ChameleonIRGenerator(parsed, minify=minify)
     tree = generator.generate_tree()
+    if minify:
+        tree = generator.collapse_whitespace(tree)
 
     tree = generator.flatten_element_nodes(tree)
     tree = generator.merge_text_nodes(tree)
@@ -7,6 +7,7 @@ from tonnikala.ir.nodes import (
     For,
     Define,
     Import,
+    Include,
     EscapedText,
     Block,
     Extends,
@@ -16,7 +17,7 @@ from tonnikala.ir.nodes import (
     EmptyAttrVal,
 )
 from ..expr import handle_text_node  # TODO: move this elsewhere.
-from ..ir.generate import BaseDOMIRGenerator
+from ..ir.generate import BaseDOMIRGenerator, is_conditional_comment
 from .docparser import TonnikalaHTMLParser
 
 
@@ -133,6 +134,7 @@ class TonnikalaIRGenerator(BaseDOMIRGenerator):
         make_control_node("for", For, "each")
         make_control_node("def", Define, "function")
         make_control_node("import", Import, "href", "alias")
+        make_control_node("include", Include, "href")
         make_control_node("with", With, "vars")
         make_control_node("vars", With, "names")
 
@@ -240,6 +242,9 @@ class TonnikalaIRGenerator(BaseDOMIRGenerator):
             return ir_node
 
         if node_t == Node.COMMENT_NODE:
+            if self.minify and not is_conditional_comment(dom_node.nodeValue):
+                return None
+
             ir_node = EscapedText("<!--" + dom_node.nodeValue + "-->")
             return ir_node
 
@@ -260,19 +265,26 @@ class TonnikalaIRGenerator(BaseDOMIRGenerator):
         )
 
 
-def parse(filename, string, translatable=False):
+def parse(filename, string, translatable=False, minify=False):
     parser = TonnikalaHTMLParser(filename, string)
     parsed = parser.parse()
     generator = TonnikalaIRGenerator(
-        document=parsed, translatable=translatable, filename=filename, source=string
+        document=parsed,
+        translatable=translatable,
+        filename=filename,
+        source=string,
+        minify=minify,
     )
     tree = generator.generate_tree()
+    if minify:
+        tree = generator.collapse_whitespace(tree)
+
     tree = generator.flatten_element_nodes(tree)
     tree = generator.merge_text_nodes(tree)
     return tree
 
 
-def parse_js(filename, string, translatable=False):
+def parse_js(filename, string, translatable=False, minify=False):
     parser = TonnikalaHTMLParser(filename, string)
     parsed = parser.parse()
     generator = TonnikalaIRGenerator(
@@ -281,8 +293,12 @@ def parse_js(filename, string, translatable=False):
         control_prefix="js",
         filename=filename,
         source=string,
+        minify=minify,
     )
     tree = generator.generate_tree()
+    if minify:
+        tree = generator.collapse_whitespace(tree)
+
     tree = generator.flatten_element_nodes(tree)
     tree = generator.merge_text_nodes(tree)
     return tree
@@ -0,0 +1,70 @@
+"""
+Writers for ``Template.render_to``
+"""
+
+import os
+
+
+def get_iov_max():
+    """
+    Return the maximum number of buffers that a single ``sendmsg`` call
+    accepts on this platform
+    """
+
+    try:
+        return os.sysconf("SC_IOV_MAX")
+    except (AttributeError, ValueError, OSError):
+        return 1024
+
+
+IOV_MAX = get_iov_max()
+
+
+class SocketWriter(object):
+    """
+    Writes the output fragments to a blocking socket, encoded in
+    ``encoding``, with scatter-gather ``sendmsg`` calls of up to
+    ``batch_size`` fragments each, so that the fragments are never
+    copied into a single string or bytes object.
+    """
+
+    def __init__(self, sock, encoding="UTF-8", batch_size=IOV_MAX):
+        self.sock = sock
+        self.encoding = encoding
+        self.batch_size = batch_size
+
+    def write(self, fragment):
+        self.writelines([fragment])
+
+    def writelines(self, fragments):
+        encoding = self.encoding
+        batch_size = self.batch_size
+        batch = []
+        for fragment in fragments:
+            if fragment:
+                batch.append(fragment.encode(encoding))
+                if len(batch) == batch_size:
+                    self.send(batch)
+                    batch = []
+
+        if batch:
+            self.send(batch)
+
+    def send(self, buffers):
+        """
+        Send all of the bytes-like ``buffers``, continuing after the
+        partially sent one when ``sendmsg`` sends only a part of them
+        """
+
+        sendmsg = self.sock.sendmsg
+        while True:
+            sent = sendmsg(buffers)
+            for i, buffer in enumerate(buffers):
+                if sent < len(buffer):
+                    break
+
+                sent -= len(buffer)
+            else:
+                return
+
+            buffers = [memoryview(buffers[i])[sent:]] + buffers[i + 1 :]